@@ -0,0 +1,341 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+# Approximate size of the UN consolidated list, used as the 1x scale.
+BASE_INDIVIDUALS = 730
+BASE_ENTITIES = 270
+
+SCENARIOS = ('parse', 'transform', 'full')
+
+# Headless start-up: interpreter start, importing risk_update and parsing the arguments. The GUI, HTTP and SQL
+# Server modules are only imported when used, so none of them may appear after a plain import.
+STARTUP_TARGET_SECONDS = 0.3
+STARTUP_RUNS = 7
+HEAVY_MODULES = ('tkinter', 'requests', 'sqlalchemy')
+
+LATIN_NAMES = ['MOHAMMED', 'ABDUL', 'AHMAD', 'ALI', 'HASSAN', 'IBRAHIM', 'YUSUF', 'OMAR', 'KHALID', 'SAID',
+               'IVAN', 'SERGEI', 'VIKTOR', 'KIM', 'PAK', 'RI', 'JONG', 'CHOL', 'ABU', 'BAKR', 'SALEH', 'JAMAL',
+               'FARUQ', 'HAJI', 'NASIR', 'RAHMAN', 'AZIZ', 'MUSA', 'ISA', 'ZAID']
+ORIGINAL_SCRIPT_NAMES = ['محمد عبد الله', 'أحمد علي', 'حسن إبراهيم', 'Иван Петров', 'Сергей Иванов', '김정철',
+                         '박영호', '李明', '王伟', 'عمر خالد', 'عبد الرحمن']
+COUNTRIES = ['Afghanistan', 'Iraq', 'Somalia', 'Yemen', 'Libya', 'Democratic People\'s Republic of Korea',
+             'Syrian Arab Republic', 'Sudan', 'Pakistan', 'Mali']
+CITIES = ['Kabul', 'Baghdad', 'Mogadishu', 'Sanaa', 'Tripoli', 'Pyongyang', 'Damascus', 'Khartoum', 'Quetta']
+LIST_TYPES = ['UN List', 'DPRK', 'Al-Qaida', 'Taliban', 'Libya', 'Somalia']
+TITLES = ['Maulavi', 'Haji', 'Mullah', 'Sheikh', 'Dr.', 'General']
+DESIGNATIONS = ['Minister of Interior', 'Commander', 'Financier', 'Deputy Minister', 'Governor']
+DOCUMENT_TYPES = ['Passport', 'National Identification Number', 'Identification Card', 'Other']
+ALIAS_QUALITIES = ['Good', 'Low', 'a.k.a.', 'f.k.a.']
+DATE_TYPES = ['EXACT', 'APPROXIMATELY', 'BETWEEN']
+
+
+def element(tag, value):
+    return f"<{tag}>{escape(str(value))}</{tag}>" if value is not None else ''
+
+
+def maybe(rng, probability, value):
+    return value if rng.random() < probability else None
+
+
+def value_list(rng, tag, choices, max_values, probability=0.7):
+    # Sanctions lists often carry an empty wrapper element rather than omitting it.
+    if rng.random() > probability:
+        return f"<{tag}/>"
+    values = ''.join(element('VALUE', rng.choice(choices)) for _ in range(rng.randint(1, max_values)))
+    return f"<{tag}>{values}</{tag}>"
+
+
+def child_group(rng, tag, fields, max_children, probability=0.6):
+    if rng.random() > probability:
+        return f"<{tag}/>" if rng.random() < 0.5 else ''
+    return ''.join(f"<{tag}>" + ''.join(element(name, value) for name, value in fields(rng)) + f"</{tag}>"
+                   for _ in range(rng.randint(1, max_children)))
+
+
+def alias_fields(rng):
+    return [('QUALITY', rng.choice(ALIAS_QUALITIES)), ('ALIAS_NAME', ' '.join(rng.sample(LATIN_NAMES, 3))),
+            ('NOTE', maybe(rng, 0.1, 'Alias reported by a Member State')),
+            ('DATE_OF_BIRTH', maybe(rng, 0.1, f"{rng.randint(1950, 1995)}")),
+            ('CITY_OF_BIRTH', maybe(rng, 0.05, rng.choice(CITIES))),
+            ('COUNTRY_OF_BIRTH', maybe(rng, 0.05, rng.choice(COUNTRIES)))]
+
+
+def address_fields(rng):
+    return [('STREET', maybe(rng, 0.3, f"{rng.randint(1, 200)} Street")),
+            ('CITY', maybe(rng, 0.6, rng.choice(CITIES))),
+            ('STATE_PROVINCE', maybe(rng, 0.3, 'Province')),
+            ('ZIP_CODE', maybe(rng, 0.1, rng.randint(10000, 99999))),
+            ('COUNTRY', maybe(rng, 0.9, rng.choice(COUNTRIES))),
+            ('NOTE', maybe(rng, 0.1, 'Previous address'))]
+
+
+def date_of_birth_fields(rng):
+    date_type = rng.choice(DATE_TYPES)
+    year = rng.randint(1940, 1995)
+    return [('TYPE_OF_DATE', date_type),
+            ('DATE', f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" if date_type == 'EXACT' else None),
+            ('YEAR', year if date_type == 'APPROXIMATELY' else None),
+            ('FROM_YEAR', year if date_type == 'BETWEEN' else None),
+            ('TO_YEAR', year + 3 if date_type == 'BETWEEN' else None)]
+
+
+def place_of_birth_fields(rng):
+    return [('CITY', maybe(rng, 0.7, rng.choice(CITIES))), ('STATE_PROVINCE', maybe(rng, 0.3, 'Province')),
+            ('COUNTRY', maybe(rng, 0.9, rng.choice(COUNTRIES)))]
+
+
+def document_fields(rng):
+    return [('TYPE_OF_DOCUMENT', rng.choice(DOCUMENT_TYPES)),
+            ('NUMBER', maybe(rng, 0.8, rng.randint(10 ** 6, 10 ** 9))),
+            ('ISSUING_COUNTRY', maybe(rng, 0.5, rng.choice(COUNTRIES))),
+            ('DATE_OF_ISSUE', maybe(rng, 0.3, f"{rng.randint(1990, 2020)}-01-01")),
+            ('CITY_OF_ISSUE', maybe(rng, 0.2, rng.choice(CITIES))),
+            ('COUNTRY_OF_ISSUE', maybe(rng, 0.2, rng.choice(COUNTRIES))),
+            ('NOTE', maybe(rng, 0.2, 'Issued under an alias'))]
+
+
+def common_fields(rng, dataid):
+    return element('DATAID', dataid) + element('VERSIONNUM', rng.randint(1, 3))
+
+
+def listing_fields(rng, prefix, number):
+    return (element('UN_LIST_TYPE', rng.choice(LIST_TYPES)) + element('REFERENCE_NUMBER', f"{prefix}.{number:03d}")
+            + element('LISTED_ON', f"{rng.randint(2001, 2023)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"))
+
+
+def generate_individual(rng, number):
+    names = rng.sample(LATIN_NAMES, 4)
+    return ("<INDIVIDUAL>" + common_fields(rng, 6900000 + number)
+            + element('FIRST_NAME', names[0]) + element('SECOND_NAME', names[1])
+            + element('THIRD_NAME', maybe(rng, 0.5, names[2])) + element('FOURTH_NAME', maybe(rng, 0.1, names[3]))
+            + listing_fields(rng, 'QDi', number) + element('GENDER', maybe(rng, 0.6, rng.choice(['Male', 'Female'])))
+            + element('NAME_ORIGINAL_SCRIPT', maybe(rng, 0.4, rng.choice(ORIGINAL_SCRIPT_NAMES)))
+            + element('COMMENTS1', maybe(rng, 0.7, 'Review pursuant to Security Council resolution concluded.'))
+            + value_list(rng, 'TITLE', TITLES, 2, 0.3) + value_list(rng, 'DESIGNATION', DESIGNATIONS, 3, 0.4)
+            + value_list(rng, 'NATIONALITY', COUNTRIES, 2) + value_list(rng, 'LIST_TYPE', LIST_TYPES, 1, 1.0)
+            + value_list(rng, 'LAST_DAY_UPDATED', [f"20{y:02d}-01-01" for y in range(5, 24)], 4, 0.6)
+            + child_group(rng, 'INDIVIDUAL_ALIAS', alias_fields, 6, 0.8)
+            + child_group(rng, 'INDIVIDUAL_ADDRESS', address_fields, 3)
+            + child_group(rng, 'INDIVIDUAL_DATE_OF_BIRTH', date_of_birth_fields, 3, 0.9)
+            + child_group(rng, 'INDIVIDUAL_PLACE_OF_BIRTH', place_of_birth_fields, 2, 0.7)
+            + child_group(rng, 'INDIVIDUAL_DOCUMENT', document_fields, 3, 0.4)
+            + element('SORT_KEY', '') + element('SORT_KEY_LAST_MOD', '') + "</INDIVIDUAL>")
+
+
+def generate_entity(rng, number):
+    name = ' '.join(rng.sample(LATIN_NAMES, 2)) + ' ' + rng.choice(['FOUNDATION', 'TRADING COMPANY', 'BRIGADE'])
+    return ("<ENTITY>" + common_fields(rng, 7900000 + number) + element('FIRST_NAME', name)
+            + listing_fields(rng, 'QDe', number)
+            + element('NAME_ORIGINAL_SCRIPT', maybe(rng, 0.2, rng.choice(ORIGINAL_SCRIPT_NAMES)))
+            + element('COMMENTS1', maybe(rng, 0.6, 'Listed pursuant to paragraph 2 of resolution.'))
+            + value_list(rng, 'LIST_TYPE', LIST_TYPES, 1, 1.0)
+            + value_list(rng, 'LAST_DAY_UPDATED', [f"20{y:02d}-01-01" for y in range(5, 24)], 3, 0.5)
+            + child_group(rng, 'ENTITY_ALIAS', alias_fields, 8, 0.7)
+            + child_group(rng, 'ENTITY_ADDRESS', address_fields, 4, 0.7)
+            + element('SORT_KEY', '') + element('SORT_KEY_LAST_MOD', '') + "</ENTITY>")
+
+
+def generate_list(path, scale=1, seed=1):
+    rng = random.Random(seed)
+    individuals = int(BASE_INDIVIDUALS * scale)
+    entities = int(BASE_ENTITIES * scale)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<CONSOLIDATED_LIST xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'dateGenerated="2024-01-01T00:00:00">\n<INDIVIDUALS>\n')
+        for number in range(individuals):
+            f.write(generate_individual(rng, number) + '\n')
+        f.write('</INDIVIDUALS>\n<ENTITIES>\n')
+        for number in range(entities):
+            f.write(generate_entity(rng, number) + '\n')
+        f.write('</ENTITIES>\n</CONSOLIDATED_LIST>\n')
+    return individuals + entities
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_scenario(scenario, path, load_options):
+    # Runs in a child process so peak RSS covers this scenario only.
+    import risk_update
+
+    statements = 0
+    records = 0
+    start = time.perf_counter()
+    if scenario in ('parse', 'transform'):
+        for tag, record in risk_update.iter_records(path):
+            if scenario == 'transform':
+                risk_update.RECORD_PARSERS[tag](record)
+            records += 1
+    else:
+        class CountingSQLiteManager(risk_update.SQLiteManager):
+            def connect_to_database(self, *args, **kwargs):
+                super().connect_to_database(*args, **kwargs)
+
+                def count_statement(statement):
+                    nonlocal statements
+                    statements += 1
+                self.conn.set_trace_callback(count_statement)
+
+        records = sum(risk_update.count_records(path).values())
+        with tempfile.TemporaryDirectory() as directory:
+            db_details = {'backend': 'sqlite', 'database': os.path.join(directory, 'benchmark.db')}
+            start = time.perf_counter()
+            result = risk_update.process_data(db_details, input_file=path, cache_dir=None,
+                                              db_manager=CountingSQLiteManager(), **load_options)
+            if result.status != 'success':
+                raise RuntimeError(result.message)
+    elapsed = time.perf_counter() - start
+    return {
+        'scenario': scenario,
+        'records': records,
+        'seconds': round(elapsed, 3),
+        'records_per_second': round(records / elapsed, 1) if elapsed else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'statements': statements if scenario == 'full' else None,
+        'statements_per_record': round(statements / records, 2) if scenario == 'full' and records else None
+    }
+
+
+def run_in_subprocess(scenario, path, load_options):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-scenario', scenario, path,
+                             '--load-options', json.dumps(load_options)],
+                            check=True, capture_output=True, text=True, cwd=tempfile.gettempdir())
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def measure_startup(runs=STARTUP_RUNS):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(directory, 'risk_update.py'), '--headless', '--help'],
+                       check=True, capture_output=True, cwd=tempfile.gettempdir())
+        timings.append(time.perf_counter() - start)
+    probe = subprocess.run([sys.executable, '-c', f"import json, sys, risk_update; print(json.dumps("
+                            f"[name for name in {HEAVY_MODULES!r} if name in sys.modules]))"],
+                           check=True, capture_output=True, text=True, cwd=directory)
+    timings.sort()
+    return {
+        'runs': runs,
+        'median_seconds': round(timings[runs // 2], 3),
+        'min_seconds': round(timings[0], 3),
+        'heavy_modules': json.loads(probe.stdout)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['scale'], r['scenario']): r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['scale'], result['scenario']))
+        if not previous or not previous['records_per_second']:
+            continue
+        if result['records_per_second'] < previous['records_per_second'] * (1 - tolerance):
+            regressions.append(f"{result['scenario']} {result['scale']}x: {result['records_per_second']} records/s "
+                               f"vs {previous['records_per_second']} in the baseline")
+        if result['statements'] and previous.get('statements') and result['statements'] > previous['statements']:
+            regressions.append(f"{result['scenario']} {result['scale']}x: {result['statements']} statements "
+                               f"vs {previous['statements']} in the baseline")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark parsing and loading of synthetic consolidated lists.")
+    parser.add_argument('--scales', default='1,10,100', help="Comma-separated multiples of the real list size")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Any of parse, transform, full")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the synthetic list generator")
+    parser.add_argument('--data-dir', default='benchmark_data', help="Where generated lists are kept and reused")
+    parser.add_argument('--output', help="JSON results file (default: benchmark_<timestamp>.json)")
+    parser.add_argument('--baseline', help="Earlier results file; exit with status 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed throughput drop against the baseline")
+    parser.add_argument('--writer', choices=['batch', 'row'], default='batch', help="Writer for the full scenario")
+    parser.add_argument('--batch-size', type=int, default=500, help="Batch size for the batch writer")
+    parser.add_argument('--generate-only', action='store_true', help="Only write the synthetic lists")
+    parser.add_argument('--startup-target', type=float, default=STARTUP_TARGET_SECONDS,
+                        help="Maximum median headless start-up time in seconds (default: %(default)s)")
+    parser.add_argument('--run-scenario', nargs=2, metavar=('SCENARIO', 'PATH'), help=argparse.SUPPRESS)
+    parser.add_argument('--load-options', default='{}', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(*args.run_scenario, json.loads(args.load_options))))
+        return 0
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    scales = [float(scale) if '.' in scale else int(scale) for scale in args.scales.split(',')]
+    scenarios = [scenario for scenario in args.scenarios.split(',') if scenario]
+    load_options = {'writer': args.writer, 'batch_size': args.batch_size}
+    results = []
+    for scale in scales:
+        path = os.path.abspath(os.path.join(args.data_dir, f"consolidated_{scale}x_seed{args.seed}.xml"))
+        if not os.path.exists(path):
+            start = time.perf_counter()
+            records = generate_list(path, scale, args.seed)
+            print(f"Generated {records} records ({os.path.getsize(path) / 1e6:.1f} MB) in "
+                  f"{time.perf_counter() - start:.1f}s: {path}", file=sys.stderr)
+        if args.generate_only:
+            continue
+        for scenario in scenarios:
+            result = run_in_subprocess(scenario, path, load_options)
+            result['scale'] = scale
+            results.append(result)
+            print(f"{scenario:>9} {scale:>5}x  {result['records_per_second']:>10} records/s  "
+                  f"{result['peak_rss_mb']:>7} MB peak RSS"
+                  + (f"  {result['statements_per_record']} statements/record" if result['statements'] else ''),
+                  file=sys.stderr)
+    if args.generate_only:
+        return 0
+
+    startup = measure_startup()
+    print(f"  startup  {startup['median_seconds']:.3f}s median headless start-up (target {args.startup_target}s)"
+          + (f", imports {', '.join(startup['heavy_modules'])}" if startup['heavy_modules'] else ''), file=sys.stderr)
+    report = {
+        'generated': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'load_options': load_options,
+        'seed': args.seed,
+        'startup': startup,
+        'results': results
+    }
+    output = args.output or f"benchmark_{datetime.now().strftime('%d_%m_%Y_%H_%M')}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+    regressions = compare_with_baseline(results, args.baseline, args.tolerance) if args.baseline else []
+    if startup['median_seconds'] > args.startup_target:
+        regressions.append(f"headless start-up takes {startup['median_seconds']}s, over the "
+                           f"{args.startup_target}s target")
+    if startup['heavy_modules']:
+        regressions.append(f"importing risk_update loads {', '.join(startup['heavy_modules'])}")
+    for regression in regressions:
+        print(f"Regression: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
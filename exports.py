@@ -0,0 +1,144 @@
+import csv
+import json
+import os
+import tempfile
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+MANIFEST_NAME = 'manifest.json'
+PARQUET_ROW_GROUP_SIZE = 50000
+
+# One file per table, named after the table, plus a manifest listing the tables, their columns and row counts.
+# Column kinds are 'int', 'binary' or 'text'. The text formats write binary values as hex. A NULL is an empty
+# CSV field, the same as SQL Server's BULK INSERT reads it, so an empty string also reads back as NULL.
+
+
+def table_path(directory, table, file_format):
+    return os.path.join(directory, f"{table}.{file_format}")
+
+
+class CsvTableWriter:
+    def __init__(self, path, columns, kinds):
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file, lineterminator='\n')
+        self.writer.writerow(columns)
+        self.binary = [position for position, column in enumerate(columns) if kinds[column] == 'binary']
+
+    def write(self, rows):
+        for row in rows:
+            row = ['' if value is None else value for value in row]
+            for position in self.binary:
+                if row[position]:
+                    row[position] = row[position].hex()
+            self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesTableWriter:
+    def __init__(self, path, columns, kinds):
+        self.file = open(path, 'w', encoding='utf-8', newline='\n')
+        self.columns = columns
+        self.binary = [position for position, column in enumerate(columns) if kinds[column] == 'binary']
+
+    def write(self, rows):
+        for row in rows:
+            if self.binary:
+                row = list(row)
+                for position in self.binary:
+                    if row[position] is not None:
+                        row[position] = row[position].hex()
+            self.file.write(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetTableWriter:
+    # pyarrow is only needed for this format, so it is imported here rather than at module load.
+    def __init__(self, path, columns, kinds):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("The parquet export format needs pyarrow (pip install pyarrow)")
+        self.pyarrow = pyarrow
+        types = {'int': pyarrow.int64(), 'binary': pyarrow.binary(), 'text': pyarrow.string()}
+        self.schema = pyarrow.schema([(column, types[kinds[column]]) for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.rows = []
+
+    def write(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= PARQUET_ROW_GROUP_SIZE:
+            self.write_row_group()
+
+    def write_row_group(self):
+        if self.rows:
+            columns = list(zip(*self.rows))
+            self.writer.write_table(self.pyarrow.Table.from_arrays(
+                [self.pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+                schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.write_row_group()
+        self.writer.close()
+
+
+TABLE_WRITERS = {
+    'csv': CsvTableWriter,
+    'jsonl': JsonLinesTableWriter,
+    'parquet': ParquetTableWriter
+}
+
+
+def open_table_writer(directory, table, columns, kinds, file_format):
+    return TABLE_WRITERS[file_format](table_path(directory, table, file_format), columns, kinds)
+
+
+def read_table(path, file_format, kinds):
+    # Returns the file's columns and an iterator over its rows, with values decoded back to their kinds.
+    if file_format == 'parquet':
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path)
+        return table.column_names, zip(*(column.to_pylist() for column in table.columns))
+    if file_format == 'csv':
+        f = open(path, encoding='utf-8', newline='')
+        rows = csv.reader(f)
+        columns = next(rows)
+        decoders = [(int if kinds[column] == 'int' else bytes.fromhex if kinds[column] == 'binary' else None)
+                    for column in columns]
+        return columns, decode_rows(f, ([value or None for value in row] for row in rows), decoders)
+    f = open(path, encoding='utf-8')
+    first = f.readline()
+    columns = list(json.loads(first)) if first else []
+    decoders = [bytes.fromhex if kinds[column] == 'binary' else None for column in columns]
+    f.seek(0)
+    return columns, decode_rows(f, (list(json.loads(line).values()) for line in f), decoders)
+
+
+def decode_rows(f, rows, decoders):
+    with f:
+        decoded = [(position, decoder) for position, decoder in enumerate(decoders) if decoder is not None]
+        for row in rows:
+            for position, decoder in decoded:
+                if row[position] is not None:
+                    row[position] = decoder(row[position])
+            yield row
+
+
+def write_manifest(directory, manifest):
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, os.path.join(directory, MANIFEST_NAME))
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as f:
+        return json.load(f)
@@ -1,63 +1,404 @@
-import tkinter as tk
 import xml.etree.ElementTree as ET
-from tkinter import messagebox, ttk
 from datetime import datetime
-import requests
-import ssl
-from urllib3 import poolmanager
-from requests.adapters import HTTPAdapter
+import hashlib
+import json
+import mmap
 import os
+import queue
+import random
+import re
+import signal
+import sqlite3
+import sys
+import tempfile
+import threading
 import time
 import logging
-import sqlalchemy as sq
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+import argparse
+from screening import ScreeningIndex, name_tokens, normalize_document_number, normalize_name
+from snapshots import SnapshotStore
+from sources import SOURCE_ADAPTERS, unique
+from exports import EXPORT_FORMATS, open_table_writer, read_table, table_path, write_manifest
 
-logging.basicConfig(filename=f"aml_risk_update_{datetime.now().strftime('%d_%m_%Y_%H_%M')}.log", level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+# tkinter, requests and sqlalchemy are imported where they are first needed: the GUI, the first download and
+# the first SQL Server connection. A headless SQLite load from a local file never imports them.
 
 
-class SSLAdapter(HTTPAdapter):
-    def init_poolmanager(self, *args, **kwargs):
-        context = ssl.create_default_context()
-        context.options |= ssl.OP_LEGACY_SERVER_CONNECT
-        kwargs['ssl_context'] = context
-        return super().init_poolmanager(*args, **kwargs)
+MAX_STATEMENT_PARAMETERS = 2000
+MAX_VALUES_ROWS = 1000
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def rows_per_statement(params_per_row):
+    return max(1, min(MAX_VALUES_ROWS, MAX_STATEMENT_PARAMETERS // params_per_row))
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    # Exponential backoff with jitter: half of the delay is fixed, the other half random, so clients that failed
+    # together do not all retry at the same moment.
+    delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+# Errors worth retrying: lost or refused connections, timeouts, deadlocks, lock timeouts, and the failover and
+# throttling errors of Azure SQL. SQL Server reports its error number in parentheses in the ODBC message.
+TRANSIENT_SQLSTATES = {'08001', '08S01', '08007', 'HYT00', 'HYT01', '40001'}
+TRANSIENT_ERROR_NUMBERS = {-2, 20, 64, 233, 1205, 1222, 4060, 4221, 10053, 10054, 10060, 10928, 10929, 40143,
+                           40197, 40501, 40540, 40613, 49918, 49919, 49920}
+MAX_PREPARED_CURSORS = 64
 
 
 class DatabaseManager:
+    backend = 'mssql'
+    shadow_schema = 'aml_shadow'
+    previous_schema = 'aml_previous'
+    max_writers = None
+
     def __init__(self):
+        self.engine = None
+        self.engine_url = None
+        self.pool_size = 5
         self.conn = None
         self.cursor = None
+        self.lookup_cache = None
+        self.metrics = None
+        self.table_names = {}
+        self.statements = {}
+        self.prepared = OrderedDict()
+        self.retry_delay = 1.0
+
+    def table_name(self, table):
+        return self.table_names.get(table, table)
+
+    def statement(self, kind, table, columns):
+        # The per-row statements only vary by kind, physical table and columns, so their text is built once.
+        key = (kind, self.table_name(table), tuple(columns))
+        sql = self.statements.get(key)
+        if sql is None:
+            sql = self.statements[key] = getattr(self, f"{kind}_sql")(key[1], key[2])
+        return sql
+
+    def rows_statement(self, kind, table, columns, row_count):
+        # The multi-row VALUES statements also vary by row count. Full chunks all have the same count, so a load
+        # uses a handful of texts per table.
+        key = (kind, table, tuple(columns), row_count)
+        sql = self.statements.get(key)
+        if sql is None:
+            sql = self.statements[key] = getattr(self, f"{kind}_sql")(table, columns, row_count)
+        return sql
+
+    def prepared_cursor(self, sql):
+        # pyodbc keeps the last statement it prepared on each cursor. A cursor per hot statement therefore runs
+        # repeated executions on the prepared handle (sp_execute) instead of preparing the text again every time.
+        cursor = self.prepared.get(sql)
+        if cursor is None:
+            if len(self.prepared) >= MAX_PREPARED_CURSORS:
+                self.prepared.popitem(last=False)[1].close()
+            cursor = self.prepared[sql] = self.conn.cursor()
+        else:
+            self.prepared.move_to_end(sql)
+        return cursor
+
+    def is_transient_error(self, error):
+        # Follows SQLAlchemy's wrapped DBAPI error and explicit causes down to the driver error.
+        while error is not None:
+            args = getattr(error, 'args', ())
+            if args and isinstance(args[0], str) and args[0] in TRANSIENT_SQLSTATES:
+                return True
+            if {int(number) for number in re.findall(r'\((-?\d+)\)', str(error))} & TRANSIENT_ERROR_NUMBERS:
+                return True
+            error = getattr(error, 'orig', None) or error.__cause__
+        return False
+
+    def select_id_sql(self, table, columns):
+        return f"SELECT ID FROM {table} WHERE {' AND '.join(f'{column} = ?' for column in columns)}"
+
+    def select_null_id_sql(self, table, columns):
+        return f"SELECT ID FROM {table} WHERE {columns[0]} IS NULL"
+
+    def insert_sql(self, table, columns):
+        return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    def insert_returning_id_sql(self, table, columns):
+        return (f"INSERT INTO {table} ({', '.join(columns)}) OUTPUT Inserted.ID "
+                f"VALUES ({', '.join('?' * len(columns))})")
+
+    def use_shadow_tables(self, enabled=True):
+        self.table_names = {f"dbo.{table}": self.shadow_table_name(table) for table in TABLE_SCHEMAS} \
+            if enabled else {}
 
     def connect_to_database(self, server=None, database=None, user=None, password=None, driver="ODBC Driver 17 for SQL Server", port="1433", max_attempts=3):
         if not all([server, database, user, password]):
             raise ValueError("Database connection details are incomplete")
 
+        import sqlalchemy as sq
+
+        error = None
         for i in range(max_attempts):
             try:
                 connection_string = (
                     f"DRIVER={{{driver}}};SERVER={server},{port};DATABASE={database};UID={user};PWD={password}"
                 )
                 connection_url = sq.engine.URL.create("mssql+pyodbc", query={"odbc_connect": connection_string})
-                engine = sq.create_engine(connection_url)
-                self.conn = engine.raw_connection()
+                # Keep the engine (and its pooled connections) between runs of a long-lived process.
+                if self.engine is None or self.engine_url != connection_url or \
+                        self.engine.pool.size() < self.pool_size:
+                    self.dispose()
+                    self.engine = sq.create_engine(connection_url, pool_pre_ping=True, pool_size=self.pool_size)
+                    self.engine_url = connection_url
+                self.conn = self.engine.raw_connection()
                 self.cursor = self.conn.cursor()
                 return
             except Exception as e:
+                error = e
                 logging.error(f"Database connection attempt {i + 1} failed: {e}")
-                time.sleep(5)
-        raise Exception("Failed to connect to the database after maximum attempts")
+                # A wrong password or a missing driver fails the same way every time.
+                if i + 1 == max_attempts or not self.is_transient_error(e):
+                    break
+                time.sleep(backoff_delay(i + 1, self.retry_delay))
+        raise Exception(f"Failed to connect to the database after {i + 1} attempt(s): {error}")
+
+    def select_existing_ids(self, table, columns, values_list):
+        table = self.table_name(table)
+        # Resolves many get-or-create keys in one round trip per chunk, letting the server apply its own
+        # collation rules exactly as the per-row "WHERE column = ?" lookup does.
+        found = {}
+        null_key = (None,) * len(columns)
+        if null_key in values_list:
+            self.cursor.execute(f"SELECT TOP 1 ID FROM {table} WHERE {columns[0]} IS NULL ORDER BY ID")
+            result = self.cursor.fetchone()
+            if result:
+                found[null_key] = result[0]
+            values_list = [values for values in values_list if values != null_key]
+
+        for chunk in chunked(values_list, rows_per_statement(len(columns) + 1)):
+            sql = self.rows_statement('select_existing', table, columns, len(chunk))
+            params = [param for rn, values in enumerate(chunk) for param in (rn, *values)]
+            cursor = self.prepared_cursor(sql)
+            cursor.execute(sql, params)
+            for rn, row_id in cursor.fetchall():
+                found[chunk[rn]] = row_id
+        return found
+
+    def select_existing_sql(self, table, columns, row_count):
+        rows_sql = ', '.join(['(' + ', '.join('?' * (len(columns) + 1)) + ')'] * row_count)
+        conditions = ' AND '.join(f"t.{column} = s.{column}" for column in columns)
+        return (f"SELECT s.RN, m.ID FROM (VALUES {rows_sql}) AS s ({', '.join(['RN'] + list(columns))}) "
+                f"CROSS APPLY (SELECT TOP 1 t.ID FROM {table} AS t WHERE {conditions} ORDER BY t.ID) AS m")
+
+    def insert_rows_returning_ids(self, table, columns, rows):
+        # MERGE ... ON 1 = 0 always inserts, and unlike INSERT its OUTPUT clause can return the source row
+        # number, so the generated IDs map back to their rows regardless of insert order.
+        table = self.table_name(table)
+        ids = []
+        for chunk in chunked(rows, rows_per_statement(len(columns) + 1)):
+            sql = self.rows_statement('insert_rows', table, columns, len(chunk))
+            params = [param for rn, values in enumerate(chunk) for param in (rn, *values)]
+            cursor = self.prepared_cursor(sql)
+            cursor.execute(sql, params)
+            chunk_ids = dict(cursor.fetchall())
+            ids.extend(chunk_ids[rn] for rn in range(len(chunk)))
+        return ids
+
+    def insert_rows_sql(self, table, columns, row_count):
+        rows_sql = ', '.join(['(' + ', '.join('?' * (len(columns) + 1)) + ')'] * row_count)
+        return (f"MERGE INTO {table} AS t USING (VALUES {rows_sql}) AS s ({', '.join(['RN'] + list(columns))}) "
+                f"ON 1 = 0 WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) "
+                f"VALUES ({', '.join(f's.{column}' for column in columns)}) OUTPUT s.RN, Inserted.ID;")
+
+    def insert_returning_id(self, table, columns, values):
+        sql = self.statement('insert_returning_id', table, columns)
+        cursor = self.prepared_cursor(sql)
+        cursor.execute(sql, values)
+        return cursor.fetchone()[0]
+
+    def merge_sql(self, table, columns, row_count):
+        # The no-op update on a match lets OUTPUT report the ID of existing rows too, so one statement resolves
+        # every row. A NULL hash never matches and is always inserted.
+        source_columns = ', '.join(['RN', 'ROW_HASH'] + columns)
+        rows_sql = ', '.join(['(' + ', '.join('?' * (len(columns) + 2)) + ')'] * row_count)
+        return (f"MERGE INTO {table} WITH (HOLDLOCK) AS t USING (VALUES {rows_sql}) AS s ({source_columns}) "
+                f"ON t.ROW_HASH = s.ROW_HASH "
+                f"WHEN MATCHED THEN UPDATE SET t.ROW_HASH = s.ROW_HASH "
+                f"WHEN NOT MATCHED THEN INSERT (ROW_HASH, {', '.join(columns)}) "
+                f"VALUES (s.ROW_HASH, {', '.join(f's.{column}' for column in columns)}) "
+                f"OUTPUT s.RN, Inserted.ID;")
+
+    def merge_rows_returning_ids(self, table, columns, rows, hashes):
+        # Get-or-create for the ROW_HASH tables: one MERGE per chunk, keyed on the unique row hash. Hashes must
+        # be unique within a call.
+        table = self.table_name(table)
+        ids = []
+        chunk_size = rows_per_statement(len(columns) + 2)
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            sql = self.rows_statement('merge', table, columns, len(chunk))
+            params = [param for rn, (values, row_hash) in enumerate(zip(chunk, hashes[start:start + chunk_size]))
+                      for param in (rn, row_hash, *values)]
+            cursor = self.prepared_cursor(sql)
+            cursor.execute(sql, params)
+            chunk_ids = dict(cursor.fetchall())
+            ids.extend(chunk_ids[rn] for rn in range(len(chunk)))
+        return ids
+
+    def column_names(self, table):
+        self.cursor.execute("SELECT name FROM sys.columns WHERE object_id = OBJECT_ID(?) ORDER BY column_id",
+                            (self.table_name(table),))
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def insert_file_rows(self, table, path, file_format, kinds, chunk_size=10000):
+        columns, rows = read_table(path, file_format, kinds)
+        insert_sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                self.cursor.executemany(insert_sql, chunk)
+                chunk = []
+        if chunk:
+            self.cursor.executemany(insert_sql, chunk)
+
+    def bulk_load(self, table, path, file_format, kinds, server_path=None):
+        # BULK INSERT reads the file on the server, so server_path is where the server sees it. The other formats
+        # are sent as array-bound executemany batches with the exported IDs.
+        table = self.table_name(table)
+        if file_format == 'csv':
+            location = (server_path or os.path.abspath(path)).replace("'", "''")
+            self.cursor.execute(f"BULK INSERT {table} FROM '{location}' WITH (FORMAT = 'CSV', FIRSTROW = 2, "
+                                f"CODEPAGE = '65001', ROWTERMINATOR = '0x0a', KEEPIDENTITY, KEEPNULLS, TABLOCK)")
+        else:
+            self.cursor.execute(f"SET IDENTITY_INSERT {table} ON")
+            self.insert_file_rows(table, path, file_format, kinds)
+            self.cursor.execute(f"SET IDENTITY_INSERT {table} OFF")
+        # Explicit IDs leave the identity seed behind; move it past the loaded rows.
+        self.cursor.execute(f"DBCC CHECKIDENT ('{table}', RESEED) WITH NO_INFOMSGS")
+
+    def add_row_hash_columns(self):
+        # Upgrades tables created before ROW_HASH existed; returns the tables whose rows need a backfill.
+        tables = [table for table in TABLE_SCHEMAS if f"dbo.{table}" in ROW_HASH_TABLES]
+        self.cursor.execute("SELECT " + ', '.join(
+            f"CASE WHEN OBJECT_ID('AMLDatabase.dbo.{table}', 'U') IS NOT NULL AND "
+            f"COL_LENGTH('AMLDatabase.dbo.{table}', 'ROW_HASH') IS NULL THEN 1 ELSE 0 END" for table in tables))
+        upgraded = [table for table, missing in zip(tables, self.cursor.fetchone()) if missing]
+        for table in upgraded:
+            self.cursor.execute(f"ALTER TABLE AMLDatabase.dbo.{table} ADD ROW_HASH {ROW_HASH_COLUMN[1]} NULL")
+        return upgraded
+
+    def create_index_sql(self, index, qualified_name, name=None):
+        name = name or index.name
+        return (f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE object_id = OBJECT_ID('{qualified_name}') "
+                f"AND name = '{name}')\n"
+                f"    CREATE {'UNIQUE ' if index.unique else ''}INDEX {name} ON {qualified_name} "
+                f"({', '.join(index.columns)}){f' WHERE {index.where}' if index.where else ''};")
+
+    def create_table_sql(self, qualified_name, columns, primary_key=True, indent='    '):
+        column_lines = ',\n'.join(
+            [f"{indent}    ID INT IDENTITY(1,1) {'PRIMARY KEY' if primary_key else 'NOT NULL'}"] +
+            [f"{indent}    {column} {column_type}" for column, column_type in columns] +
+            [f"{indent}    [Inserted] [datetime] NULL DEFAULT (getdate())"])
+        return f"{indent}CREATE TABLE {qualified_name} (\n{column_lines}\n{indent});"
+
+    def create_tables_script(self):
+        statements = ["USE AMLDatabase;"]
+        for table in TABLE_SCHEMAS:
+            statements.append(
+                f"IF OBJECT_ID('dbo.{table}', 'U') IS NULL\n"
+                f"BEGIN\n"
+                f"{self.create_table_sql(f'AMLDatabase.dbo.{table}', table_columns(table))}\n"
+                f"END;")
+        statements += [self.create_index_sql(index, f"dbo.{index.table}") for index in TABLE_INDEXES]
+        return '\n\n'.join(statements)
+
+    def execute_script(self, script):
+        self.cursor.execute(script)
+
+    def truncate_table_sql(self, table):
+        return f"TRUNCATE TABLE AMLDatabase.dbo.{table}"
+
+    def shadow_table_name(self, table):
+        return f"{self.shadow_schema}.{table}"
+
+    def prepare_shadow_tables(self):
+        # Shadow tables start as heaps so the load only appends rows; the primary keys and the record indexes
+        # are added by build_shadow_indexes once the data is in. The ROW_HASH indexes are needed by the load
+        # itself and are created up front.
+        statements = [f"IF SCHEMA_ID('{schema}') IS NULL EXEC('CREATE SCHEMA {schema}');"
+                      for schema in (self.shadow_schema, self.previous_schema)]
+        for table in TABLE_SCHEMAS:
+            shadow_table = self.shadow_table_name(table)
+            statements.append(f"IF OBJECT_ID('{shadow_table}', 'U') IS NOT NULL DROP TABLE {shadow_table};")
+            statements.append(self.create_table_sql(shadow_table, table_columns(table), primary_key=False,
+                                                    indent=''))
+        statements += [self.create_index_sql(index, self.shadow_table_name(index.table))
+                       for index in TABLE_INDEXES if index.unique]
+        self.execute_script('\n'.join(statements))
+        self.conn.commit()
+
+    def build_shadow_indexes(self):
+        for table in TABLE_SCHEMAS:
+            self.cursor.execute(
+                f"ALTER TABLE {self.shadow_table_name(table)} ADD CONSTRAINT PK_{table} PRIMARY KEY CLUSTERED (ID)")
+        for index in TABLE_INDEXES:
+            if not index.unique:
+                self.cursor.execute(self.create_index_sql(index, self.shadow_table_name(index.table)))
+        self.conn.commit()
+
+    def swap_shadow_tables(self):
+        # Schema transfers are metadata-only and run in one transaction, so readers see either the old or
+        # the new generation. The old one is kept in the previous schema for restore_previous_tables.
+        statements = []
+        for table in TABLE_SCHEMAS:
+            previous_table = f"{self.previous_schema}.{table}"
+            statements += [
+                f"IF OBJECT_ID('{previous_table}', 'U') IS NOT NULL DROP TABLE {previous_table};",
+                f"ALTER SCHEMA {self.previous_schema} TRANSFER dbo.{table};",
+                f"ALTER SCHEMA dbo TRANSFER {self.shadow_table_name(table)};"
+            ]
+        self.execute_script('\n'.join(statements))
+        self.conn.commit()
+
+    def has_previous_generation(self):
+        self.cursor.execute("SELECT " + ', '.join(
+            f"OBJECT_ID('{self.previous_schema}.{table}', 'U')" for table in TABLE_SCHEMAS))
+        return all(object_id is not None for object_id in self.cursor.fetchone())
+
+    def restore_previous_tables(self):
+        statements = []
+        for table in TABLE_SCHEMAS:
+            shadow_table = self.shadow_table_name(table)
+            statements += [
+                f"IF OBJECT_ID('{shadow_table}', 'U') IS NOT NULL DROP TABLE {shadow_table};",
+                f"ALTER SCHEMA {self.shadow_schema} TRANSFER dbo.{table};",
+                f"ALTER SCHEMA dbo TRANSFER {self.previous_schema}.{table};",
+                f"ALTER SCHEMA {self.previous_schema} TRANSFER {shadow_table};"
+            ]
+        self.execute_script('\n'.join(statements))
+        self.conn.commit()
 
     def check_connection(self):
+        # A round trip that reads no table, so a connection can be tested before it is reused.
         if not self.conn or not self.cursor:
-            raise Exception("No active database connection to check")
+            return False
         try:
-            self.cursor.execute("SELECT TOP 1 * FROM INFORMATION_SCHEMA.TABLES")
+            self.cursor.execute("SELECT 1")
+            self.cursor.fetchall()
+            return True
         except Exception as e:
-            logging.error(f"Connection check failed: {e}")
-            raise e
+            logging.warning(f"Connection check failed: {e}")
+            return False
 
     def close_connection(self):
         try:
+            while self.prepared:
+                self.prepared.popitem()[1].close()
             if self.cursor:
                 self.cursor.close()
             if self.conn:
@@ -65,445 +406,1824 @@ class DatabaseManager:
         except Exception as e:
             logging.error(f"Error closing connection: {e}")
         finally:
+            self.prepared.clear()
             self.conn = None
             self.cursor = None
+            self.lookup_cache = None
+
+    def dispose(self):
+        if self.engine is not None:
+            self.engine.dispose()
+        self.engine = None
+        self.engine_url = None
+
+    def open_worker(self):
+        # Parallel writers share the pooled engine but each gets its own connection and transaction.
+        worker = type(self)()
+        worker.table_names = self.table_names
+        worker.metrics = self.metrics
+        worker.statements = self.statements
+        worker.conn = self.engine.raw_connection()
+        worker.cursor = worker.conn.cursor()
+        return worker
+
+
+SQLITE_TYPES = {'INT': 'INTEGER', 'BINARY': 'BLOB'}
+
+
+class SQLiteManager(DatabaseManager):
+    # Local store for edge screening nodes and for running loads without SQL Server. The database file is
+    # attached as schema "dbo" so the dbo.-qualified table names used throughout resolve unchanged.
+    backend = 'sqlite'
+    # SQLite allows a single writer per database file; more workers would only queue on its lock.
+    max_writers = 1
+
+    def connect_to_database(self, database=None, max_attempts=3, timeout=60, **details):
+        if not database:
+            raise ValueError("SQLite database path is missing")
+        self.database = database
+        error = None
+        for i in range(max_attempts):
+            try:
+                # Keeps the prepared form of every statement a load repeats, including the per-chunk-size texts.
+                self.conn = sqlite3.connect(':memory:', timeout=timeout, cached_statements=512)
+                self.cursor = self.conn.cursor()
+                self.cursor.execute("ATTACH DATABASE ? AS dbo", (database,))
+                self.cursor.execute("PRAGMA dbo.journal_mode=WAL")
+                self.cursor.execute("PRAGMA dbo.synchronous=NORMAL")
+                return
+            except sqlite3.Error as e:
+                error = e
+                logging.error(f"Database connection attempt {i + 1} failed: {e}")
+                self.close_connection()
+                if i + 1 == max_attempts or not self.is_transient_error(e):
+                    break
+                time.sleep(backoff_delay(i + 1, self.retry_delay))
+        raise Exception(f"Failed to connect to the database after {i + 1} attempt(s): {error}")
+
+    def prepared_cursor(self, sql):
+        # sqlite3 caches prepared statements per connection by their text, so one cursor serves them all.
+        return self.cursor
+
+    def is_transient_error(self, error):
+        # Another process holding the write lock for longer than the busy timeout.
+        return isinstance(error, sqlite3.OperationalError) and ('locked' in str(error) or 'busy' in str(error))
+
+    def select_existing_ids(self, table, columns, values_list):
+        table = self.table_name(table)
+        found = {}
+        null_key = (None,) * len(columns)
+        if null_key in values_list:
+            self.cursor.execute(f"SELECT ID FROM {table} WHERE {columns[0]} IS NULL ORDER BY ID LIMIT 1")
+            result = self.cursor.fetchone()
+            if result:
+                found[null_key] = result[0]
+            values_list = [values for values in values_list if values != null_key]
+
+        source_columns = ', '.join(['RN'] + columns)
+        conditions = ' AND '.join(f"t.{column} = s.{column}" for column in columns)
+        for chunk in chunked(values_list, rows_per_statement(len(columns) + 1)):
+            rows_sql = ', '.join(['(' + ', '.join('?' * (len(columns) + 1)) + ')'] * len(chunk))
+            params = [param for rn, values in enumerate(chunk) for param in (rn, *values)]
+            self.cursor.execute(
+                f"WITH s ({source_columns}) AS (VALUES {rows_sql}) "
+                f"SELECT s.RN, (SELECT t.ID FROM {table} AS t WHERE {conditions} ORDER BY t.ID LIMIT 1) FROM s",
+                params)
+            for rn, row_id in self.cursor.fetchall():
+                if row_id is not None:
+                    found[chunk[rn]] = row_id
+        return found
+
+    def insert_rows_returning_ids(self, table, columns, rows):
+        # In-process inserts cost no round trip, so lastrowid per row is both simple and fast here.
+        insert_sql = self.statement('insert', table, columns)
+        ids = []
+        for values in rows:
+            self.cursor.execute(insert_sql, values)
+            ids.append(self.cursor.lastrowid)
+        return ids
+
+    def insert_returning_id(self, table, columns, values):
+        return self.insert_rows_returning_ids(table, columns, [values])[0]
+
+    def merge_sql(self, table, columns):
+        return (f"INSERT INTO {table} (ROW_HASH, {', '.join(columns)}) VALUES ({', '.join('?' * (len(columns) + 1))}) "
+                f"ON CONFLICT (ROW_HASH) WHERE ROW_HASH IS NOT NULL DO UPDATE SET ROW_HASH = excluded.ROW_HASH "
+                f"RETURNING ID")
+
+    def merge_rows_returning_ids(self, table, columns, rows, hashes):
+        # An upsert per row: in-process statements cost no round trip, and RETURNING reports the ID whether the
+        # row was inserted or already there.
+        merge_sql = self.statement('merge', table, columns)
+        ids = []
+        for values, row_hash in zip(rows, hashes):
+            self.cursor.execute(merge_sql, (row_hash, *values))
+            ids.append(self.cursor.fetchone()[0])
+        return ids
+
+    def column_names(self, table):
+        schema, name = self.table_name(table).split('.')
+        return [row[1] for row in self.cursor.execute(f"PRAGMA {schema}.table_info({name})").fetchall()]
+
+    def bulk_load(self, table, path, file_format, kinds, server_path=None):
+        # The local equivalent of BULK INSERT: the file's rows in executemany batches inside the load transaction.
+        self.insert_file_rows(self.table_name(table), path, file_format, kinds)
+
+    def add_row_hash_columns(self):
+        upgraded = []
+        for table in TABLE_SCHEMAS:
+            if f"dbo.{table}" not in ROW_HASH_TABLES:
+                continue
+            columns = [row[1] for row in self.cursor.execute(f"PRAGMA dbo.table_info({table})").fetchall()]
+            if columns and 'ROW_HASH' not in columns:
+                self.cursor.execute(f"ALTER TABLE dbo.{table} ADD COLUMN ROW_HASH BLOB")
+                upgraded.append(table)
+        return upgraded
+
+    def create_index_sql(self, index, table, name=None):
+        # SQLite index names are unique per database, not per table, so shadow tables use their own names.
+        return (f"CREATE {'UNIQUE ' if index.unique else ''}INDEX IF NOT EXISTS dbo.{name or index.name} "
+                f"ON {table} ({', '.join(index.columns)}){f' WHERE {index.where}' if index.where else ''};")
+
+    def create_table_sql(self, qualified_name, columns, primary_key=True, if_not_exists=False):
+        # ID is always the rowid alias; unlike SQL Server there is no separate index to defer.
+        column_lines = ',\n'.join(
+            ["    ID INTEGER PRIMARY KEY"] +
+            [f"    {column} {SQLITE_TYPES.get(column_type.split('(')[0], 'TEXT')}" for column, column_type in columns] +
+            ["    Inserted TEXT DEFAULT CURRENT_TIMESTAMP"])
+        return f"CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{qualified_name} (\n{column_lines}\n);"
+
+    def create_tables_script(self):
+        return '\n\n'.join([self.create_table_sql(f"dbo.{table}", table_columns(table), if_not_exists=True)
+                              for table in TABLE_SCHEMAS] +
+                             [self.create_index_sql(index, index.table) for index in TABLE_INDEXES])
+
+    def execute_script(self, script):
+        self.cursor.executescript(script)
+
+    def truncate_table_sql(self, table):
+        return f"DELETE FROM dbo.{table}"
+
+    def shadow_table_name(self, table):
+        return f"dbo.{table}__shadow"
+
+    def prepare_shadow_tables(self):
+        statements = []
+        for table in TABLE_SCHEMAS:
+            shadow_table = self.shadow_table_name(table)
+            statements.append(f"DROP TABLE IF EXISTS {shadow_table};")
+            statements.append(self.create_table_sql(shadow_table, table_columns(table), primary_key=False))
+        statements += [self.create_index_sql(index, f"{index.table}__shadow", f"{index.name}__shadow")
+                       for index in TABLE_INDEXES if index.unique]
+        self.execute_script('\n'.join(statements))
+
+    def build_shadow_indexes(self):
+        self.conn.commit()
+
+    def live_index_statements(self, table):
+        # Indexes follow a renamed table but keep their names, so the live generation's indexes are dropped
+        # before it is renamed away and recreated under the live names on the table that replaces it.
+        indexes = [index for index in TABLE_INDEXES if index.table == table]
+        return ([f"DROP INDEX IF EXISTS dbo.{index.name};" for index in indexes],
+                [f"DROP INDEX IF EXISTS dbo.{index.name}__shadow;" for index in indexes] +
+                [self.create_index_sql(index, table) for index in indexes])
+
+    def swap_shadow_tables(self):
+        # executescript commits any open transaction first, so the renames run in a transaction of their own.
+        statements = ["BEGIN;"]
+        for table in TABLE_SCHEMAS:
+            drop_live, create_live = self.live_index_statements(table)
+            statements += [f"DROP TABLE IF EXISTS dbo.{table}__previous;"] + drop_live + [
+                f"ALTER TABLE dbo.{table} RENAME TO {table}__previous;",
+                f"ALTER TABLE {self.shadow_table_name(table)} RENAME TO {table};"
+            ] + create_live
+        statements.append("COMMIT;")
+        self.execute_script('\n'.join(statements))
+
+    def has_previous_generation(self):
+        self.cursor.execute("SELECT COUNT(*) FROM dbo.sqlite_master WHERE type = 'table' AND name IN ({})".format(
+            ', '.join('?' * len(TABLE_SCHEMAS))), [f"{table}__previous" for table in TABLE_SCHEMAS])
+        return self.cursor.fetchone()[0] == len(TABLE_SCHEMAS)
+
+    def restore_previous_tables(self):
+        statements = ["BEGIN;"]
+        for table in TABLE_SCHEMAS:
+            drop_live, create_live = self.live_index_statements(table)
+            statements += [f"DROP TABLE IF EXISTS {self.shadow_table_name(table)};"] + drop_live + [
+                f"ALTER TABLE dbo.{table} RENAME TO {table}__shadow;",
+                f"ALTER TABLE dbo.{table}__previous RENAME TO {table};",
+                f"ALTER TABLE {self.shadow_table_name(table)} RENAME TO {table}__previous;"
+            ] + create_live
+        statements.append("COMMIT;")
+        self.execute_script('\n'.join(statements))
+
+    def open_worker(self):
+        worker = type(self)()
+        worker.table_names = self.table_names
+        worker.metrics = self.metrics
+        worker.statements = self.statements
+        worker.connect_to_database(self.database)
+        return worker
+
+
+DATABASE_BACKENDS = {
+    'mssql': DatabaseManager,
+    'sqlite': SQLiteManager
+}
+
+
+def create_database_manager(db_details):
+    return DATABASE_BACKENDS[db_details.get('backend') or 'mssql']()
+
+
+def connection_details(db_details):
+    return {key: value for key, value in db_details.items() if key != 'backend'}
+
+
+def database_target(db_details):
+    if (db_details.get('backend') or 'mssql') == 'sqlite':
+        return f"sqlite:{os.path.abspath(db_details['database'])}"
+    return f"{db_details.get('server')}/{db_details.get('database')}"
+
+
+RECORD_TAGS = ('INDIVIDUAL', 'ENTITY')
+
+
+def download_to_file(session, url, path, headers=None, chunk_size=1 << 16):
+    digest = hashlib.sha256()
+    with session.get(url, timeout=30, stream=True, headers=headers) as response:
+        response.raise_for_status()
+        if response.status_code == 304:
+            return response.status_code, None, response.headers
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size):
+                f.write(chunk)
+                digest.update(chunk)
+    return response.status_code, digest.hexdigest(), response.headers
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def open_payload(path, use_mmap=False):
+    with open(path, 'rb') as f:
+        if use_mmap and os.path.getsize(path):
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+        else:
+            yield f
+
+
+class PayloadCache:
+    # Content-addressed store of downloaded lists (<sha256>.xml) plus the validators needed for conditional
+    # requests and, per database target, the hash of the payload that was last loaded successfully.
+    def __init__(self, cache_dir='aml_cache', keep=3):
+        self.cache_dir = cache_dir
+        self.keep = keep
+        self.meta_path = os.path.join(cache_dir, 'meta.json')
+        # Sources are fetched concurrently and all of them record their validators here; multi-target loads share
+        # one cache and mark their targets loaded from several threads.
+        self.lock = threading.RLock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.meta = self.read_meta()
+
+    def read_meta(self):
+        try:
+            with open(self.meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        meta.setdefault('sources', {})
+        meta.setdefault('loaded', {})
+        meta.setdefault('checkpoints', {})
+        return meta
+
+    def save_meta(self):
+        with self.lock:
+            temp_path = f"{self.meta_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.meta, f, indent=2)
+            os.replace(temp_path, self.meta_path)
+
+    def payload_path(self, sha256):
+        return os.path.join(self.cache_dir, f"{sha256}.xml")
+
+    def temp_path(self):
+        fd, path = tempfile.mkstemp(prefix='download_', suffix='.part', dir=self.cache_dir)
+        os.close(fd)
+        return path
+
+    def cached_source(self, url):
+        source = self.meta['sources'].get(url)
+        if source and os.path.exists(self.payload_path(source['sha256'])):
+            return source
+        return None
+
+    def conditional_headers(self, url):
+        source = self.cached_source(url)
+        headers = {}
+        if source:
+            if source.get('etag'):
+                headers['If-None-Match'] = source['etag']
+            if source.get('last_modified'):
+                headers['If-Modified-Since'] = source['last_modified']
+        return headers
+
+    def store(self, url, temp_path, sha256, headers):
+        with self.lock:
+            path = self.payload_path(sha256)
+            if os.path.exists(path):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, path)
+            self.meta['sources'][url] = {
+                'sha256': sha256,
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'fetched': datetime.now().isoformat(timespec='seconds')
+            }
+            self.prune()
+            self.save_meta()
+        return path
+
+    def loaded_hash(self, target):
+        return self.meta['loaded'].get(target)
+
+    def mark_loaded(self, target, sha256):
+        with self.lock:
+            self.meta['loaded'][target] = sha256
+            self.save_meta()
+
+    def checkpoint(self, target):
+        return self.meta['checkpoints'].get(target)
+
+    def save_checkpoint(self, target, checkpoint):
+        # A partially committed load no longer matches the last loaded payload, so that hash is cleared too.
+        with self.lock:
+            if checkpoint is None:
+                self.meta['checkpoints'].pop(target, None)
+            else:
+                self.meta['checkpoints'][target] = checkpoint
+                self.meta['loaded'][target] = None
+            self.save_meta()
+
+    def prune(self):
+        referenced = {source['sha256'] for source in self.meta['sources'].values()}
+        payloads = sorted((name for name in os.listdir(self.cache_dir) if name.endswith('.xml')),
+                          key=lambda name: os.path.getmtime(os.path.join(self.cache_dir, name)), reverse=True)
+        for name in payloads[self.keep:]:
+            if name[:-len('.xml')] not in referenced:
+                os.remove(os.path.join(self.cache_dir, name))
+
+
+def create_session():
+    import ssl
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class SSLAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            context = ssl.create_default_context()
+            context.options |= ssl.OP_LEGACY_SERVER_CONNECT
+            kwargs['ssl_context'] = context
+            return super().init_poolmanager(*args, **kwargs)
+
+    session = requests.Session()
+    adapter = SSLAdapter()
+    session.mount('https://', adapter)
+    return session
+
+
+def request_errors(name='RequestException'):
+    # For except clauses. requests is imported by the first download, so while it is not loaded nothing can
+    # have raised one of its exceptions and the empty tuple matches nothing.
+    exceptions = sys.modules.get('requests.exceptions')
+    return getattr(exceptions, name) if exceptions else ()
+
+
+def fetch_payload(session, url, payload_cache=None):
+    # Returns (status_code, path, sha256, is_temporary). A 304 answer is served from the local cache.
+    if payload_cache is None:
+        fd, path = tempfile.mkstemp(prefix='consolidated_', suffix='.xml')
+        os.close(fd)
+        try:
+            status_code, sha256, _ = download_to_file(session, url, path)
+        except Exception:
+            os.remove(path)
+            raise
+        return status_code, path, sha256, True
 
-def get_text(element, tag):
-    el = element.find(tag)
-    return el.text if el is not None else None
+    temp_path = payload_cache.temp_path()
+    try:
+        status_code, sha256, headers = download_to_file(session, url, temp_path,
+                                                        headers=payload_cache.conditional_headers(url))
+    except Exception:
+        os.remove(temp_path)
+        raise
+    if status_code == 304:
+        os.remove(temp_path)
+        source = payload_cache.cached_source(url)
+        logging.info(f"Not modified since {source.get('fetched')}; using cached payload {source['sha256']}")
+        return status_code, payload_cache.payload_path(source['sha256']), source['sha256'], False
+    if status_code != 200:
+        os.remove(temp_path)
+        return status_code, None, None, False
+    return status_code, payload_cache.store(url, temp_path, sha256, headers), sha256, False
+
+
+def fetch_source(session, adapter, payload_cache=None, location=None):
+    # Like fetch_payload, but a location that is a local file is read in place.
+    location = location or adapter.url
+    if os.path.isfile(location):
+        return 200, location, sha256_file(location), False
+    return fetch_payload(session, location, payload_cache)
+
+
+def needs_session(input_file=None, sources=None, source_locations=None):
+    # Whether anything is downloaded. Local files are read in place, so loading only those never creates a session
+    # and never imports requests.
+    if not sources:
+        return not input_file
+    locations = dict(source_locations or {})
+    if input_file:
+        locations.setdefault('un', input_file)
+    return any(not os.path.isfile(locations.get(name) or SOURCE_ADAPTERS[name].url) for name in sources)
+
+
+def load_source(session, adapter, payload_cache=None, location=None):
+    start = time.perf_counter()
+    status_code, path, sha256, temporary = fetch_source(session, adapter, payload_cache, location)
+    try:
+        if status_code not in (200, 304):
+            raise Exception(f"Source {adapter.name} answered with status {status_code}")
+        records = [(tag, RECORD_PARSERS[tag](element)) for tag, element in adapter.records(path)]
+    finally:
+        if temporary and path and os.path.exists(path):
+            os.remove(path)
+    logging.info(f"Source {adapter.name}: {len(records)} records in {time.perf_counter() - start:.2f}s")
+    return sha256, records
+
+
+def fetch_sources(session, names, payload_cache=None, locations=None):
+    # Every list is downloaded, with its own conditional request and cache entry, and parsed on a thread of its
+    # own, so a refresh takes about as long as the slowest list. Records come back in the order of names, which
+    # keeps IDs and checkpoints reproducible; the combined hash changes whenever any list does.
+    locations = locations or {}
+    with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix='aml-source') as executor:
+        futures = [executor.submit(load_source, session, SOURCE_ADAPTERS[name], payload_cache, locations.get(name))
+                   for name in names]
+        results = [future.result() for future in futures]
+    combined = hashlib.sha256(' '.join(f"{name}:{sha256}" for name, (sha256, _) in zip(names, results))
+                              .encode()).hexdigest()
+    return combined, [item for _, records in results for item in records]
+
+
+def count_records(path, tags=RECORD_TAGS, chunk_size=1 << 20, use_mmap=False):
+    # Cheap byte scan for closing tags so the progress bar has a total without building a tree.
+    markers = {tag: f"</{tag}>".encode() for tag in tags}
+    counts = dict.fromkeys(tags, 0)
+    tails = dict.fromkeys(tags, b'')
+    with open_payload(path, use_mmap) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            for tag, marker in markers.items():
+                window = tails[tag] + chunk
+                counts[tag] += window.count(marker)
+                tails[tag] = window[-(len(marker) - 1):]
+    return counts
+
+
+def select_records(events, parents, tags=RECORD_TAGS):
+    # Yields each record element once it is complete, then drops it (and any already parsed
+    # siblings) from its parent so memory stays flat regardless of list size.
+    for event, elem in events:
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag in tags:
+            yield elem.tag, elem
+            elem.clear()
+            if parents:
+                parents[-1].clear()
+
+
+def iter_records(source, tags=RECORD_TAGS):
+    return select_records(ET.iterparse(source, events=('start', 'end')), [], tags)
+
+
+_END_OF_STREAM = object()
+
+
+class StreamingPipeline:
+    # Overlaps download, parsing and database writes: response chunks feed an XMLPullParser on one thread,
+    # parsed records flow through a bounded queue to the writer on the calling thread. Both queues are bounded,
+    # so a slow database throttles parsing and downloading instead of letting memory grow.
+    def __init__(self, session, url, payload_cache=None, chunk_size=1 << 16, chunk_queue_size=64,
+                 record_queue_size=1000):
+        self.session = session
+        self.url = url
+        self.payload_cache = payload_cache
+        self.chunk_size = chunk_size
+        self.chunk_queue_size = chunk_queue_size
+        self.record_queue_size = record_queue_size
+        self.response = None
+        self.status_code = None
+        self.cached_path = None
+        self.sha256 = None
+        self.total_bytes = None
+        self.bytes_parsed = 0
+        self.stop = threading.Event()
+        self.errors = []
+        self.stats = OrderedDict(
+            (stage, {'items': 0, 'bytes': 0, 'elapsed': 0.0, 'blocked': 0.0}) for stage in ('download', 'parse', 'write'))
+
+    def open(self):
+        headers = self.payload_cache.conditional_headers(self.url) if self.payload_cache is not None else None
+        self.response = self.session.get(self.url, timeout=30, stream=True, headers=headers)
+        try:
+            self.response.raise_for_status()
+        except Exception:
+            self.response.close()
+            raise
+        self.status_code = self.response.status_code
+        if self.status_code == 304:
+            self.response.close()
+            source = self.payload_cache.cached_source(self.url)
+            self.sha256 = source['sha256']
+            self.cached_path = self.payload_cache.payload_path(self.sha256)
+            self.total_bytes = os.path.getsize(self.cached_path)
+            logging.info(f"Not modified since {source.get('fetched')}; streaming cached payload {self.sha256}")
+        else:
+            length = self.response.headers.get('Content-Length')
+            self.total_bytes = int(length) if length and length.isdigit() else None
+        return self.status_code
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+
+    def progress(self):
+        if not self.total_bytes:
+            return None
+        return min(self.bytes_parsed / self.total_bytes, 1.0)
+
+    def put(self, target_queue, item, stats):
+        start = time.perf_counter()
+        while not self.stop.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                stats['blocked'] += time.perf_counter() - start
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, source_queue, stats):
+        start = time.perf_counter()
+        while not self.stop.is_set():
+            try:
+                item = source_queue.get(timeout=0.1)
+                stats['blocked'] += time.perf_counter() - start
+                return item
+            except queue.Empty:
+                continue
+        raise self.errors[0] if self.errors else Exception("Pipeline stopped")
+
+    def fail(self, error):
+        self.errors.append(error)
+        self.stop.set()
+
+    def iter_chunks(self):
+        if self.cached_path:
+            with open(self.cached_path, 'rb') as f:
+                yield from iter(lambda: f.read(self.chunk_size), b'')
+        else:
+            yield from self.response.iter_content(self.chunk_size)
+
+    def download(self, chunk_queue):
+        stats = self.stats['download']
+        start = time.perf_counter()
+        temp_path = None
+        try:
+            digest = hashlib.sha256()
+            out = None
+            if self.payload_cache is not None and not self.cached_path:
+                temp_path = self.payload_cache.temp_path()
+                out = open(temp_path, 'wb')
+            try:
+                for chunk in self.iter_chunks():
+                    if out is not None:
+                        out.write(chunk)
+                    digest.update(chunk)
+                    stats['items'] += 1
+                    stats['bytes'] += len(chunk)
+                    if not self.put(chunk_queue, chunk, stats):
+                        return
+            finally:
+                if out is not None:
+                    out.close()
+            if not self.cached_path:
+                self.sha256 = digest.hexdigest()
+                if temp_path:
+                    self.payload_cache.store(self.url, temp_path, self.sha256, self.response.headers)
+                    temp_path = None
+            self.put(chunk_queue, _END_OF_STREAM, stats)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            stats['elapsed'] = time.perf_counter() - start
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def parse(self, chunk_queue, record_queue):
+        stats = self.stats['parse']
+        start = time.perf_counter()
+        try:
+            parser = ET.XMLPullParser(events=('start', 'end'))
+            parents = []
+            while True:
+                chunk = self.get(chunk_queue, stats)
+                if chunk is _END_OF_STREAM:
+                    parser.close()
+                else:
+                    parser.feed(chunk)
+                    self.bytes_parsed += len(chunk)
+                    stats['bytes'] += len(chunk)
+                for tag, element in select_records(parser.read_events(), parents):
+                    stats['items'] += 1
+                    if not self.put(record_queue, (tag, RECORD_PARSERS[tag](element)), stats):
+                        return
+                if chunk is _END_OF_STREAM:
+                    self.put(record_queue, _END_OF_STREAM, stats)
+                    return
+        except Exception as e:
+            self.fail(e)
+        finally:
+            stats['elapsed'] = time.perf_counter() - start
+
+    def run(self, sink, on_record=None):
+        chunk_queue = queue.Queue(maxsize=self.chunk_queue_size)
+        record_queue = queue.Queue(maxsize=self.record_queue_size)
+        threads = [
+            threading.Thread(target=self.download, args=(chunk_queue,), name='aml-download', daemon=True),
+            threading.Thread(target=self.parse, args=(chunk_queue, record_queue), name='aml-parse', daemon=True)
+        ]
+        stats = self.stats['write']
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self.get(record_queue, stats)
+                if item is _END_OF_STREAM:
+                    break
+                tag, record = item
+                sink.add(record)
+                stats['items'] += 1
+                if on_record is not None:
+                    on_record(tag, self.progress())
+        except Exception:
+            self.stop.set()
+            raise
+        finally:
+            stats['elapsed'] = time.perf_counter() - start
+            for thread in threads:
+                thread.join()
+            self.close()
+        if self.errors:
+            raise self.errors[0]
+        self.log_stats()
+
+    def log_stats(self):
+        busiest = max(self.stats, key=lambda stage: self.stats[stage]['elapsed'] - self.stats[stage]['blocked'])
+        for stage, stats in self.stats.items():
+            busy = max(stats['elapsed'] - stats['blocked'], 1e-9)
+            if stage == 'download':
+                rate = f"{stats['bytes'] / busy / 1048576:.1f} MB/s"
+            else:
+                rate = f"{stats['items'] / busy:.0f} records/s"
+            logging.info(f"Pipeline {stage}: {stats['items']} items, {stats['bytes'] / 1048576:.1f} MB, "
+                         f"{busy:.2f}s busy, {stats['blocked']:.2f}s blocked on queues, {rate}")
+        logging.info(f"Pipeline bottleneck: {busiest}")
+
+
+DIMENSION_TABLES = [
+    'dbo.ConsolidatedTitle',
+    'dbo.ConsolidatedDesignation',
+    'dbo.ConsolidatedNationality',
+    'dbo.ConsolidatedListType',
+    'dbo.ConsolidatedLastDayUpdated'
+]
+
+
+class LookupCache:
+    # Per-run value -> ID cache for insert_and_get_id. Dimension tables hold a few hundred values and are
+    # kept whole; every other table is bounded and evicts its least recently used entries.
+    def __init__(self, max_entries=10000, unbounded_tables=DIMENSION_TABLES):
+        self.max_entries = max_entries
+        self.unbounded_tables = set(unbounded_tables)
+        self.tables = {}
+        self.hits = {}
+        self.misses = {}
+
+    def get(self, table, values):
+        entries = self.tables.get(table)
+        key = tuple(values)
+        if entries is not None and key in entries:
+            entries.move_to_end(key)
+            self.hits[table] = self.hits.get(table, 0) + 1
+            return entries[key]
+        self.misses[table] = self.misses.get(table, 0) + 1
+        return None
+
+    def put(self, table, values, row_id):
+        entries = self.tables.setdefault(table, OrderedDict())
+        key = tuple(values)
+        entries[key] = row_id
+        entries.move_to_end(key)
+        if table not in self.unbounded_tables and len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def preload(self, db_manager, tables=DIMENSION_TABLES):
+        if not tables:
+            return
+        select_sql = ' UNION ALL '.join(
+            f"SELECT '{table}' AS TBL, ID, VALUE FROM {db_manager.table_name(table)}" for table in tables)
+        db_manager.cursor.execute(f"{select_sql} ORDER BY TBL, ID")
+        for table, row_id, value in db_manager.cursor.fetchall():
+            entries = self.tables.setdefault(table, OrderedDict())
+            if (value,) not in entries:
+                entries[(value,)] = row_id
+        logging.info(f"Lookup cache preloaded {sum(len(self.tables.get(t, ())) for t in tables)} dimension values")
+
+    def stats(self):
+        tables = sorted(set(self.hits) | set(self.misses))
+        return {
+            table: {
+                'hits': self.hits.get(table, 0),
+                'misses': self.misses.get(table, 0),
+                'size': len(self.tables.get(table, ()))
+            } for table in tables
+        }
+
+    def log_stats(self):
+        total_hits = sum(self.hits.values())
+        total_lookups = total_hits + sum(self.misses.values())
+        hit_rate = (total_hits / total_lookups * 100) if total_lookups else 0.0
+        logging.info(f"Lookup cache: {total_hits}/{total_lookups} hits ({hit_rate:.1f}%), "
+                     f"{total_hits} SELECT round trips saved")
+        for table, table_stats in self.stats().items():
+            logging.info(f"Lookup cache {table}: {table_stats}")
+
+
+def row_hash(values):
+    # Key of the get-or-create tables. Rows with only some NULLs get no hash: they are always inserted fresh,
+    # as "column = NULL" never matched them before the hash existed either. Text is hashed casefolded and without
+    # trailing spaces, so values the database collation compares equal ("Iraq", "IRAQ ") share a row; the stored
+    # values keep their original form.
+    if None in values and any(value is not None for value in values):
+        return None
+    key = [value.casefold().rstrip(' ') if isinstance(value, str) else value for value in values]
+    return hashlib.blake2b(json.dumps(key, ensure_ascii=False).encode('utf-8'), digest_size=16).digest()
 
 
 def insert_and_get_id(db_manager, table, columns, values):
-    if all(v is None for v in values):
-        select_sql = f"SELECT ID FROM {table} WHERE {columns[0]} IS NULL"
-        db_manager.cursor.execute(select_sql)
-        result = db_manager.cursor.fetchone()
-        if result:
-            return result[0]
-        else:
-            placeholders = ', '.join('?' * len(values))
-            columns_str = ', '.join(columns)
-            insert_sql = f"INSERT INTO {table} ({columns_str}) OUTPUT Inserted.ID VALUES ({placeholders})"
-            db_manager.cursor.execute(insert_sql, values)
-            return db_manager.cursor.fetchone()[0]
-
-    conditions = ' AND '.join([f"{column} = ?" for column in columns])
-    select_sql = f"SELECT ID FROM {table} WHERE {conditions}"
-    db_manager.cursor.execute(select_sql, values)
-    result = db_manager.cursor.fetchone()
+    cache = db_manager.lookup_cache
+    if table in ROW_HASH_TABLES:
+        return merge_and_get_id(db_manager, table, columns, values)
+    all_null = all(v is None for v in values)
+    # "column = NULL" never matches, so rows with only some NULLs are always inserted fresh and never cached.
+    cacheable = all_null or all(v is not None for v in values)
+    if cache is not None and cacheable:
+        cached_id = cache.get(table, values)
+        if cached_id is not None:
+            return cached_id
+
+    result = None
+    metrics = db_manager.metrics
+    started = time.perf_counter() if metrics is not None else None
+    if all_null:
+        sql = db_manager.statement('select_null_id', table, columns)
+        cursor = db_manager.prepared_cursor(sql)
+        cursor.execute(sql)
+        result = cursor.fetchone()
+    elif cacheable:
+        sql = db_manager.statement('select_id', table, columns)
+        cursor = db_manager.prepared_cursor(sql)
+        cursor.execute(sql, values)
+        result = cursor.fetchone()
+    if metrics is not None and cacheable:
+        metrics.observe(table, 'select', time.perf_counter() - started)
+
     if result:
-        return result[0]
+        row_id = result[0]
     else:
-        placeholders = ', '.join('?' * len(values))
-        columns_str = ', '.join(columns)
-        insert_sql = f"INSERT INTO {table} ({columns_str}) OUTPUT Inserted.ID VALUES ({placeholders})"
-        db_manager.cursor.execute(insert_sql, values)
-        return db_manager.cursor.fetchone()[0]
+        started = time.perf_counter() if metrics is not None else None
+        row_id = db_manager.insert_returning_id(table, columns, values)
+        if metrics is not None:
+            metrics.observe(table, 'insert', time.perf_counter() - started)
+
+    if cache is not None and cacheable:
+        cache.put(table, values, row_id)
+    return row_id
+
+
+def merge_and_get_id(db_manager, table, columns, values):
+    cache = db_manager.lookup_cache
+    values = tuple(values)
+    digest = row_hash(values)
+    if cache is not None and digest is not None:
+        cached_id = cache.get(table, values)
+        if cached_id is not None:
+            return cached_id
+
+    metrics = db_manager.metrics
+    started = time.perf_counter() if metrics is not None else None
+    row_id = db_manager.merge_rows_returning_ids(table, columns, [values], [digest])[0]
+    if metrics is not None:
+        metrics.observe(table, 'merge', time.perf_counter() - started)
+
+    if cache is not None and digest is not None:
+        cache.put(table, values, row_id)
+    return row_id
+
+
+ParsedRecord = namedtuple('ParsedRecord', ['table', 'columns', 'fields', 'lookups', 'link_table', 'link_column',
+                                           'children'])
+
+INDIVIDUAL_COLUMNS = [
+    'DATAID', 'VERSIONNUM', 'FIRST_NAME', 'SECOND_NAME', 'THIRD_NAME', 'UN_LIST_TYPE',
+    'REFERENCE_NUMBER', 'LISTED_ON', 'NAME_ORIGINAL_SCRIPT', 'COMMENTS1', 'Title_ID',
+    'Designation_ID', 'Nationality_ID', 'List_type_ID', 'Last_day_updated_ID',
+    'Individual_alias_ID', 'Individual_address_ID', 'Individual_date_of_birth_ID',
+    'Individual_place_of_birth_ID', 'Individual_document_ID', 'SORT_KEY', 'SORT_KEY_LAST_MOD', 'GENDER',
+    'FOURTH_NAME'
+]
+
+ENTITY_COLUMNS = [
+    'DATAID', 'VERSIONNUM', 'FIRST_NAME', 'UN_LIST_TYPE', 'REFERENCE_NUMBER',
+    'LISTED_ON', 'COMMENTS1', 'List_type_ID', 'Last_day_updated_ID',
+    'Entity_alias_ID', 'Entity_address_ID', 'SORT_KEY', 'SORT_KEY_LAST_MOD', 'NAME_ORIGINAL_SCRIPT'
+]
+
+# How a record element maps onto the tables. Fields are copied from the direct child element of the same name.
+# Lookups are (record column, lookup table, element path, lookup columns, link table): a path ending in /VALUE
+# yields one lookup row per VALUE element, any other path one row per element with its columns read from child
+# elements of the same name. Lookups with a link table keep every occurrence there; the record column always
+# points to the first one. A new UN schema field is one more entry here and in TABLE_SCHEMAS.
+RecordMapping = namedtuple('RecordMapping', ['table', 'columns', 'fields', 'lookups', 'link_table', 'link_column'])
+
+INDIVIDUAL_MAPPING = RecordMapping(
+    'dbo.ConsolidatedIndividual', INDIVIDUAL_COLUMNS,
+    ['DATAID', 'VERSIONNUM', 'FIRST_NAME', 'SECOND_NAME', 'THIRD_NAME', 'UN_LIST_TYPE', 'REFERENCE_NUMBER',
+     'LISTED_ON', 'NAME_ORIGINAL_SCRIPT', 'COMMENTS1', 'SORT_KEY', 'SORT_KEY_LAST_MOD', 'GENDER', 'FOURTH_NAME'],
+    [
+        ('Title_ID', 'dbo.ConsolidatedTitle', 'TITLE/VALUE', ['VALUE'], 'dbo.ConsolidatedIndividualTitles'),
+        ('Designation_ID', 'dbo.ConsolidatedDesignation', 'DESIGNATION/VALUE', ['VALUE'],
+         'dbo.ConsolidatedIndividualDesignations'),
+        ('Nationality_ID', 'dbo.ConsolidatedNationality', 'NATIONALITY/VALUE', ['VALUE'],
+         'dbo.ConsolidatedIndividualNationalities'),
+        ('List_type_ID', 'dbo.ConsolidatedListType', 'LIST_TYPE/VALUE', ['VALUE'], None),
+        ('Last_day_updated_ID', 'dbo.ConsolidatedLastDayUpdated', 'LAST_DAY_UPDATED/VALUE', ['VALUE'], None),
+        ('Individual_alias_ID', 'dbo.ConsolidatedIndividualAlias', 'INDIVIDUAL_ALIAS',
+         ['QUALITY', 'ALIAS_NAME', 'DATE_OF_BIRTH', 'NOTE', 'CITY_OF_BIRTH', 'COUNTRY_OF_BIRTH'],
+         'dbo.ConsolidatedIndividualAliases'),
+        ('Individual_address_ID', 'dbo.ConsolidatedIndividualAddress', 'INDIVIDUAL_ADDRESS',
+         ['COUNTRY', 'STREET', 'CITY', 'STATE_PROVINCE', 'NOTE', 'ZIP_CODE'],
+         'dbo.ConsolidatedIndividualAddresses'),
+        ('Individual_date_of_birth_ID', 'dbo.ConsolidatedIndividualDateOfBirth', 'INDIVIDUAL_DATE_OF_BIRTH',
+         ['TYPE_OF_DATE', 'YEAR', 'FROM_YEAR', 'TO_YEAR', 'NOTE', 'DATE'],
+         'dbo.ConsolidatedIndividualDatesOfBirth'),
+        ('Individual_place_of_birth_ID', 'dbo.ConsolidatedIndividualPlaceOfBirth', 'INDIVIDUAL_PLACE_OF_BIRTH',
+         ['CITY', 'STATE_PROVINCE', 'COUNTRY', 'NOTE', 'STREET'],
+         'dbo.ConsolidatedIndividualPlacesOfBirth'),
+        ('Individual_document_ID', 'dbo.ConsolidatedIndividualDocument', 'INDIVIDUAL_DOCUMENT',
+         ['TYPE_OF_DOCUMENT', 'TYPE_OF_DOCUMENT2', 'NUMBER', 'COUNTRY_OF_ISSUE', 'NOTE', 'ISSUING_COUNTRY',
+          'DATE_OF_ISSUE', 'CITY_OF_ISSUE'],
+         'dbo.ConsolidatedIndividualDocuments')
+    ],
+    'dbo.ConsolidatedIndividuals', 'Individual_ID')
+
+ENTITY_MAPPING = RecordMapping(
+    'dbo.ConsolidatedEntity', ENTITY_COLUMNS,
+    ['DATAID', 'VERSIONNUM', 'FIRST_NAME', 'UN_LIST_TYPE', 'REFERENCE_NUMBER', 'LISTED_ON', 'COMMENTS1',
+     'SORT_KEY', 'SORT_KEY_LAST_MOD', 'NAME_ORIGINAL_SCRIPT'],
+    [
+        ('List_type_ID', 'dbo.ConsolidatedListType', 'LIST_TYPE/VALUE', ['VALUE'], None),
+        ('Last_day_updated_ID', 'dbo.ConsolidatedLastDayUpdated', 'LAST_DAY_UPDATED/VALUE', ['VALUE'], None),
+        ('Entity_alias_ID', 'dbo.ConsolidatedEntityAlias', 'ENTITY_ALIAS', ['QUALITY', 'ALIAS_NAME', 'NOTE'],
+         'dbo.ConsolidatedEntityAliases'),
+        ('Entity_address_ID', 'dbo.ConsolidatedEntityAddress', 'ENTITY_ADDRESS',
+         ['STREET', 'CITY', 'COUNTRY', 'ZIP_CODE', 'STATE_PROVINCE', 'NOTE'],
+         'dbo.ConsolidatedEntityAddresses')
+    ],
+    'dbo.ConsolidatedEntities', 'Entity_ID')
+
+
+def mapping_children(mapping):
+    # (link table, child column in the link table and the record, element path)
+    return [(link_table, fk_column, path) for fk_column, _, path, _, link_table in mapping.lookups if link_table]
+
+
+INDIVIDUAL_CHILDREN = mapping_children(INDIVIDUAL_MAPPING)
+ENTITY_CHILDREN = mapping_children(ENTITY_MAPPING)
+
+# Lookup tables are only ever written by get-or-create, keyed on their ROW_HASH column.
+ROW_HASH_TABLES = {table for mapping in (INDIVIDUAL_MAPPING, ENTITY_MAPPING) for _, table, _, _, _ in mapping.lookups}
+
+_MISSING = object()
+
+
+class RecordParser:
+    # A RecordMapping compiled into a tag -> slot dispatch table, so a record is read in one pass over its
+    # direct children instead of one find() per column. The first occurrence of a lookup column is taken
+    # across all occurrences of its element, which is what find('ELEMENT/COLUMN') returned.
+    __slots__ = ('mapping', 'fields', 'lookups', 'dispatch')
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.fields = tuple(mapping.fields)
+        self.lookups = []
+        self.dispatch = {column: (None, column) for column in mapping.fields}
+        for slot, (fk_column, table, path, columns, link_table) in enumerate(mapping.lookups):
+            tag, _, value_tag = path.partition('/')
+            self.lookups.append((fk_column, table, columns, link_table, value_tag or None))
+            self.dispatch[tag] = (value_tag or False, slot)
+
+    def __call__(self, element):
+        fields = {}
+        rows = [[] for _ in self.lookups]
+        for child in element:
+            target = self.dispatch.get(child.tag)
+            if target is None:
+                continue
+            value_tag, slot = target
+            if value_tag is None:
+                if slot not in fields:
+                    fields[slot] = child.text
+            elif value_tag:
+                rows[slot].extend([value.text] for value in child if value.tag == value_tag)
+            else:
+                found = {}
+                for value in child:
+                    if value.tag not in found:
+                        found[value.tag] = value.text
+                rows[slot].append([found.get(column, _MISSING) for column in self.lookups[slot][2]])
+        for column in self.fields:
+            fields.setdefault(column, None)
+
+        lookups = []
+        children = []
+        for (fk_column, table, columns, link_table, value_tag), values_list in zip(self.lookups, rows):
+            if value_tag:
+                first_values = list(values_list[0]) if values_list else [None]
+            else:
+                first_values = [None] * len(columns)
+                for position in range(len(columns)):
+                    for values in values_list:
+                        if values[position] is not _MISSING:
+                            first_values[position] = values[position]
+                            break
+                values_list = [[None if value is _MISSING else value for value in values] for values in values_list]
+            lookups.append((fk_column, table, columns, first_values))
+            if link_table:
+                children.append((link_table, fk_column, table, columns, values_list))
+        mapping = self.mapping
+        return ParsedRecord(mapping.table, mapping.columns, fields, lookups, mapping.link_table,
+                            mapping.link_column, children)
+
+
+RECORD_PARSERS = {
+    'INDIVIDUAL': RecordParser(INDIVIDUAL_MAPPING),
+    'ENTITY': RecordParser(ENTITY_MAPPING)
+}
+parse_individual = RECORD_PARSERS['INDIVIDUAL']
+parse_entity = RECORD_PARSERS['ENTITY']
+
+
+def resolve_record_values(db_manager, record):
+    row = dict(record.fields)
+    for fk_column, table, columns, values in record.lookups:
+        row[fk_column] = insert_and_get_id(db_manager, table, columns, values)
+    return [row[c] for c in record.columns]
+
+
+def insert_record(db_manager, record):
+    return insert_and_get_id(db_manager, record.table, record.columns, resolve_record_values(db_manager, record))
 
 
 def insert_individual(db_manager, individual):
-    dataid = get_text(individual, 'DATAID')
-    versionnum = get_text(individual, 'VERSIONNUM')
-    first_name = get_text(individual, 'FIRST_NAME')
-    second_name = get_text(individual, 'SECOND_NAME')
-    third_name = get_text(individual, 'THIRD_NAME')
-    un_list_type = get_text(individual, 'UN_LIST_TYPE')
-    reference_number = get_text(individual, 'REFERENCE_NUMBER')
-    listed_on = get_text(individual, 'LISTED_ON')
-    name_original_script = get_text(individual, 'NAME_ORIGINAL_SCRIPT')
-    comments1 = get_text(individual, 'COMMENTS1')
-    sort_key = get_text(individual, 'SORT_KEY')
-    sort_key_last_mod = get_text(individual, 'SORT_KEY_LAST_MOD')
-    gender = get_text(individual, 'GENDER')
-    fourth_name = get_text(individual, 'FOURTH_NAME')
-
-    title_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedTitle', ['VALUE'], [get_text(individual, 'TITLE/VALUE')])
-    designation_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedDesignation', ['VALUE'],
-                                       [get_text(individual, 'DESIGNATION/VALUE')])
-    nationality_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedNationality', ['VALUE'],
-                                       [get_text(individual, 'NATIONALITY/VALUE')])
-    list_type_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedListType', ['VALUE'],
-                                     [get_text(individual, 'LIST_TYPE/VALUE')])
-    last_day_updated_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedLastDayUpdated', ['VALUE'],
-                                            [get_text(individual, 'LAST_DAY_UPDATED/VALUE')])
-
-    alias_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedIndividualAlias', [
-        'QUALITY', 'ALIAS_NAME', 'DATE_OF_BIRTH', 'NOTE', 'CITY_OF_BIRTH', 'COUNTRY_OF_BIRTH'
-    ], [
-                                     get_text(individual, 'INDIVIDUAL_ALIAS/QUALITY'),
-                                     get_text(individual, 'INDIVIDUAL_ALIAS/ALIAS_NAME'),
-                                     get_text(individual, 'INDIVIDUAL_ALIAS/DATE_OF_BIRTH'),
-                                     get_text(individual, 'INDIVIDUAL_ALIAS/NOTE'),
-                                     get_text(individual, 'INDIVIDUAL_ALIAS/CITY_OF_BIRTH'),
-                                     get_text(individual, 'INDIVIDUAL_ALIAS/COUNTRY_OF_BIRTH')
-                                 ])
-
-    address_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedIndividualAddress', [
-        'COUNTRY', 'STREET', 'CITY', 'STATE_PROVINCE', 'NOTE', 'ZIP_CODE'
-    ], [
-                                       get_text(individual, 'INDIVIDUAL_ADDRESS/COUNTRY'),
-                                       get_text(individual, 'INDIVIDUAL_ADDRESS/STREET'),
-                                       get_text(individual, 'INDIVIDUAL_ADDRESS/CITY'),
-                                       get_text(individual, 'INDIVIDUAL_ADDRESS/STATE_PROVINCE'),
-                                       get_text(individual, 'INDIVIDUAL_ADDRESS/NOTE'),
-                                       get_text(individual, 'INDIVIDUAL_ADDRESS/ZIP_CODE')
-                                   ])
-
-    dob_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedIndividualDateOfBirth', [
-        'TYPE_OF_DATE', 'YEAR', 'FROM_YEAR', 'TO_YEAR', 'NOTE', 'DATE'
-    ], [
-                                   get_text(individual, 'INDIVIDUAL_DATE_OF_BIRTH/TYPE_OF_DATE'),
-                                   get_text(individual, 'INDIVIDUAL_DATE_OF_BIRTH/YEAR'),
-                                   get_text(individual, 'INDIVIDUAL_DATE_OF_BIRTH/FROM_YEAR'),
-                                   get_text(individual, 'INDIVIDUAL_DATE_OF_BIRTH/TO_YEAR'),
-                                   get_text(individual, 'INDIVIDUAL_DATE_OF_BIRTH/NOTE'),
-                                   get_text(individual, 'INDIVIDUAL_DATE_OF_BIRTH/DATE')
-                               ])
-
-    pob_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedIndividualPlaceOfBirth', [
-        'CITY', 'STATE_PROVINCE', 'COUNTRY', 'NOTE', 'STREET'
-    ], [
-                                   get_text(individual, 'INDIVIDUAL_PLACE_OF_BIRTH/CITY'),
-                                   get_text(individual, 'INDIVIDUAL_PLACE_OF_BIRTH/STATE_PROVINCE'),
-                                   get_text(individual, 'INDIVIDUAL_PLACE_OF_BIRTH/COUNTRY'),
-                                   get_text(individual, 'INDIVIDUAL_PLACE_OF_BIRTH/NOTE'),
-                                   get_text(individual, 'INDIVIDUAL_PLACE_OF_BIRTH/STREET')
-                               ])
-
-    doc_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedIndividualDocument', [
-        'TYPE_OF_DOCUMENT', 'TYPE_OF_DOCUMENT2', 'NUMBER', 'COUNTRY_OF_ISSUE', 'NOTE',
-        'ISSUING_COUNTRY', 'DATE_OF_ISSUE', 'CITY_OF_ISSUE'
-    ], [
-                                   get_text(individual, 'INDIVIDUAL_DOCUMENT/TYPE_OF_DOCUMENT'),
-                                   get_text(individual, 'INDIVIDUAL_DOCUMENT/TYPE_OF_DOCUMENT2'),
-                                   get_text(individual, 'INDIVIDUAL_DOCUMENT/NUMBER'),
-                                   get_text(individual, 'INDIVIDUAL_DOCUMENT/COUNTRY_OF_ISSUE'),
-                                   get_text(individual, 'INDIVIDUAL_DOCUMENT/NOTE'),
-                                   get_text(individual, 'INDIVIDUAL_DOCUMENT/ISSUING_COUNTRY'),
-                                   get_text(individual, 'INDIVIDUAL_DOCUMENT/DATE_OF_ISSUE'),
-                                   get_text(individual, 'INDIVIDUAL_DOCUMENT/CITY_OF_ISSUE')
-                               ])
-
-    individual_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedIndividual', [
-        'DATAID', 'VERSIONNUM', 'FIRST_NAME', 'SECOND_NAME', 'THIRD_NAME', 'UN_LIST_TYPE',
-        'REFERENCE_NUMBER', 'LISTED_ON', 'NAME_ORIGINAL_SCRIPT', 'COMMENTS1', 'Title_ID',
-        'Designation_ID', 'Nationality_ID', 'List_type_ID', 'Last_day_updated_ID',
-        'Individual_alias_ID', 'Individual_address_ID', 'Individual_date_of_birth_ID',
-        'Individual_place_of_birth_ID', 'Individual_document_ID', 'SORT_KEY', 'SORT_KEY_LAST_MOD', 'GENDER',
-        'FOURTH_NAME'
-    ], [
-                                          dataid, versionnum, first_name, second_name, third_name, un_list_type,
-                                          reference_number, listed_on, name_original_script, comments1, title_id,
-                                          designation_id, nationality_id, list_type_id, last_day_updated_id,
-                                          alias_id, address_id, dob_id, pob_id, doc_id,
-                                          sort_key, sort_key_last_mod, gender, fourth_name
-                                      ])
-
-    return individual_id
+    return insert_record(db_manager, parse_individual(individual))
 
 
 def insert_entity(db_manager, entity):
-    dataid = get_text(entity, 'DATAID')
-    versionnum = get_text(entity, 'VERSIONNUM')
-    first_name = get_text(entity, 'FIRST_NAME')
-    un_list_type = get_text(entity, 'UN_LIST_TYPE')
-    reference_number = get_text(entity, 'REFERENCE_NUMBER')
-    listed_on = get_text(entity, 'LISTED_ON')
-    comments1 = get_text(entity, 'COMMENTS1')
-    sort_key = get_text(entity, 'SORT_KEY')
-    sort_key_last_mod = get_text(entity, 'SORT_KEY_LAST_MOD')
-    name_original_script = get_text(entity, 'NAME_ORIGINAL_SCRIPT')
-
-    list_type_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedListType', ['VALUE'],
-                                     [get_text(entity, 'LIST_TYPE/VALUE')])
-    last_day_updated_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedLastDayUpdated', ['VALUE'],
-                                            [get_text(entity, 'LAST_DAY_UPDATED/VALUE')])
-
-    alias_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedEntityAlias', [
-        'QUALITY', 'ALIAS_NAME', 'NOTE'
-    ], [
-                                     get_text(entity, 'ENTITY_ALIAS/QUALITY'),
-                                     get_text(entity, 'ENTITY_ALIAS/ALIAS_NAME'),
-                                     get_text(entity, 'ENTITY_ALIAS/NOTE')
-                                 ])
-
-    address_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedEntityAddress', [
-        'STREET', 'CITY', 'COUNTRY', 'ZIP_CODE', 'STATE_PROVINCE', 'NOTE'
-    ], [
-                                       get_text(entity, 'ENTITY_ADDRESS/STREET'),
-                                       get_text(entity, 'ENTITY_ADDRESS/CITY'),
-                                       get_text(entity, 'ENTITY_ADDRESS/COUNTRY'),
-                                       get_text(entity, 'ENTITY_ADDRESS/ZIP_CODE'),
-                                       get_text(entity, 'ENTITY_ADDRESS/STATE_PROVINCE'),
-                                       get_text(entity, 'ENTITY_ADDRESS/NOTE')
-                                   ])
-
-    entity_id = insert_and_get_id(db_manager, 'dbo.ConsolidatedEntity', [
-        'DATAID', 'VERSIONNUM', 'FIRST_NAME', 'UN_LIST_TYPE', 'REFERENCE_NUMBER',
-        'LISTED_ON', 'COMMENTS1', 'List_type_ID', 'Last_day_updated_ID',
-        'Entity_alias_ID', 'Entity_address_ID', 'SORT_KEY', 'SORT_KEY_LAST_MOD', 'NAME_ORIGINAL_SCRIPT'
-    ], [
-                                      dataid, versionnum, first_name, un_list_type, reference_number,
-                                      listed_on, comments1, list_type_id, last_day_updated_id,
-                                      alias_id, address_id, sort_key, sort_key_last_mod, name_original_script
-                                  ])
-
-    return entity_id
-
-
-def create_tables(db_manager):
-    create_tables_script = """ 
-
-    USE AMLDatabase;
-
-        IF OBJECT_ID('dbo.ConsolidatedTitle', 'U') IS NULL
-            BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedTitle (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                VALUE VARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedDesignation', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedDesignation (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                VALUE VARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedNationality', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedNationality (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                VALUE VARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedListType', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedListType (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                VALUE VARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedLastDayUpdated', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedLastDayUpdated (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                VALUE VARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedIndividualAlias', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedIndividualAlias (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                QUALITY VARCHAR(500),
-                ALIAS_NAME VARCHAR(500),
-                DATE_OF_BIRTH VARCHAR(500),
-                NOTE NVARCHAR(max),
-                CITY_OF_BIRTH VARCHAR(500),
-                COUNTRY_OF_BIRTH VARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedIndividualAddress', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedIndividualAddress (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                COUNTRY VARCHAR(500),
-                STREET VARCHAR(500),
-                CITY VARCHAR(500),
-                STATE_PROVINCE VARCHAR(500),
-                NOTE NVARCHAR(max),
-                ZIP_CODE VARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedIndividualDateOfBirth', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedIndividualDateOfBirth (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                TYPE_OF_DATE VARCHAR(500),
-                YEAR VARCHAR(500),
-                FROM_YEAR VARCHAR(500),
-                TO_YEAR VARCHAR(500),
-                NOTE NVARCHAR(max),
-                DATE VARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedIndividualPlaceOfBirth', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedIndividualPlaceOfBirth (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                CITY VARCHAR(500),
-                STATE_PROVINCE VARCHAR(500),
-                COUNTRY VARCHAR(500),
-                NOTE NVARCHAR(max),
-                STREET VARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedIndividualDocument', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedIndividualDocument (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                TYPE_OF_DOCUMENT VARCHAR(500),
-                TYPE_OF_DOCUMENT2 VARCHAR(500),
-                NUMBER VARCHAR(500),
-                COUNTRY_OF_ISSUE VARCHAR(500),
-                NOTE NVARCHAR(max),
-                ISSUING_COUNTRY VARCHAR(500),
-                DATE_OF_ISSUE VARCHAR(500),
-                CITY_OF_ISSUE VARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedIndividual', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedIndividual (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                DATAID VARCHAR(500),
-                VERSIONNUM VARCHAR(500),
-                FIRST_NAME VARCHAR(500),
-                SECOND_NAME VARCHAR(500),
-                THIRD_NAME VARCHAR(500),
-                FOURTH_NAME VARCHAR(500),
-                UN_LIST_TYPE VARCHAR(500),
-                REFERENCE_NUMBER VARCHAR(500),
-                LISTED_ON VARCHAR(500),
-                NAME_ORIGINAL_SCRIPT NVARCHAR(500),
-                COMMENTS1 NVARCHAR(max),
-                Title_ID INT,
-                Designation_ID INT,
-                Nationality_ID INT,
-                List_type_ID INT,
-                Last_day_updated_ID INT,
-                Individual_alias_ID INT,
-                Individual_address_ID INT,
-                Individual_date_of_birth_ID INT,
-                Individual_place_of_birth_ID INT,
-                Individual_document_ID INT,
-                SORT_KEY VARCHAR(500),
-                SORT_KEY_LAST_MOD VARCHAR(500),
-                GENDER VARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedIndividuals', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedIndividuals (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                Individual_ID INT,
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedEntityAlias', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedEntityAlias (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                QUALITY VARCHAR(500),
-                ALIAS_NAME VARCHAR(500),
-                NOTE NVARCHAR(max),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedEntityAddress', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedEntityAddress (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                STREET VARCHAR(500),
-                CITY VARCHAR(500),
-                COUNTRY VARCHAR(500),
-                ZIP_CODE VARCHAR(500),
-                STATE_PROVINCE VARCHAR(500),
-                NOTE NVARCHAR(max),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedEntity', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedEntity (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                DATAID VARCHAR(500),
-                VERSIONNUM VARCHAR(500),
-                FIRST_NAME VARCHAR(500),
-                UN_LIST_TYPE VARCHAR(500),
-                REFERENCE_NUMBER VARCHAR(500),
-                LISTED_ON VARCHAR(500),
-                COMMENTS1 NVARCHAR(max),
-                List_type_ID INT,
-                Last_day_updated_ID INT,
-                Entity_alias_ID INT,
-                Entity_address_ID INT,
-                SORT_KEY VARCHAR(500),
-                SORT_KEY_LAST_MOD VARCHAR(500),
-                NAME_ORIGINAL_SCRIPT NVARCHAR(500),
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-        IF OBJECT_ID('dbo.ConsolidatedEntities', 'U') IS NULL
-        BEGIN
-            CREATE TABLE AMLDatabase.dbo.ConsolidatedEntities (
-                ID INT IDENTITY(1,1) PRIMARY KEY,
-                Entity_ID INT,
-                [Inserted] [datetime] NULL DEFAULT (getdate())
-            );
-        END;
-
-    """
-    for i in range(3):
+    return insert_record(db_manager, parse_entity(entity))
+
+
+def insert_children(db_manager, record, record_id, row):
+    first_values = {fk_column: values for fk_column, _, _, values in record.lookups}
+    for link_table, fk_column, table, columns, values_list in record.children:
+        for position, values in enumerate(values_list):
+            if position == 0 and values == first_values[fk_column]:
+                # The first child is the row the record's own column already points to.
+                child_id = row[fk_column]
+            else:
+                child_id = insert_and_get_id(db_manager, table, columns, values)
+            db_manager.cursor.execute(db_manager.statement('insert', link_table, (record.link_column, fk_column)),
+                                      (record_id, child_id))
+
+
+class RowWriter:
+    # The original row-at-a-time path, kept behind the same add/flush interface as BatchWriter.
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.records_written = 0
+
+    def add(self, record):
+        values = resolve_record_values(self.db_manager, record)
+        record_id = insert_and_get_id(self.db_manager, record.table, record.columns, values)
+        self.db_manager.cursor.execute(self.db_manager.statement('insert', record.link_table, (record.link_column,)),
+                                       (record_id,))
+        insert_children(self.db_manager, record, record_id, dict(zip(record.columns, values)))
+        write_screening_rows(self.db_manager, [record], [record_id])
+        self.records_written += 1
+        return record_id
+
+    def flush(self):
+        return []
+
+
+def collect_lookup_requests(records):
+    # Children are requested in the same per-table order as the row path (each record's first-occurrence
+    # lookup, then its children), so both paths assign the same IDs. A request fills one or more targets:
+    # record columns, or child slots given as (link table, position).
+    lookup_requests = OrderedDict()
+    child_requests = OrderedDict()
+    for index, record in enumerate(records):
+        first_requests = {}
+        for fk_column, table, columns, values in record.lookups:
+            targets = [fk_column]
+            first_requests[fk_column] = (targets, values)
+            lookup_requests.setdefault((table, tuple(columns)), []).append((index, targets, values))
+        for link_table, fk_column, table, columns, values_list in record.children:
+            child_requests.setdefault((link_table, record.link_column, fk_column), []).append(index)
+            for position, values in enumerate(values_list):
+                targets, first_values = first_requests[fk_column]
+                if position == 0 and values == first_values:
+                    targets.append((link_table, 0))
+                else:
+                    lookup_requests.setdefault((table, tuple(columns)), []).append(
+                        (index, [(link_table, position)], values))
+    return lookup_requests, child_requests
+
+
+def assign_lookup_ids(rows, child_ids, requests_for_table, ids):
+    for (index, targets, _), row_id in zip(requests_for_table, ids):
+        for target in targets:
+            if isinstance(target, tuple):
+                child_ids[(index,) + target] = row_id
+            else:
+                rows[index][target] = row_id
+
+
+def child_link_rows(records, indexes, record_ids, child_requests, child_ids):
+    indexes = set(indexes)
+    for (link_table, link_column, fk_column), record_indexes in child_requests.items():
+        link_rows = []
+        for index, record_id in ((i, record_ids[i]) for i in record_indexes if i in indexes):
+            values_list = next(values_list for table, _, _, _, values_list in records[index].children
+                               if table == link_table)
+            link_rows.extend((record_id, child_ids[(index, link_table, position)])
+                             for position in range(len(values_list)))
+        if link_rows:
+            yield link_table, (link_column, fk_column), link_rows
+
+
+def write_child_links(db_manager, records, indexes, record_ids, child_requests, child_ids):
+    # One executemany per link table for the whole batch instead of an insert per child element.
+    for link_table, columns, link_rows in child_link_rows(records, indexes, record_ids, child_requests, child_ids):
+        db_manager.cursor.executemany(db_manager.statement('insert', link_table, columns), link_rows)
+
+
+class BatchWriter:
+    # Set-based alternative to insert_record: buffers parsed records and writes each table once per batch.
+    # IDs are resolved with the same get-or-create rules as insert_and_get_id, applied per table in record
+    # order, so the resulting rows and IDs match the per-row path.
+    def __init__(self, db_manager, batch_size=500, auto_tune=False, target_seconds=1.0,
+                 min_batch_size=50, max_batch_size=5000):
+        self.db_manager = db_manager
+        self.batch_size = batch_size
+        self.auto_tune = auto_tune
+        self.target_seconds = target_seconds
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.pending = []
+        self.records_written = 0
+        self.batches_written = 0
+        if hasattr(db_manager.cursor, 'fast_executemany'):
+            db_manager.cursor.fast_executemany = True
+
+    def add(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return []
+        records, self.pending = self.pending, []
+        start = time.perf_counter()
+
+        rows = [dict(record.fields) for record in records]
+        lookup_requests, child_requests = collect_lookup_requests(records)
+        child_ids = {}
+        for (table, columns), requests_for_table in lookup_requests.items():
+            ids = self.get_or_create_ids(table, list(columns), [values for _, _, values in requests_for_table])
+            assign_lookup_ids(rows, child_ids, requests_for_table, ids)
+
+        main_requests = OrderedDict()
+        for index, record in enumerate(records):
+            main_requests.setdefault((record.table, tuple(record.columns)), []).append(index)
+        record_ids = [None] * len(records)
+        for (table, columns), indexes in main_requests.items():
+            ids = self.get_or_create_ids(table, list(columns), [[rows[i][c] for c in columns] for i in indexes])
+            for index, row_id in zip(indexes, ids):
+                record_ids[index] = row_id
+
+        link_rows = OrderedDict()
+        for record, record_id in zip(records, record_ids):
+            link_rows.setdefault((record.link_table, record.link_column), []).append((record_id,))
+        for (table, column), values in link_rows.items():
+            self.db_manager.cursor.executemany(self.db_manager.statement('insert', table, (column,)), values)
+        write_child_links(self.db_manager, records, range(len(records)), record_ids, child_requests, child_ids)
+        write_screening_rows(self.db_manager, records, record_ids)
+
+        elapsed = time.perf_counter() - start
+        self.records_written += len(records)
+        self.batches_written += 1
+        logging.info(f"Batch of {len(records)} records written in {elapsed:.2f}s")
+        if self.auto_tune:
+            self.tune(len(records), elapsed)
+        return record_ids
+
+    def tune(self, batch_records, elapsed):
+        if elapsed <= 0:
+            return
+        scaled = int(batch_records * self.target_seconds / elapsed)
+        scaled = max(self.batch_size // 2, min(self.batch_size * 2, scaled))
+        self.batch_size = max(self.min_batch_size, min(self.max_batch_size, scaled))
+
+    def get_or_create_ids(self, table, columns, values_list):
+        if table in ROW_HASH_TABLES:
+            return self.merge_ids(table, columns, values_list)
+        cache = self.db_manager.lookup_cache
+        ids = [None] * len(values_list)
+        known = {}
+        unresolved = OrderedDict()
+        for index, values in enumerate(values_list):
+            values = tuple(values)
+            all_null = all(v is None for v in values)
+            if not all_null and any(v is None for v in values):
+                continue
+            cached_id = cache.get(table, values) if cache is not None else None
+            if cached_id is not None:
+                known[values] = cached_id
+            elif values not in known:
+                unresolved.setdefault(values, None)
+
+        metrics = self.db_manager.metrics
+        if unresolved:
+            started = time.perf_counter() if metrics is not None else None
+            known.update(self.db_manager.select_existing_ids(table, columns, list(unresolved)))
+            if metrics is not None:
+                metrics.observe(table, 'select', time.perf_counter() - started, len(unresolved))
+
+        # Walk rows in order: reuse anything already stored or created earlier in this batch, otherwise queue an
+        # insert. An all-NULL row matches the first row whose first column is NULL, as insert_and_get_id does.
+        null_key = (None,) * len(columns)
+        null_checked = null_key in unresolved
+        inserts = []
+        insert_slots = []
+        pending_slots = {}
+        for index, values in enumerate(values_list):
+            values = tuple(values)
+            cacheable = values == null_key or all(v is not None for v in values)
+            if cacheable and values in known:
+                ids[index] = known[values]
+            elif cacheable and values in pending_slots:
+                insert_slots[pending_slots[values]].append(index)
+            else:
+                if cacheable:
+                    pending_slots[values] = len(inserts)
+                if values[0] is None and null_checked and null_key not in known and null_key not in pending_slots:
+                    pending_slots[null_key] = len(inserts)
+                inserts.append(list(values))
+                insert_slots.append([index])
+
+        if inserts:
+            started = time.perf_counter() if metrics is not None else None
+            new_ids = self.db_manager.insert_rows_returning_ids(table, columns, inserts)
+            if metrics is not None:
+                metrics.observe(table, 'insert', time.perf_counter() - started, len(inserts))
+            for slot, row_id in zip(insert_slots, new_ids):
+                for index in slot:
+                    ids[index] = row_id
+            for values, slot_index in pending_slots.items():
+                known[values] = new_ids[slot_index]
+
+        if cache is not None:
+            for values, row_id in known.items():
+                cache.put(table, values, row_id)
+        return ids
+
+    def merge_ids(self, table, columns, values_list):
+        # Rows are sent in order, each hash once; rows without a hash are always sent, as in merge_and_get_id.
+        cache = self.db_manager.lookup_cache
+        ids = [None] * len(values_list)
+        rows = []
+        hashes = []
+        slots = []
+        pending_slots = {}
+        for index, values in enumerate(values_list):
+            values = tuple(values)
+            digest = row_hash(values)
+            if digest is not None:
+                cached_id = cache.get(table, values) if cache is not None else None
+                if cached_id is not None:
+                    ids[index] = cached_id
+                    continue
+                if digest in pending_slots:
+                    slots[pending_slots[digest]].append(index)
+                    continue
+                pending_slots[digest] = len(rows)
+            rows.append(values)
+            hashes.append(digest)
+            slots.append([index])
+
+        if rows:
+            metrics = self.db_manager.metrics
+            started = time.perf_counter() if metrics is not None else None
+            new_ids = self.db_manager.merge_rows_returning_ids(table, columns, rows, hashes)
+            if metrics is not None:
+                metrics.observe(table, 'merge', time.perf_counter() - started, len(rows))
+            for values, digest, slot, row_id in zip(rows, hashes, slots, new_ids):
+                for index in slot:
+                    ids[index] = row_id
+                if cache is not None and digest is not None:
+                    cache.put(table, values, row_id)
+        return ids
+
+
+def dataid_sort_key(dataid):
+    return (0, int(dataid), '') if dataid and dataid.isdigit() else (1, 0, dataid or '')
+
+
+def shard_by_dataid(indexes, dataids, shards):
+    # Contiguous DATAID ranges; every copy of a DATAID lands in the same shard so identical rows still dedupe.
+    groups = OrderedDict()
+    for index in sorted(indexes, key=lambda i: dataid_sort_key(dataids[i])):
+        groups.setdefault(dataids[index], []).append(index)
+    groups = list(groups.values())
+    size = -(-len(groups) // max(shards, 1))
+    return [[index for group in groups[start:start + size] for index in group]
+            for start in range(0, len(groups), size)] if groups else []
+
+
+class ParallelWriter:
+    # Buffers every parsed record, then writes them with several pooled connections in two phases:
+    #   1. lookup tables, one task per table, so each shared VALUE table has exactly one writer and concurrent
+    #      get-or-create can never insert the same value twice;
+    #   2. individuals and entities, each sharded into DATAID ranges that are written concurrently.
+    # Every task commits on its own connection, so a failed run can leave part of the load behind; use it
+    # with the shadow load mode when the live tables must stay untouched until the load is complete.
+    def __init__(self, db_manager, workers=4):
+        self.db_manager = db_manager
+        limit = db_manager.max_writers
+        self.workers = max(1, min(workers, limit) if limit else workers)
+        if self.workers < workers:
+            logging.info(f"The {db_manager.backend} backend allows {self.workers} writer(s); using {self.workers} "
+                         f"instead of {workers}")
+        self.pending = []
+        self.records = []
+        self.records_written = 0
+        self.task_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        self.records.append(record)
+
+    def flush(self):
+        if not self.records:
+            return []
+        records, self.records = self.records, []
+        start = time.perf_counter()
+        rows = [dict(record.fields) for record in records]
+
+        lookup_requests, child_requests = collect_lookup_requests(records)
+        child_ids = {}
+        lookup_ids = self.run_tasks([(self.write_lookup_table, table, list(columns),
+                                      [values for _, _, values in requests_for_table])
+                                     for (table, columns), requests_for_table in lookup_requests.items()])
+        for requests_for_table, ids in zip(lookup_requests.values(), lookup_ids):
+            assign_lookup_ids(rows, child_ids, requests_for_table, ids)
+        lookup_seconds = time.perf_counter() - start
+
+        main_requests = OrderedDict()
+        for index, record in enumerate(records):
+            main_requests.setdefault((record.table, tuple(record.columns), record.link_table, record.link_column),
+                                     []).append(index)
+        dataids = [record.fields['DATAID'] for record in records]
+        shards = []
+        tasks = []
+        for (table, columns, link_table, link_column), indexes in main_requests.items():
+            for shard in shard_by_dataid(indexes, dataids, self.workers):
+                shards.append(shard)
+                tasks.append((self.write_record_shard, table, list(columns), link_table, link_column,
+                              [[rows[i][c] for c in columns] for i in shard], records, shard, child_requests,
+                              child_ids))
+        record_ids = [None] * len(records)
+        for shard, ids in zip(shards, self.run_tasks(tasks)):
+            for index, row_id in zip(shard, ids):
+                record_ids[index] = row_id
+
+        elapsed = time.perf_counter() - start
+        self.wall_seconds += elapsed
+        self.records_written += len(records)
+        logging.info(f"Parallel writer: {len(records)} records in {len(lookup_requests)} lookup tasks and "
+                     f"{len(tasks)} record shards on {self.workers} workers, {elapsed:.2f}s "
+                     f"(lookup phase {lookup_seconds:.2f}s)")
+        return record_ids
+
+    def run_tasks(self, tasks):
+        if self.workers == 1:
+            return [function(*args) for function, *args in tasks]
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='aml-writer') as executor:
+            futures = [executor.submit(function, *args) for function, *args in tasks]
+            return [future.result() for future in futures]
+
+    @contextmanager
+    def worker_connection(self):
+        start = time.perf_counter()
+        worker = self.db_manager.open_worker()
+        try:
+            yield worker
+            worker.conn.commit()
+        except Exception:
+            worker.conn.rollback()
+            raise
+        finally:
+            worker.close_connection()
+            with self.lock:
+                self.task_seconds += time.perf_counter() - start
+
+    def write_lookup_table(self, table, columns, values_list):
+        with self.worker_connection() as worker:
+            return BatchWriter(worker).get_or_create_ids(table, columns, values_list)
+
+    def write_record_shard(self, table, columns, link_table, link_column, rows, records, shard, child_requests,
+                           child_ids):
+        with self.worker_connection() as worker:
+            ids = BatchWriter(worker).get_or_create_ids(table, columns, rows)
+            worker.cursor.executemany(worker.statement('insert', link_table, (link_column,)),
+                                      [(row_id,) for row_id in ids])
+            write_child_links(worker, records, shard, dict(zip(shard, ids)), child_requests, child_ids)
+            write_screening_rows(worker, [records[index] for index in shard], ids)
+            return ids
+
+    def report(self):
+        # The summed task time approximates the same tasks run back to back on one connection, so its ratio to
+        # the wall time estimates the speedup over the serial path. Lock waits count as task time, so the
+        # estimate is an upper bound when tasks contend.
+        speedup = self.task_seconds / self.wall_seconds if self.wall_seconds else 0.0
+        return {'workers': self.workers, 'records': self.records_written, 'wall_seconds': round(self.wall_seconds, 3),
+                'task_seconds': round(self.task_seconds, 3), 'estimated_speedup': round(speedup, 2)}
+
+
+class BulkWriter:
+    # Export stage and bulk load: every ID is assigned in memory with the get-or-create rules of BatchWriter, so
+    # the tables must start empty (full and shadow loads). Rows stream to one file per table as batches
+    # resolve; flush() closes the files, writes the manifest and bulk-loads each table. The files stay behind
+    # as an offline copy of the load.
+    def __init__(self, db_manager, directory='aml_export', file_format='csv', batch_size=500, server_directory=None):
+        self.db_manager = db_manager
+        self.directory = directory
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.server_directory = server_directory
+        self.pending = []
+        self.keys = {}
+        self.files = OrderedDict()
+        self.row_counts = OrderedDict()
+        self.load_seconds = {}
+        self.records_written = 0
+        self.inserted = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        os.makedirs(directory, exist_ok=True)
+        if hasattr(db_manager.cursor, 'fast_executemany'):
+            db_manager.cursor.fast_executemany = True
+
+    def add(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size:
+            self.write_batch()
+
+    def write_batch(self):
+        records, self.pending = self.pending, []
+        rows = [dict(record.fields) for record in records]
+        lookup_requests, child_requests = collect_lookup_requests(records)
+        child_ids = {}
+        for (table, columns), requests_for_table in lookup_requests.items():
+            ids = self.get_or_create_ids(table, columns, [values for _, _, values in requests_for_table])
+            assign_lookup_ids(rows, child_ids, requests_for_table, ids)
+        main_requests = OrderedDict()
+        for index, record in enumerate(records):
+            main_requests.setdefault((record.table, tuple(record.columns)), []).append(index)
+        record_ids = [None] * len(records)
+        for (table, columns), indexes in main_requests.items():
+            ids = self.get_or_create_ids(table, columns, [[rows[i][c] for c in columns] for i in indexes])
+            for index, row_id in zip(indexes, ids):
+                record_ids[index] = row_id
+        link_rows = OrderedDict()
+        for record, record_id in zip(records, record_ids):
+            link_rows.setdefault((record.link_table, record.link_column), []).append((record_id,))
+        for (table, column), values in link_rows.items():
+            self.append_rows(table, (column,), values)
+        for link_table, columns, link_rows in child_link_rows(records, range(len(records)), record_ids,
+                                                              child_requests, child_ids):
+            self.append_rows(link_table, columns, link_rows)
+        screening_rows = screening_table_rows(records, record_ids)
+        if screening_rows:
+            self.append_rows(SCREENING_TABLE, SCREENING_TABLE_COLUMNS, screening_rows)
+        self.records_written += len(records)
+
+    def get_or_create_ids(self, table, columns, values_list):
+        keys = self.keys.setdefault(table, {})
+        hashed = table in ROW_HASH_TABLES
+        row_id = self.row_counts.get(table, 0)
+        ids = []
+        new_rows = []
+        for values in values_list:
+            values = tuple(values)
+            if hashed:
+                key = row_hash(values)
+            else:
+                key = values if all(v is None for v in values) or None not in values else None
+            existing_id = keys.get(key) if key is not None else None
+            if existing_id is not None:
+                ids.append(existing_id)
+                continue
+            row_id += 1
+            new_rows.append(values + (key,) if hashed else values)
+            if key is not None:
+                keys[key] = row_id
+            ids.append(row_id)
+        if new_rows:
+            self.append_rows(table, tuple(columns) + (('ROW_HASH',) if hashed else ()), new_rows)
+        return ids
+
+    def append_rows(self, table, columns, rows):
+        # IDs are numbered per table from 1, in the order rows are appended.
+        entry = self.files.get(table)
+        if entry is None:
+            name = table.split('.', 1)[1]
+            file_columns = self.db_manager.column_names(table)
+            writer = open_table_writer(self.directory, name, file_columns, column_kinds(name), self.file_format)
+            entry = self.files[table] = (writer, file_columns)
+            self.row_counts[table] = 0
+        writer, file_columns = entry
+        names = ('ID',) + tuple(columns) + ('Inserted',)
+        positions = [names.index(column) if column in names else None for column in file_columns]
+        row_id = self.row_counts[table]
+        output = []
+        for values in rows:
+            row_id += 1
+            row = (row_id, *values, self.inserted)
+            output.append([None if position is None else row[position] for position in positions])
+        writer.write(output)
+        self.row_counts[table] = row_id
+
+    def flush(self):
+        if self.pending:
+            self.write_batch()
+        if not self.files:
+            return
+        files, self.files = self.files, OrderedDict()
+        for writer, _ in files.values():
+            writer.close()
+        names = OrderedDict((table, table.split('.', 1)[1]) for table in files)
+        paths = {table: table_path(self.directory, name, self.file_format) for table, name in names.items()}
+        write_manifest(self.directory, {
+            'format': self.file_format,
+            'created': self.inserted,
+            'tables': {name: {'file': os.path.basename(paths[table]), 'columns': files[table][1],
+                              'rows': self.row_counts[table]} for table, name in names.items()}
+        })
+        metrics = self.db_manager.metrics
+        for table, name in names.items():
+            server_path = None
+            if self.server_directory:
+                separator = '\\' if '\\' in self.server_directory else '/'
+                server_path = self.server_directory.rstrip('/\\') + separator + os.path.basename(paths[table])
+            start = time.perf_counter()
+            self.db_manager.bulk_load(table, paths[table], self.file_format, column_kinds(name), server_path)
+            self.load_seconds[table] = time.perf_counter() - start
+            if metrics is not None:
+                metrics.observe(table, 'bulk_load', self.load_seconds[table], self.row_counts[table])
+
+    def report(self):
+        return {'records': self.records_written, 'directory': os.path.abspath(self.directory),
+                'format': self.file_format,
+                'tables': {table: {'rows': rows, 'load_seconds': round(self.load_seconds.get(table, 0.0), 3)}
+                           for table, rows in self.row_counts.items()}}
+
+
+TABLE_SCHEMAS = OrderedDict([
+    ('ConsolidatedTitle', [
+        ('VALUE', 'VARCHAR(500)')
+    ]),
+    ('ConsolidatedDesignation', [
+        ('VALUE', 'VARCHAR(500)')
+    ]),
+    ('ConsolidatedNationality', [
+        ('VALUE', 'VARCHAR(500)')
+    ]),
+    ('ConsolidatedListType', [
+        ('VALUE', 'VARCHAR(500)')
+    ]),
+    ('ConsolidatedLastDayUpdated', [
+        ('VALUE', 'VARCHAR(500)')
+    ]),
+    ('ConsolidatedIndividualAlias', [
+        ('QUALITY', 'VARCHAR(500)'),
+        ('ALIAS_NAME', 'VARCHAR(500)'),
+        ('DATE_OF_BIRTH', 'VARCHAR(500)'),
+        ('NOTE', 'NVARCHAR(max)'),
+        ('CITY_OF_BIRTH', 'VARCHAR(500)'),
+        ('COUNTRY_OF_BIRTH', 'VARCHAR(500)')
+    ]),
+    ('ConsolidatedIndividualAddress', [
+        ('COUNTRY', 'VARCHAR(500)'),
+        ('STREET', 'VARCHAR(500)'),
+        ('CITY', 'VARCHAR(500)'),
+        ('STATE_PROVINCE', 'VARCHAR(500)'),
+        ('NOTE', 'NVARCHAR(max)'),
+        ('ZIP_CODE', 'VARCHAR(500)')
+    ]),
+    ('ConsolidatedIndividualDateOfBirth', [
+        ('TYPE_OF_DATE', 'VARCHAR(500)'),
+        ('YEAR', 'VARCHAR(500)'),
+        ('FROM_YEAR', 'VARCHAR(500)'),
+        ('TO_YEAR', 'VARCHAR(500)'),
+        ('NOTE', 'NVARCHAR(max)'),
+        ('DATE', 'VARCHAR(500)')
+    ]),
+    ('ConsolidatedIndividualPlaceOfBirth', [
+        ('CITY', 'VARCHAR(500)'),
+        ('STATE_PROVINCE', 'VARCHAR(500)'),
+        ('COUNTRY', 'VARCHAR(500)'),
+        ('NOTE', 'NVARCHAR(max)'),
+        ('STREET', 'VARCHAR(500)')
+    ]),
+    ('ConsolidatedIndividualDocument', [
+        ('TYPE_OF_DOCUMENT', 'VARCHAR(500)'),
+        ('TYPE_OF_DOCUMENT2', 'VARCHAR(500)'),
+        ('NUMBER', 'VARCHAR(500)'),
+        ('COUNTRY_OF_ISSUE', 'VARCHAR(500)'),
+        ('NOTE', 'NVARCHAR(max)'),
+        ('ISSUING_COUNTRY', 'VARCHAR(500)'),
+        ('DATE_OF_ISSUE', 'VARCHAR(500)'),
+        ('CITY_OF_ISSUE', 'VARCHAR(500)')
+    ]),
+    ('ConsolidatedIndividual', [
+        ('DATAID', 'VARCHAR(500)'),
+        ('VERSIONNUM', 'VARCHAR(500)'),
+        ('FIRST_NAME', 'VARCHAR(500)'),
+        ('SECOND_NAME', 'VARCHAR(500)'),
+        ('THIRD_NAME', 'VARCHAR(500)'),
+        ('FOURTH_NAME', 'VARCHAR(500)'),
+        ('UN_LIST_TYPE', 'VARCHAR(500)'),
+        ('REFERENCE_NUMBER', 'VARCHAR(500)'),
+        ('LISTED_ON', 'VARCHAR(500)'),
+        ('NAME_ORIGINAL_SCRIPT', 'NVARCHAR(500)'),
+        ('COMMENTS1', 'NVARCHAR(max)'),
+        ('Title_ID', 'INT'),
+        ('Designation_ID', 'INT'),
+        ('Nationality_ID', 'INT'),
+        ('List_type_ID', 'INT'),
+        ('Last_day_updated_ID', 'INT'),
+        ('Individual_alias_ID', 'INT'),
+        ('Individual_address_ID', 'INT'),
+        ('Individual_date_of_birth_ID', 'INT'),
+        ('Individual_place_of_birth_ID', 'INT'),
+        ('Individual_document_ID', 'INT'),
+        ('SORT_KEY', 'VARCHAR(500)'),
+        ('SORT_KEY_LAST_MOD', 'VARCHAR(500)'),
+        ('GENDER', 'VARCHAR(500)')
+    ]),
+    ('ConsolidatedIndividuals', [
+        ('Individual_ID', 'INT')
+    ]),
+    ('ConsolidatedIndividualTitles', [
+        ('Individual_ID', 'INT'),
+        ('Title_ID', 'INT')
+    ]),
+    ('ConsolidatedIndividualDesignations', [
+        ('Individual_ID', 'INT'),
+        ('Designation_ID', 'INT')
+    ]),
+    ('ConsolidatedIndividualNationalities', [
+        ('Individual_ID', 'INT'),
+        ('Nationality_ID', 'INT')
+    ]),
+    ('ConsolidatedIndividualAliases', [
+        ('Individual_ID', 'INT'),
+        ('Individual_alias_ID', 'INT')
+    ]),
+    ('ConsolidatedIndividualAddresses', [
+        ('Individual_ID', 'INT'),
+        ('Individual_address_ID', 'INT')
+    ]),
+    ('ConsolidatedIndividualDatesOfBirth', [
+        ('Individual_ID', 'INT'),
+        ('Individual_date_of_birth_ID', 'INT')
+    ]),
+    ('ConsolidatedIndividualPlacesOfBirth', [
+        ('Individual_ID', 'INT'),
+        ('Individual_place_of_birth_ID', 'INT')
+    ]),
+    ('ConsolidatedIndividualDocuments', [
+        ('Individual_ID', 'INT'),
+        ('Individual_document_ID', 'INT')
+    ]),
+    ('ConsolidatedEntityAlias', [
+        ('QUALITY', 'VARCHAR(500)'),
+        ('ALIAS_NAME', 'VARCHAR(500)'),
+        ('NOTE', 'NVARCHAR(max)')
+    ]),
+    ('ConsolidatedEntityAddress', [
+        ('STREET', 'VARCHAR(500)'),
+        ('CITY', 'VARCHAR(500)'),
+        ('COUNTRY', 'VARCHAR(500)'),
+        ('ZIP_CODE', 'VARCHAR(500)'),
+        ('STATE_PROVINCE', 'VARCHAR(500)'),
+        ('NOTE', 'NVARCHAR(max)')
+    ]),
+    ('ConsolidatedEntity', [
+        ('DATAID', 'VARCHAR(500)'),
+        ('VERSIONNUM', 'VARCHAR(500)'),
+        ('FIRST_NAME', 'VARCHAR(500)'),
+        ('UN_LIST_TYPE', 'VARCHAR(500)'),
+        ('REFERENCE_NUMBER', 'VARCHAR(500)'),
+        ('LISTED_ON', 'VARCHAR(500)'),
+        ('COMMENTS1', 'NVARCHAR(max)'),
+        ('List_type_ID', 'INT'),
+        ('Last_day_updated_ID', 'INT'),
+        ('Entity_alias_ID', 'INT'),
+        ('Entity_address_ID', 'INT'),
+        ('SORT_KEY', 'VARCHAR(500)'),
+        ('SORT_KEY_LAST_MOD', 'VARCHAR(500)'),
+        ('NAME_ORIGINAL_SCRIPT', 'NVARCHAR(500)')
+    ]),
+    ('ConsolidatedEntities', [
+        ('Entity_ID', 'INT')
+    ]),
+    ('ConsolidatedEntityAliases', [
+        ('Entity_ID', 'INT'),
+        ('Entity_alias_ID', 'INT')
+    ]),
+    ('ConsolidatedEntityAddresses', [
+        ('Entity_ID', 'INT'),
+        ('Entity_address_ID', 'INT')
+    ]),
+    ('ConsolidatedScreening', [
+        ('RECORD_TYPE', 'VARCHAR(20)'),
+        ('RECORD_ID', 'INT'),
+        ('DATAID', 'VARCHAR(500)'),
+        ('NAME', 'NVARCHAR(max)'),
+        ('NAME_KIND', 'VARCHAR(20)'),
+        ('NORMALIZED_NAME', 'NVARCHAR(450)'),
+        ('NAME_TOKENS', 'NVARCHAR(450)'),
+        ('DOCUMENT_NUMBERS', 'NVARCHAR(max)'),
+        ('BIRTH_YEARS', 'VARCHAR(500)'),
+        ('NATIONALITIES', 'NVARCHAR(max)')
+    ])
+])
+
+# One row per name variant of every listed record, written by the record writers alongside the record itself.
+SCREENING_TABLE = 'dbo.ConsolidatedScreening'
+SCREENING_TABLE_COLUMNS = [column for column, _ in TABLE_SCHEMAS['ConsolidatedScreening']]
+
+ROW_HASH_COLUMN = ('ROW_HASH', 'BINARY(16)')
+
+TableIndex = namedtuple('TableIndex', ['name', 'table', 'columns', 'unique', 'where'])
+
+# Rows without a hash are left out of the unique ROW_HASH indexes. The record indexes serve the DATAID lookups
+# of delta loads and screening.
+TABLE_INDEXES = [TableIndex(f"UX_{table}_ROW_HASH", table, ['ROW_HASH'], True, 'ROW_HASH IS NOT NULL')
+                 for table in TABLE_SCHEMAS if f"dbo.{table}" in ROW_HASH_TABLES] + [
+    TableIndex(f"IX_{table}_{column}", table, [column], False, None)
+    for table in ('ConsolidatedIndividual', 'ConsolidatedEntity') for column in ('DATAID', 'REFERENCE_NUMBER')
+] + [
+    TableIndex('IX_ConsolidatedScreening_NORMALIZED_NAME', 'ConsolidatedScreening', ['NORMALIZED_NAME'], False, None),
+    TableIndex('IX_ConsolidatedScreening_NAME_TOKENS', 'ConsolidatedScreening', ['NAME_TOKENS'], False, None),
+    TableIndex('IX_ConsolidatedScreening_RECORD', 'ConsolidatedScreening', ['RECORD_TYPE', 'RECORD_ID'], False, None)
+]
+
+
+def table_columns(table):
+    columns = TABLE_SCHEMAS[table]
+    return columns + [ROW_HASH_COLUMN] if f"dbo.{table}" in ROW_HASH_TABLES else columns
+
+
+def column_kinds(table):
+    kinds = {'ID': 'int', 'Inserted': 'text'}
+    for column, column_type in table_columns(table):
+        kinds[column] = 'int' if column_type == 'INT' else 'binary' if column_type.startswith('BINARY') else 'text'
+    return kinds
+
+
+# Child tables first so the order is also safe for backends that enforce foreign keys.
+TRUNCATE_ORDER = [
+    'ConsolidatedScreening',
+    'ConsolidatedIndividualTitles',
+    'ConsolidatedIndividualDesignations',
+    'ConsolidatedIndividualNationalities',
+    'ConsolidatedIndividualAliases',
+    'ConsolidatedIndividualAddresses',
+    'ConsolidatedIndividualDatesOfBirth',
+    'ConsolidatedIndividualPlacesOfBirth',
+    'ConsolidatedIndividualDocuments',
+    'ConsolidatedEntityAliases',
+    'ConsolidatedEntityAddresses',
+    'ConsolidatedEntities',
+    'ConsolidatedIndividuals',
+    'ConsolidatedIndividualDocument',
+    'ConsolidatedIndividualPlaceOfBirth',
+    'ConsolidatedIndividualDateOfBirth',
+    'ConsolidatedIndividualAddress',
+    'ConsolidatedIndividualAlias',
+    'ConsolidatedEntityAlias',
+    'ConsolidatedEntityAddress',
+    'ConsolidatedIndividual',
+    'ConsolidatedEntity',
+    'ConsolidatedLastDayUpdated',
+    'ConsolidatedListType',
+    'ConsolidatedNationality',
+    'ConsolidatedDesignation',
+    'ConsolidatedTitle'
+]
+
+
+def create_tables(db_manager, max_attempts=3):
+    # The script only creates what is missing, so a failed attempt is rolled back and run again in full. Only
+    # transient errors are retried; anything else would fail the same way and is raised.
+    for attempt in range(1, max_attempts + 1):
         try:
-            db_manager.cursor.execute(create_tables_script)
+            upgraded = db_manager.add_row_hash_columns()
+            db_manager.execute_script(db_manager.create_tables_script())
             logging.info("Tables Created")
             break
         except Exception as e:
-            error_message = 'create_tables() Error:', e
-            logging.error(error_message)
+            logging.error(f"create_tables() attempt {attempt} failed: {e}")
+            db_manager.conn.rollback()
+            if attempt == max_attempts or not db_manager.is_transient_error(e):
+                raise
+            time.sleep(backoff_delay(attempt, db_manager.retry_delay))
+    for table in upgraded:
+        backfill_row_hashes(db_manager, table)
     db_manager.conn.commit()
 
 
+def backfill_row_hashes(db_manager, table):
+    # Hashes rows loaded before the ROW_HASH column existed. A duplicate keeps a NULL hash, so the first row
+    # stays the one get-or-create matches.
+    columns = [column for column, _ in TABLE_SCHEMAS[table]]
+    db_manager.cursor.execute(f"SELECT ID, {', '.join(columns)} FROM dbo.{table} ORDER BY ID")
+    updates = []
+    seen = set()
+    for row_id, *values in db_manager.cursor.fetchall():
+        digest = row_hash(tuple(values))
+        if digest is not None and digest not in seen:
+            seen.add(digest)
+            updates.append((digest, row_id))
+    if updates:
+        db_manager.cursor.executemany(f"UPDATE dbo.{table} SET ROW_HASH = ? WHERE ID = ?", updates)
+    logging.info(f"Added ROW_HASH to {table} and hashed {len(updates)} existing rows")
+
+
 def truncate_tables(db_manager):
-    tables_in_order = [
-        "AMLDatabase.dbo.ConsolidatedEntities",
-        "AMLDatabase.dbo.ConsolidatedIndividuals",
-        "AMLDatabase.dbo.ConsolidatedIndividualDocument",
-        "AMLDatabase.dbo.ConsolidatedIndividualPlaceOfBirth",
-        "AMLDatabase.dbo.ConsolidatedIndividualDateOfBirth",
-        "AMLDatabase.dbo.ConsolidatedIndividualAddress",
-        "AMLDatabase.dbo.ConsolidatedIndividualAlias",
-        "AMLDatabase.dbo.ConsolidatedEntityAlias",
-        "AMLDatabase.dbo.ConsolidatedEntityAddress",
-        "AMLDatabase.dbo.ConsolidatedIndividual",
-        "AMLDatabase.dbo.ConsolidatedEntity",
-        "AMLDatabase.dbo.ConsolidatedLastDayUpdated",
-        "AMLDatabase.dbo.ConsolidatedListType",
-        "AMLDatabase.dbo.ConsolidatedNationality",
-        "AMLDatabase.dbo.ConsolidatedDesignation",
-        "AMLDatabase.dbo.ConsolidatedTitle"
-    ]
-
-    for table in tables_in_order:
+    for table in TRUNCATE_ORDER:
         try:
-            db_manager.cursor.execute(f"""TRUNCATE TABLE {table}""")
+            db_manager.cursor.execute(db_manager.truncate_table_sql(table))
         except Exception as e:
             error_message = 'truncate_tables() Error:', e
             logging.error(error_message)
@@ -511,89 +2231,1086 @@ def truncate_tables(db_manager):
     logging.info("All tables truncated.")
 
 
+RECORD_TABLES = OrderedDict([
+    ('dbo.ConsolidatedIndividual', ('dbo.ConsolidatedIndividuals', 'Individual_ID')),
+    ('dbo.ConsolidatedEntity', ('dbo.ConsolidatedEntities', 'Entity_ID'))
+])
+
+RECORD_CHILDREN = {
+    'dbo.ConsolidatedIndividual': INDIVIDUAL_CHILDREN,
+    'dbo.ConsolidatedEntity': ENTITY_CHILDREN
+}
+
+
+class DeltaSync:
+    # Applies only the differences between the incoming list and the currently listed records, keyed on
+    # DATAID and compared on VERSIONNUM. New records go through the regular writer, changed records are
+    # updated in place (keeping their ID and link row) and delisted records are deleted.
+    def __init__(self, db_manager, writer):
+        self.db_manager = db_manager
+        self.writer = writer
+        self.current = {}
+        self.duplicates = {}
+        self.seen = {table: set() for table in RECORD_TABLES}
+        self.changes = {table: {'added': [], 'modified': [], 'removed': []} for table in RECORD_TABLES}
+        self.unchanged = {table: 0 for table in RECORD_TABLES}
+        self.rebuild_screening = False
+
+    def load_current(self):
+        for table, (link_table, link_column) in RECORD_TABLES.items():
+            self.db_manager.cursor.execute(
+                f"SELECT r.ID, r.DATAID, r.VERSIONNUM FROM {table} AS r "
+                f"JOIN {link_table} AS l ON l.{link_column} = r.ID ORDER BY r.ID")
+            current = {}
+            duplicates = []
+            for row_id, dataid, versionnum in self.db_manager.cursor.fetchall():
+                if dataid in current:
+                    duplicates.append(row_id)
+                else:
+                    current[dataid] = (row_id, versionnum)
+            self.current[table] = current
+            self.duplicates[table] = duplicates
+        # Tables loaded before the screening table existed get its rows for their unchanged records too.
+        self.db_manager.cursor.execute(f"SELECT COUNT(*) FROM {SCREENING_TABLE}")
+        self.rebuild_screening = self.db_manager.cursor.fetchone()[0] == 0 and any(self.current.values())
+        if self.rebuild_screening:
+            logging.info("The screening table is empty; it is filled for every record of this load")
+        logging.info("Delta sync baseline: " + ", ".join(
+            f"{len(current)} rows in {table}" for table, current in self.current.items()))
+
+    def add(self, record):
+        dataid = record.fields['DATAID']
+        versionnum = record.fields['VERSIONNUM']
+        self.seen[record.table].add(dataid)
+        stored = self.current[record.table].get(dataid)
+        if stored is None:
+            self.writer.add(record)
+            self.changes[record.table]['added'].append(dataid)
+        elif stored[1] != versionnum:
+            self.update_record(stored[0], record)
+            self.changes[record.table]['modified'].append(dataid)
+        else:
+            self.unchanged[record.table] += 1
+            if self.rebuild_screening:
+                write_screening_rows(self.db_manager, [record], [stored[0]])
+
+    def update_record(self, row_id, record):
+        values = resolve_record_values(self.db_manager, record)
+        assignments = ', '.join(f"{column} = ?" for column in record.columns)
+        self.db_manager.cursor.execute(f"UPDATE {record.table} SET {assignments} WHERE ID = ?", values + [row_id])
+        for link_table, _, _, _, _ in record.children:
+            self.db_manager.cursor.execute(f"DELETE FROM {link_table} WHERE {record.link_column} = ?", (row_id,))
+        insert_children(self.db_manager, record, row_id, dict(zip(record.columns, values)))
+        self.db_manager.cursor.execute(f"DELETE FROM {SCREENING_TABLE} WHERE RECORD_TYPE = ? AND RECORD_ID = ?",
+                                       (RECORD_TYPES[record.table], row_id))
+        write_screening_rows(self.db_manager, [record], [row_id])
+
+    def finish(self):
+        self.writer.flush()
+        if not any(self.seen.values()):
+            raise Exception("Delta sync received no records; refusing to delist every stored record")
+        for table, (link_table, link_column) in RECORD_TABLES.items():
+            removed_ids = list(self.duplicates[table])
+            for dataid, (row_id, _) in self.current[table].items():
+                if dataid not in self.seen[table]:
+                    removed_ids.append(row_id)
+                    self.changes[table]['removed'].append(dataid)
+            for chunk in chunked(removed_ids, MAX_STATEMENT_PARAMETERS - 1):
+                placeholders = ', '.join('?' * len(chunk))
+                self.db_manager.cursor.execute(
+                    f"DELETE FROM {SCREENING_TABLE} WHERE RECORD_TYPE = ? AND RECORD_ID IN ({placeholders})",
+                    [RECORD_TYPES[table]] + chunk)
+                for child_link_table, _, _ in RECORD_CHILDREN[table]:
+                    self.db_manager.cursor.execute(
+                        f"DELETE FROM {child_link_table} WHERE {link_column} IN ({placeholders})", chunk)
+                self.db_manager.cursor.execute(f"DELETE FROM {link_table} WHERE {link_column} IN ({placeholders})",
+                                               chunk)
+                self.db_manager.cursor.execute(f"DELETE FROM {table} WHERE ID IN ({placeholders})", chunk)
+        return self.summary()
+
+    def summary(self):
+        tables = {}
+        for table, changes in self.changes.items():
+            tables[table] = {
+                'added_count': len(changes['added']),
+                'modified_count': len(changes['modified']),
+                'removed_count': len(changes['removed']),
+                'unchanged_count': self.unchanged[table],
+                'added': changes['added'],
+                'modified': changes['modified'],
+                'removed': changes['removed']
+            }
+        return {
+            'generated': datetime.now().isoformat(timespec='seconds'),
+            'added_count': sum(t['added_count'] for t in tables.values()),
+            'modified_count': sum(t['modified_count'] for t in tables.values()),
+            'removed_count': sum(t['removed_count'] for t in tables.values()),
+            'tables': tables
+        }
+
+
+def write_change_summary(summary, path=None):
+    path = path or f"aml_risk_update_changes_{datetime.now().strftime('%d_%m_%Y_%H_%M')}.json"
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    logging.info(f"Change summary: {summary['added_count']} added, {summary['modified_count']} modified, "
+                 f"{summary['removed_count']} removed -> {path}")
+    return path
+
+
+class LoadCheckpoint:
+    # Sits in front of the writer and commits every commit_interval records, recording the payload hash and the
+    # last committed DATAID so that a resumed run skips what is already stored. Delta loads are not skipped:
+    # committed records already carry the new VERSIONNUM and pass through as unchanged, which keeps the removal
+    # detection complete.
+    def __init__(self, db_manager, sink, writer, payload_cache, target, payload_sha256, load_mode,
+                 commit_interval=None, resume_from=None):
+        self.db_manager = db_manager
+        self.sink = sink
+        self.writer = writer
+        self.payload_cache = payload_cache
+        self.target = target
+        self.payload_sha256 = payload_sha256
+        self.load_mode = load_mode
+        self.commit_interval = commit_interval
+        self.position = 0
+        self.committed = 0
+        self.last_dataid = None
+        self.skip = 0
+        self.resume_dataid = None
+        # The state of the last commit, which is where a retry after a transient error resumes.
+        self.saved = resume_from
+        if resume_from is not None:
+            self.committed = resume_from['records_committed']
+            self.last_dataid = resume_from['last_dataid']
+            if load_mode != 'delta':
+                self.skip, self.resume_dataid = self.committed, self.last_dataid
+
+    def add(self, record):
+        self.position += 1
+        if self.position <= self.skip:
+            if self.position == self.skip and record.fields['DATAID'] != self.resume_dataid:
+                raise Exception(f"Checkpoint mismatch: record {self.position} has DATAID "
+                                f"{record.fields['DATAID']}, expected {self.resume_dataid}")
+            return
+        self.sink.add(record)
+        self.last_dataid = record.fields['DATAID']
+        if self.commit_interval and self.position - self.committed >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self.writer.flush()
+        self.db_manager.conn.commit()
+        self.committed = self.position
+        self.saved = {
+            'payload_sha256': self.payload_sha256,
+            'load_mode': self.load_mode,
+            'records_committed': self.committed,
+            'last_dataid': self.last_dataid,
+            'updated': datetime.now().isoformat(timespec='seconds')
+        }
+        if self.payload_cache is not None:
+            self.payload_cache.save_checkpoint(self.target, self.saved)
+        logging.info(f"Committed {self.committed} records (last DATAID {self.last_dataid})")
+
+    def finish(self):
+        # With a commit interval the final commit is checkpointed too, so a crash before the checkpoint is cleared
+        # resumes to a no-op instead of loading the tail twice.
+        if self.commit_interval:
+            self.commit()
+        else:
+            self.db_manager.conn.commit()
+
+    def clear(self):
+        if self.payload_cache is not None and self.payload_cache.checkpoint(self.target) is not None:
+            self.payload_cache.save_checkpoint(self.target, None)
+
+
+# (record type, record table, name columns, alias table, first-alias column)
+SCREENING_SOURCES = [
+    ('INDIVIDUAL', 'dbo.ConsolidatedIndividual', ['FIRST_NAME', 'SECOND_NAME', 'THIRD_NAME', 'FOURTH_NAME'],
+     'dbo.ConsolidatedIndividualAlias', 'Individual_alias_ID'),
+    ('ENTITY', 'dbo.ConsolidatedEntity', ['FIRST_NAME'], 'dbo.ConsolidatedEntityAlias', 'Entity_alias_ID')
+]
+
+
+def screening_names(name_parts, original_script, aliases):
+    names = []
+    for name, kind in [(' '.join(part for part in name_parts if part), 'primary'),
+                       (original_script, 'original_script')] + [(alias, 'alias') for alias in aliases]:
+        if name and (name, kind) not in names:
+            names.append((name, kind))
+    return names
+
+
+def screening_record(record):
+    record_type, table, name_columns, alias_table, alias_column = next(
+        source for source in SCREENING_SOURCES if source[1] == record.table)
+    aliases = [values[columns.index('ALIAS_NAME')] for _, _, table, columns, values_list in record.children
+               if table == alias_table for values in values_list]
+    return (record_type, record.fields['DATAID'], record.fields['VERSIONNUM'],
+            screening_names([record.fields[column] for column in name_columns],
+                            record.fields['NAME_ORIGINAL_SCRIPT'], aliases))
+
+
+def record_child_values(record, table, column):
+    return [values[columns.index(column)] for _, _, child_table, columns, values_list in record.children
+            if child_table == table for values in values_list if values[columns.index(column)]]
+
+
+def birth_years(record):
+    years = []
+    for column in ('YEAR', 'DATE', 'FROM_YEAR', 'TO_YEAR'):
+        years += [value[:4] for value in record_child_values(record, 'dbo.ConsolidatedIndividualDateOfBirth', column)
+                  if value[:4].isdigit()]
+    return ' '.join(sorted(set(years))) or None
+
+
+def screening_table_rows(records, record_ids):
+    # Everything a screening query filters on, pre-normalized with the functions screening.py matches with.
+    rows = []
+    for record, record_id in zip(records, record_ids):
+        record_type, dataid, _, names = screening_record(record)
+        documents = ' '.join(unique(map(normalize_document_number, record_child_values(
+            record, 'dbo.ConsolidatedIndividualDocument', 'NUMBER')))) or None
+        years = birth_years(record)
+        nationalities = joined(unique(record_child_values(record, 'dbo.ConsolidatedNationality', 'VALUE')))
+        for name, kind in names:
+            normalized = normalize_name(name)
+            if normalized:
+                rows.append((record_type, record_id, dataid, name, kind, normalized[:450],
+                             name_tokens(normalized)[:450], documents, years, nationalities))
+    return rows
+
+
+def write_screening_rows(db_manager, records, record_ids):
+    rows = screening_table_rows(records, record_ids)
+    if rows:
+        db_manager.cursor.executemany(db_manager.statement('insert', SCREENING_TABLE, SCREENING_TABLE_COLUMNS), rows)
+
+
+def screening_records_from_db(db_manager):
+    cursor = db_manager.cursor
+    for record_type, table, name_columns, alias_table, alias_column in SCREENING_SOURCES:
+        link_table, link_column = RECORD_TABLES[table]
+        child_link_table = next(link for link, fk_column, _ in RECORD_CHILDREN[table] if fk_column == alias_column)
+        # Aliases come from the link table and from the first-alias column, which is all that loads made before
+        # the link tables existed recorded.
+        cursor.execute(
+            f"SELECT k.{link_column}, a.ALIAS_NAME FROM {child_link_table} AS k "
+            f"JOIN {alias_table} AS a ON a.ID = k.{alias_column} "
+            f"UNION SELECT r.ID, a.ALIAS_NAME FROM {table} AS r JOIN {alias_table} AS a ON a.ID = r.{alias_column}")
+        aliases = {}
+        for record_id, alias in cursor.fetchall():
+            aliases.setdefault(record_id, []).append(alias)
+        cursor.execute(
+            f"SELECT r.ID, r.DATAID, r.VERSIONNUM, r.NAME_ORIGINAL_SCRIPT, {', '.join(f'r.{c}' for c in name_columns)} "
+            f"FROM {table} AS r JOIN {link_table} AS l ON l.{link_column} = r.ID ORDER BY r.ID")
+        for record_id, dataid, versionnum, original_script, *name_parts in cursor.fetchall():
+            yield record_type, dataid, versionnum, screening_names(name_parts, original_script,
+                                                                   sorted(aliases.get(record_id, []), key=str))
+
+
+def update_screening_index(db_manager, path):
+    # Runs after the load has committed, so a failure here is logged without failing the load itself.
+    try:
+        index = None
+        if os.path.exists(path):
+            try:
+                index = ScreeningIndex.load(path)
+            except Exception as e:
+                logging.warning(f"Rebuilding the screening index; could not load {path}: {e}")
+        index = index or ScreeningIndex()
+        index.refresh(list(screening_records_from_db(db_manager)))
+        index.save(path)
+        return True
+    except Exception as e:
+        logging.error(f"Screening index update failed: {e}")
+        return False
+
+
+UpdateResult = namedtuple('UpdateResult', ['status', 'title', 'message'])
+ParsedPayload = namedtuple('ParsedPayload', ['source', 'sha256', 'records'])
+
+
+SNAPSHOT_COLUMNS = [
+    'RECORD_TYPE', 'DATAID', 'VERSIONNUM', 'NAME', 'NAME_ORIGINAL_SCRIPT', 'REFERENCE_NUMBER', 'UN_LIST_TYPE',
+    'LISTED_ON', 'LIST_TYPE', 'NATIONALITIES', 'ALIASES', 'DATES_OF_BIRTH', 'DOCUMENT_NUMBERS', 'DIGEST'
+]
+
+RECORD_TYPES = {parser.mapping.table: tag for tag, parser in RECORD_PARSERS.items()}
+
+
+def joined(values):
+    return '; '.join(value for value in values if value) or None
+
 
+def snapshot_row(record):
+    # One flat row per record; DIGEST covers every parsed value, so diffs also see changes that kept VERSIONNUM.
+    fields = record.fields
+    children = {fk_column: (columns, values_list) for _, fk_column, _, columns, values_list in record.children}
 
-def process_data(progress_var, status_label, root, db_details):
-    db_manager = DatabaseManager()
+    def child_values(suffix, *names):
+        return [next((values[columns.index(name)] for name in names if values[columns.index(name)]), None)
+                for fk_column, (columns, values_list) in children.items() if fk_column.endswith(suffix)
+                for values in values_list]
+
+    digest = hashlib.sha1(repr((sorted(fields.items()), [values for _, _, _, values in record.lookups],
+                                [values_list for _, _, _, _, values_list in record.children])).encode())
+    return (RECORD_TYPES[record.table], fields['DATAID'], fields['VERSIONNUM'],
+            ' '.join(fields[column] for column in ('FIRST_NAME', 'SECOND_NAME', 'THIRD_NAME', 'FOURTH_NAME')
+                     if fields.get(column)) or None,
+            fields.get('NAME_ORIGINAL_SCRIPT'), fields.get('REFERENCE_NUMBER'), fields.get('UN_LIST_TYPE'),
+            fields.get('LISTED_ON'),
+            next((values[0] for fk_column, _, _, values in record.lookups if fk_column == 'List_type_ID'), None),
+            joined(child_values('Nationality_ID', 'VALUE')), joined(child_values('alias_ID', 'ALIAS_NAME')),
+            joined(child_values('date_of_birth_ID', 'DATE', 'YEAR')),
+            joined(child_values('document_ID', 'NUMBER')), digest.hexdigest()[:16])
+
+
+class SnapshotCollector:
+    # Sits in front of the load sink and keeps a snapshot row of every record, including records a resumed
+    # run skips, so the snapshot always holds the complete list version.
+    def __init__(self, sink):
+        self.sink = sink
+        self.rows = []
+
+    def add(self, record):
+        self.rows.append(snapshot_row(record))
+        self.sink.add(record)
+
+
+def update_snapshot_store(directory, retention, rows, metadata):
+    # Like the screening index, the snapshot is written after the load has committed and never fails the load.
     try:
-        url = "https://scsanctions.un.org/resources/xml/en/consolidated.xml"
+        return SnapshotStore(directory, retention).save(SNAPSHOT_COLUMNS, rows, 'DATAID', metadata)
+    except Exception as e:
+        logging.error(f"Snapshot update failed: {e}")
+        return None
+
+
+class LoadCancelled(Exception):
+    pass
+
 
-        session = requests.Session()
-        adapter = SSLAdapter()
-        session.mount('https://', adapter)
+class ProgressReporter:
+    # Coalesces per-record progress into at most one callback per interval (10 Hz by default), with the
+    # throughput and ETA computed here so the receiving side only has to display them.
+    def __init__(self, callback, interval=0.1):
+        self.callback = callback
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last_emit = 0.0
+
+    def update(self, processed, fraction, label, force=False):
+        now = time.perf_counter()
+        if not force and now - self.last_emit < self.interval:
+            return
+        self.last_emit = now
+        elapsed = now - self.start
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        eta = elapsed * (1 - fraction) / fraction if fraction and fraction < 1 else None
+        self.callback({
+            'processed': processed,
+            'percent': fraction * 100,
+            'label': label,
+            'rate': rate,
+            'eta': eta
+        })
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class RunMetrics:
+    # Per-run instrumentation. It only exists when a report is requested; every hook in the load path checks
+    # for None first, so a normal run pays nothing beyond that check.
+    def __init__(self, profile=False, trace_memory=False):
+        self.started = datetime.now()
+        self.phases = OrderedDict()
+        self.current_phase = None
+        self.phase_start = None
+        self.tables = {}
+        self.cache = {}
+        self.records = 0
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.trace_memory = trace_memory
+        self.memory = None
+        if profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+    def start(self):
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        self.end_phase()
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.trace_memory:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            tracemalloc.stop()
+            self.memory = {
+                'current_bytes': current,
+                'peak_bytes': peak,
+                'top_allocations': [{'location': str(stat.traceback), 'bytes': stat.size, 'blocks': stat.count}
+                                    for stat in top]
+            }
+
+    def start_phase(self, name):
+        now = time.perf_counter()
+        self.end_phase(now)
+        self.current_phase = name
+        self.phase_start = now
+
+    def end_phase(self, now=None):
+        if self.current_phase is None:
+            return
+        elapsed = (now or time.perf_counter()) - self.phase_start
+        self.phases[self.current_phase] = self.phases.get(self.current_phase, 0.0) + elapsed
+        self.current_phase = None
+
+    @contextmanager
+    def phase(self, name):
+        self.start_phase(name)
+        try:
+            yield
+        finally:
+            self.end_phase()
+
+    def observe(self, table, operation, seconds, rows=1):
+        with self.lock:
+            operations = self.tables.setdefault(table, {})
+            stats = operations.get(operation)
+            if stats is None:
+                stats = operations[operation] = {'calls': 0, 'rows': 0, 'seconds': 0.0,
+                                                 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+            stats['calls'] += 1
+            stats['rows'] += rows
+            stats['seconds'] += seconds
+            stats['buckets'][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def report(self, result):
+        tables = {}
+        for table in sorted(set(self.tables) | set(self.cache)):
+            table_report = {operation: dict(stats, seconds=round(stats['seconds'], 6))
+                            for operation, stats in self.tables.get(table, {}).items()}
+            cache = self.cache.get(table)
+            if cache:
+                lookups = cache['hits'] + cache['misses']
+                table_report['cache'] = dict(cache, hit_rate=round(cache['hits'] / lookups, 4) if lookups else None)
+            tables[table] = table_report
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'status': result.status,
+            'message': result.message,
+            'records': self.records,
+            'total_seconds': round(sum(self.phases.values()), 6),
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            'latency_buckets': list(LATENCY_BUCKETS),
+            'tables': tables,
+            'memory': self.memory
+        }
+
+    def prometheus_text(self, result):
+        lines = [
+            "# HELP aml_risk_update_last_run_timestamp_seconds Start time of the last run.",
+            "# TYPE aml_risk_update_last_run_timestamp_seconds gauge",
+            f"aml_risk_update_last_run_timestamp_seconds {self.started.timestamp():.0f}",
+            "# HELP aml_risk_update_last_run_success Whether the last run succeeded or was already up to date.",
+            "# TYPE aml_risk_update_last_run_success gauge",
+            f"aml_risk_update_last_run_success {int(result.status in ('success', 'up_to_date'))}",
+            "# HELP aml_risk_update_records Records processed by the last run.",
+            "# TYPE aml_risk_update_records gauge",
+            f"aml_risk_update_records {self.records}",
+            "# HELP aml_risk_update_phase_seconds Wall time of each phase of the last run.",
+            "# TYPE aml_risk_update_phase_seconds gauge"
+        ]
+        lines += [f'aml_risk_update_phase_seconds{{phase="{name}"}} {seconds:.6f}'
+                  for name, seconds in self.phases.items()]
+        lines += ["# HELP aml_risk_update_table_rows Rows looked up or inserted per table in the last run.",
+                  "# TYPE aml_risk_update_table_rows gauge"]
+        lines += [f'aml_risk_update_table_rows{{table="{table}",operation="{operation}"}} {stats["rows"]}'
+                  for table, operations in sorted(self.tables.items()) for operation, stats in operations.items()]
+        lines += ["# HELP aml_risk_update_cache_lookups Lookup cache lookups per table in the last run.",
+                  "# TYPE aml_risk_update_cache_lookups gauge"]
+        for table, cache in sorted(self.cache.items()):
+            lines.append(f'aml_risk_update_cache_lookups{{table="{table}",result="hit"}} {cache["hits"]}')
+            lines.append(f'aml_risk_update_cache_lookups{{table="{table}",result="miss"}} {cache["misses"]}')
+        lines += ["# HELP aml_risk_update_query_seconds Latency of lookup and insert calls per table in the last run.",
+                  "# TYPE aml_risk_update_query_seconds histogram"]
+        for table, operations in sorted(self.tables.items()):
+            for operation, stats in operations.items():
+                labels = f'table="{table}",operation="{operation}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats['buckets']):
+                    cumulative += count
+                    lines.append(f'aml_risk_update_query_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'aml_risk_update_query_seconds_sum{{{labels}}} {stats["seconds"]:.6f}')
+                lines.append(f'aml_risk_update_query_seconds_count{{{labels}}} {stats["calls"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def write_atomically(path, text):
+    # The textfile collector may read at any moment, so the file is replaced rather than rewritten in place.
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, path)
+
+
+def measure(metrics, name):
+    return metrics.phase(name) if metrics is not None else nullcontext()
+
+
+def process_data(db_details, metrics_report=None, prometheus_file=None, profile_output=None, trace_memory=False,
+                 **load_options):
+    if not (metrics_report or prometheus_file or profile_output or trace_memory):
+        return run_update(db_details, **load_options)
+
+    metrics = RunMetrics(profile=bool(profile_output), trace_memory=trace_memory)
+    metrics.start()
+    try:
+        result = run_update(db_details, metrics=metrics, **load_options)
+    finally:
+        metrics.stop()
+    if profile_output:
+        metrics.profiler.dump_stats(profile_output)
+        logging.info(f"Profile written to {profile_output}")
+    report = metrics.report(result)
+    if metrics_report or trace_memory:
+        metrics_report = metrics_report or f"aml_risk_update_report_{datetime.now().strftime('%d_%m_%Y_%H_%M')}.json"
+        with open(metrics_report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"Run report written to {metrics_report}")
+    if prometheus_file:
+        write_atomically(prometheus_file, metrics.prometheus_text(result))
+    logging.info("Phase timings: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in metrics.phases.items()))
+    return result
+
+
+def run_update(db_details, progress=None, cancel_event=None, cache_size=10000, preload_cache=True, writer='batch',
+               batch_size=500, auto_tune_batch=False, load_mode='full', change_summary_path=None,
+               input_file=None, use_mmap=False, cache_dir='aml_cache', force=False, pipeline=False,
+               record_queue_size=1000, progress_interval=0.1, session=None, db_manager=None, workers=4,
+               screening_index=None, metrics=None, commit_interval=None, resume=False, sources=None,
+               source_locations=None, snapshot_dir=None, snapshot_retention=30, export_dir='aml_export',
+               export_format='csv', bulk_server_dir=None, parsed_payload=None, payload_cache=None, db_retries=3,
+               db_retry_delay=1.0):
+    db_manager = db_manager or create_database_manager(db_details)
+    db_manager.metrics = metrics
+    db_manager.retry_delay = db_retry_delay
+    if writer == 'parallel' and load_mode == 'delta':
+        # Delta updates run on the main connection while the writer flushes, which would make the workers wait
+        # on its locks.
+        logging.warning("The parallel writer does not support delta loads; using the batch writer")
+        writer = 'batch'
+    if writer == 'parallel' and (commit_interval or resume):
+        # Parallel workers commit their own tasks, so a failed flush can leave records past the checkpoint behind.
+        logging.warning("The parallel writer does not support checkpoints; using the batch writer")
+        writer = 'batch'
+    if writer == 'bulk' and (load_mode == 'delta' or commit_interval or resume):
+        # The bulk writer numbers rows from 1 and loads everything at the end, so it needs empty tables and a
+        # single transaction.
+        logging.warning("The bulk writer only runs full and shadow loads without checkpoints; using the batch writer")
+        writer = 'batch'
+    if parsed_payload is not None:
+        # Multi-target loads download and parse once and hand every target the same records.
+        sources = input_file = None
+        pipeline = False
+    if sources:
+        source_locations = dict(source_locations or {})
+        if input_file:
+            source_locations.setdefault('un', input_file)
+            input_file = None
+        if pipeline:
+            logging.warning("The streaming pipeline reads the UN list only; sources are fetched and parsed in full")
+            pipeline = False
+    if pipeline and (commit_interval or resume):
+        # A checkpoint needs the payload hash, which the pipeline only knows once the download has finished.
+        logging.warning("Checkpointed loads read a downloaded payload; the streaming pipeline is disabled")
+        pipeline = False
+    xml_path = None
+    temporary_payload = False
+    pipeline_stream = None
+    source_records = None
+    checkpoint = None
+    try:
+        url = SOURCE_ADAPTERS['un'].url
+        if payload_cache is None and cache_dir:
+            payload_cache = PayloadCache(cache_dir)
+        target = database_target(db_details)
+        resume_from = None
+        if resume:
+            if payload_cache is None:
+                raise Exception("Resuming a load needs the payload cache; do not disable --cache-dir")
+            resume_from = payload_cache.checkpoint(target)
+            if resume_from is None:
+                logging.warning("No checkpoint to resume from; starting a new load")
 
         try:
-            response = session.get(url, timeout=30)
-            response.raise_for_status()
-        except requests.exceptions.Timeout:
+            with measure(metrics, 'download'):
+                if parsed_payload is not None:
+                    url, payload_sha256, source_records = parsed_payload
+                    status_code = 200
+                elif sources:
+                    url = ', '.join(sources)
+                    status_code = 200
+                    if session is None and needs_session(sources=sources, source_locations=source_locations):
+                        session = create_session()
+                    payload_sha256, source_records = fetch_sources(session, sources, payload_cache,
+                                                                   source_locations)
+                elif resume_from is not None and not input_file and \
+                        os.path.exists(payload_cache.payload_path(resume_from['payload_sha256'])):
+                    # The interrupted run's payload is still cached, so there is nothing to download.
+                    payload_sha256 = resume_from['payload_sha256']
+                    status_code, xml_path = 200, payload_cache.payload_path(payload_sha256)
+                elif input_file:
+                    url = os.path.abspath(input_file)
+                    status_code, xml_path, payload_sha256 = 200, input_file, sha256_file(input_file)
+                else:
+                    session = session or create_session()
+                    if pipeline:
+                        pipeline_stream = StreamingPipeline(session, url, payload_cache,
+                                                            record_queue_size=record_queue_size)
+                        status_code, payload_sha256 = pipeline_stream.open(), pipeline_stream.sha256
+                    else:
+                        status_code, xml_path, payload_sha256, temporary_payload = fetch_payload(session, url,
+                                                                                                 payload_cache)
+        except request_errors('Timeout'):
             error_message = "Request timed out. Please try again later."
-            messagebox.showerror("Timeout Error", error_message)
             logging.error(error_message)
-            return
-        except requests.exceptions.RequestException as e:
+            return UpdateResult('network_error', "Timeout Error", error_message)
+        except request_errors() as e:
             error_message = f"Network error occurred: {e}"
-            messagebox.showerror("Network Error", error_message)
             logging.error(error_message)
-            return
+            return UpdateResult('network_error', "Network Error", error_message)
         logging.info(f"Request URL: {url}")
-        if response.status_code == 200:
-            xml_content = response.content
-            xml_root = ET.fromstring(xml_content)
-
-            individuals = xml_root.findall('.//INDIVIDUAL')
-            entities = xml_root.findall('.//ENTITY')
-
-            logging.info(f"Found {len(individuals)} individuals and {len(entities)} entities")
+        if status_code in (200, 304):
+            if resume_from is not None and (resume_from['payload_sha256'] != payload_sha256 or
+                                            resume_from['load_mode'] != load_mode):
+                logging.warning("The checkpoint belongs to a different payload or load mode; starting a new load")
+                resume_from = None
+            if payload_cache is not None and not force and payload_sha256 and \
+                    payload_cache.loaded_hash(target) == payload_sha256:
+                message = f"The sanctions list has not changed since the last successful load ({payload_sha256[:12]})."
+                logging.info(message + " Skipping the database phase.")
+                if screening_index and not os.path.exists(screening_index):
+                    db_manager.connect_to_database(**connection_details(db_details))
+                    with measure(metrics, 'screening_index'):
+                        update_screening_index(db_manager, screening_index)
+                return UpdateResult('up_to_date', "Up to date", message)
+            if source_records is not None:
+                counts = dict.fromkeys(RECORD_TAGS, 0)
+                for tag, _ in source_records:
+                    counts[tag] += 1
+            elif pipeline_stream is None:
+                with measure(metrics, 'count_records'):
+                    counts = count_records(xml_path, use_mmap=use_mmap)
+                logging.info(f"Found {counts['INDIVIDUAL']} individuals and {counts['ENTITY']} entities")
         else:
             error_message = '''Could not find any data on individuals or entities on the URL! Program finished unsuccessfully. Please check the URL and try again.'''
-            messagebox.showerror("Fail", error_message)
             logging.error(error_message)
-            return
+            return UpdateResult('no_data', "Fail", error_message)
+
+        total_items = counts['INDIVIDUAL'] + counts['ENTITY'] if pipeline_stream is None else None
+        if cancel_event is not None and cancel_event.is_set():
+            raise LoadCancelled()
 
-        total_items = len(individuals) + len(entities)
-
-        db_manager.connect_to_database(**db_details)
-        create_tables(db_manager)
-        truncate_tables(db_manager)
-
-        processed_items = 0
-
-        for individual in individuals:
-            individual_id = insert_individual(db_manager, individual)
-            db_manager.cursor.execute("INSERT INTO dbo.ConsolidatedIndividuals (Individual_ID) VALUES (?)",
-                                      individual_id)
-            processed_items += 1
-            progress = (processed_items / total_items) * 100
-            progress_var.set(progress)
-            status_label.config(text=f"Processing individuals: {progress:.1f}%")
-            root.update_idletasks()
-
-        for entity in entities:
-            entity_id = insert_entity(db_manager, entity)
-            db_manager.cursor.execute("INSERT INTO dbo.ConsolidatedEntities (Entity_ID) VALUES (?)", entity_id)
-            processed_items += 1
-            progress = (processed_items / total_items) * 100
-            progress_var.set(progress)
-            status_label.config(text=f"Processing entities: {progress:.1f}%")
-            root.update_idletasks()
-
-        db_manager.conn.commit()
-        messagebox.showinfo("Success", "Risk updates completed successfully!")
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                if writer == 'parallel':
+                    db_manager.pool_size = max(db_manager.pool_size, workers + 1)
+                if attempt == 1 or db_manager.conn is None:
+                    with measure(metrics, 'connect'):
+                        db_manager.connect_to_database(**connection_details(db_details))
+                with measure(metrics, 'create_tables'):
+                    create_tables(db_manager)
+                with measure(metrics, 'truncate'):
+                    if load_mode == 'shadow':
+                        if resume_from is None:
+                            db_manager.prepare_shadow_tables()
+                        db_manager.use_shadow_tables()
+                    elif load_mode != 'delta' and resume_from is None:
+                        truncate_tables(db_manager)
+                    if writer == 'parallel':
+                        # Workers write on their own connections and would block on the uncommitted truncate.
+                        db_manager.conn.commit()
+
+                if cache_size and writer not in ('parallel', 'bulk'):
+                    db_manager.lookup_cache = LookupCache(max_entries=cache_size)
+                    # Full and shadow loads start from empty tables, so there is only something to preload when
+                    # the rows are kept: delta loads and resumed loads.
+                    if preload_cache and (load_mode == 'delta' or resume_from is not None):
+                        with measure(metrics, 'preload_cache'):
+                            db_manager.lookup_cache.preload(db_manager)
+
+                if writer == 'batch':
+                    record_writer = BatchWriter(db_manager, batch_size=batch_size, auto_tune=auto_tune_batch)
+                elif writer == 'parallel':
+                    record_writer = ParallelWriter(db_manager, workers=workers)
+                elif writer == 'bulk':
+                    record_writer = BulkWriter(db_manager, export_dir, export_format, batch_size=batch_size,
+                                               server_directory=bulk_server_dir)
+                else:
+                    record_writer = RowWriter(db_manager)
+                delta_sync = None
+                if load_mode == 'delta':
+                    delta_sync = DeltaSync(db_manager, record_writer)
+                    with measure(metrics, 'delta_baseline'):
+                        delta_sync.load_current()
+                checkpoint = LoadCheckpoint(db_manager, delta_sync or record_writer, record_writer, payload_cache,
+                                            target, payload_sha256, load_mode, commit_interval, resume_from)
+                if resume_from is not None:
+                    logging.info(f"Resuming after {resume_from['records_committed']} committed records "
+                                 f"(last DATAID {resume_from['last_dataid']})")
+                sink = checkpoint
+                if snapshot_dir:
+                    sink = SnapshotCollector(checkpoint)
+                labels = {'INDIVIDUAL': "individuals", 'ENTITY': "entities"}
+                phase_names = {'INDIVIDUAL': 'insert_individuals', 'ENTITY': 'insert_entities'}
+                reporter = ProgressReporter(progress, progress_interval) if progress is not None else None
+                processed_items = 0
+
+                def report_progress(tag, fraction=None):
+                    nonlocal processed_items
+                    processed_items += 1
+                    # Records arrive individuals first, then entities, so the phase only changes once.
+                    if metrics is not None and metrics.current_phase != phase_names[tag]:
+                        metrics.start_phase(phase_names[tag])
+                    if fraction is None:
+                        fraction = processed_items / max(total_items, 1) if total_items else 0.0
+                    if reporter is not None:
+                        reporter.update(processed_items, fraction, labels[tag])
+                    # Only stop between batches so a cancelled run never leaves a half-written batch behind.
+                    if cancel_event is not None and cancel_event.is_set() and \
+                            not getattr(record_writer, 'pending', None):
+                        raise LoadCancelled()
+
+                if pipeline_stream is not None:
+                    pipeline_stream.run(sink, report_progress)
+                    payload_sha256 = pipeline_stream.sha256
+                    logging.info(f"Streamed {processed_items} records")
+                elif source_records is not None:
+                    for tag, record in source_records:
+                        sink.add(record)
+                        report_progress(tag)
+                else:
+                    with open_payload(xml_path, use_mmap) as payload:
+                        for tag, element in iter_records(payload):
+                            sink.add(RECORD_PARSERS[tag](element))
+                            report_progress(tag)
+
+                if metrics is not None:
+                    metrics.records = processed_items
+                with measure(metrics, 'flush'):
+                    if delta_sync is not None:
+                        write_change_summary(delta_sync.finish(), change_summary_path)
+                    else:
+                        record_writer.flush()
+                if writer == 'batch':
+                    logging.info(f"Batch writer: {record_writer.records_written} records in "
+                                 f"{record_writer.batches_written} batches "
+                                 f"(final batch size {record_writer.batch_size})")
+                elif writer in ('parallel', 'bulk'):
+                    logging.info(f"{writer.capitalize()} writer report: {json.dumps(record_writer.report())}")
+                if reporter is not None:
+                    reporter.update(processed_items, 1.0, "records", force=True)
+
+                with measure(metrics, 'commit'):
+                    checkpoint.finish()
+                if load_mode == 'shadow':
+                    with measure(metrics, 'swap'):
+                        db_manager.build_shadow_indexes()
+                        db_manager.swap_shadow_tables()
+                    db_manager.use_shadow_tables(False)
+                    logging.info("Shadow tables swapped in; the previous generation is kept for rollback")
+                break
+            except Exception as e:
+                # A transient error retries the database phase with the payload at hand instead of failing the
+                # run. With a commit interval the retry resumes after the last commit, so only the batch that
+                # failed is written again. A streamed payload cannot be read twice.
+                if attempt > db_retries or pipeline_stream is not None or not db_manager.is_transient_error(e):
+                    raise
+                delay = backoff_delay(attempt, db_retry_delay)
+                logging.warning(f"Transient database error on attempt {attempt} of {db_retries + 1}: {e}; "
+                                f"retrying in {delay:.1f}s")
+                db_manager.use_shadow_tables(False)
+                if db_manager.conn:
+                    try:
+                        db_manager.conn.rollback()
+                    except Exception:
+                        pass
+                    # After a deadlock or lock timeout the connection is still good and is kept.
+                    if not db_manager.check_connection():
+                        db_manager.close_connection()
+                db_manager.lookup_cache = None
+                if checkpoint is not None and checkpoint.saved is not None:
+                    resume_from = checkpoint.saved
+                if (cancel_event or threading.Event()).wait(delay):
+                    raise LoadCancelled()
+        checkpoint.clear()
+        if payload_cache is not None:
+            payload_cache.mark_loaded(target, payload_sha256)
+        if snapshot_dir:
+            with measure(metrics, 'snapshot'):
+                update_snapshot_store(snapshot_dir, snapshot_retention, sink.rows,
+                                      {'source': url, 'payload_sha256': payload_sha256})
+        if screening_index:
+            with measure(metrics, 'screening_index'):
+                update_screening_index(db_manager, screening_index)
+        if db_manager.lookup_cache is not None:
+            db_manager.lookup_cache.log_stats()
         logging.info("Risk updating completed successfully!")
+        return UpdateResult('success', "Success", "Risk updates completed successfully!")
+    except LoadCancelled:
+        db_manager.use_shadow_tables(False)
+        if db_manager.conn:
+            db_manager.conn.rollback()
+        message = "Risk update cancelled. No changes were saved."
+        if checkpoint is not None and checkpoint.committed:
+            message = (f"Risk update cancelled after {checkpoint.committed} committed records. "
+                       f"Run again with --resume to continue.")
+        logging.info(message)
+        return UpdateResult('cancelled', "Cancelled", message)
     except Exception as e:
+        db_manager.use_shadow_tables(False)
         if db_manager.conn:
             db_manager.conn.rollback()
         error_message = f"Error occurred during processing: {e}"
+        if checkpoint is not None and checkpoint.committed:
+            error_message += f" ({checkpoint.committed} records are committed; run again with --resume to continue)"
         logging.error(error_message)
-        messagebox.showerror("Error", error_message)
+        return UpdateResult('error', "Error", error_message)
     finally:
+        if metrics is not None and db_manager.lookup_cache is not None:
+            metrics.cache = db_manager.lookup_cache.stats()
         if db_manager.conn:
             db_manager.close_connection()
+        if pipeline_stream is not None:
+            pipeline_stream.close()
+        if temporary_payload and os.path.exists(xml_path):
+            os.remove(xml_path)
+
 
+def rollback_generation(db_details, cache_dir='aml_cache', db_manager=None):
+    db_manager = db_manager or create_database_manager(db_details)
+    try:
+        db_manager.connect_to_database(**connection_details(db_details))
+        if not db_manager.has_previous_generation():
+            return UpdateResult('no_data', "No Previous Data", "There is no previous generation to roll back to.")
+        db_manager.restore_previous_tables()
+        if cache_dir:
+            # The restored tables no longer match the last loaded list, so the next run must not short-circuit.
+            PayloadCache(cache_dir).mark_loaded(database_target(db_details), None)
+        logging.info("Previous generation restored")
+        return UpdateResult('success', "Rolled Back", "The previous generation of the risk tables is live again.")
+    except Exception as e:
+        if db_manager.conn:
+            db_manager.conn.rollback()
+        error_message = f"Error occurred during rollback: {e}"
+        logging.error(error_message)
+        return UpdateResult('error', "Error", error_message)
+    finally:
+        if db_manager.conn:
+            db_manager.close_connection()
+
+TargetResult = namedtuple('TargetResult', ['name', 'status', 'title', 'message', 'attempts', 'seconds'])
+
+# Only a failed load is retried; a cancelled, unchanged or empty one would end the same way again.
+TARGET_RETRY_STATUSES = ('error',)
+
+# Load options a target may override in the target file. The payload options are not among them because the
+# list is downloaded and parsed once for all targets.
+TARGET_OPTIONS = (
+    'load_mode', 'writer', 'batch_size', 'auto_tune_batch', 'workers', 'cache_size', 'preload_cache', 'force',
+    'db_retries', 'db_retry_delay', 'commit_interval', 'resume', 'change_summary_path', 'export_dir',
+    'export_format', 'bulk_server_dir', 'screening_index', 'snapshot_dir', 'snapshot_retention', 'metrics_report',
+    'prometheus_file'
+)
+
+# Options that name a file or directory. Unless a target sets its own, it gets the shared one suffixed with its
+# name, so concurrent loads never write the same file.
+TARGET_PATH_OPTIONS = {
+    'change_summary_path': 'file',
+    'screening_index': 'file',
+    'metrics_report': 'file',
+    'prometheus_file': 'file',
+    'export_dir': 'directory',
+    'snapshot_dir': 'directory'
+}
+
+
+def target_path(path, name, kind):
+    if kind == 'directory':
+        return os.path.join(path, name)
+    root, extension = os.path.splitext(path)
+    return f"{root}_{name}{extension}"
+
+
+def parse_payload(session=None, payload_cache=None, input_file=None, use_mmap=False, sources=None,
+                  source_locations=None):
+    # Downloads and parses the list into memory. Returns None when the download has no data. The writers only
+    # read parsed records, so every target of a multi-target load shares the same list.
+    if sources:
+        locations = dict(source_locations or {})
+        if input_file:
+            locations.setdefault('un', input_file)
+        if session is None and needs_session(sources=sources, source_locations=locations):
+            session = create_session()
+        payload_sha256, records = fetch_sources(session, sources, payload_cache, locations)
+        return ParsedPayload(', '.join(sources), payload_sha256, records)
+    if input_file:
+        url, path, payload_sha256, temporary = os.path.abspath(input_file), input_file, sha256_file(input_file), False
+    else:
+        url = SOURCE_ADAPTERS['un'].url
+        status_code, path, payload_sha256, temporary = fetch_payload(session or create_session(), url, payload_cache)
+        if status_code not in (200, 304):
+            return None
+    try:
+        with open_payload(path, use_mmap) as payload:
+            records = [(tag, RECORD_PARSERS[tag](element)) for tag, element in iter_records(payload)]
+    finally:
+        if temporary:
+            os.remove(path)
+    return ParsedPayload(url, payload_sha256, records)
+
+
+def load_target(target, parsed_payload, payload_cache=None, cancel_event=None, db_manager=None, **load_options):
+    # A failed attempt is rolled back, so the next one starts over, or resumes after the last checkpoint when
+    # the target commits in intervals. The delay backs off exponentially with jitter.
+    name = target['name']
+    options = dict(load_options, **target['options'])
+    for option, kind in TARGET_PATH_OPTIONS.items():
+        if options.get(option) and option not in target['options']:
+            options[option] = target_path(options[option], name, kind)
+    start = time.perf_counter()
+    attempts = 0
+    created_manager = db_manager is None
+    try:
+        db_manager = db_manager or create_database_manager(target['db_details'])
+        while True:
+            attempts += 1
+            logging.info(f"Target {name}: attempt {attempts}")
+            result = process_data(target['db_details'], cancel_event=cancel_event, db_manager=db_manager,
+                                  parsed_payload=parsed_payload, payload_cache=payload_cache, **options)
+            if result.status not in TARGET_RETRY_STATUSES or attempts > target['retries']:
+                break
+            delay = backoff_delay(attempts, target['retry_delay'], max_delay=3600)
+            logging.warning(f"Target {name}: attempt {attempts} failed; retrying in {delay:.0f}s")
+            if (cancel_event or threading.Event()).wait(delay):
+                break
+            if options.get('commit_interval'):
+                options['resume'] = True
+    except Exception as e:
+        result = UpdateResult('error', "Error", f"Error occurred during processing: {e}")
+    finally:
+        if created_manager and db_manager is not None:
+            db_manager.dispose()
+    seconds = time.perf_counter() - start
+    log = logging.info if EXIT_CODES[result.status] == 0 else logging.error
+    log(f"Target {name}: {result.title} after {attempts} attempt(s) in {seconds:.1f}s - {result.message}")
+    return TargetResult(name, result.status, result.title, result.message, attempts, seconds)
+
+
+def run_targets(targets, cancel_event=None, session=None, db_managers=None, max_workers=None, report_path=None,
+                input_file=None, use_mmap=False, cache_dir='aml_cache', sources=None, source_locations=None,
+                pipeline=False, **load_options):
+    # Downloads and parses the list once, then loads all targets concurrently, each on its own connection and
+    # with its own retries, so a slow or failing target only holds up its own result. Returns the overall
+    # result and one TargetResult per target.
+    for option in ('profile_output', 'trace_memory'):
+        if load_options.pop(option, None):
+            logging.warning(f"{option} covers the whole process and is ignored when loading several targets")
+    if pipeline:
+        logging.warning("The streaming pipeline loads a single target; the list is parsed once instead")
+    started = datetime.now()
+    start = time.perf_counter()
+    payload_cache = PayloadCache(cache_dir) if cache_dir else None
+    parsed_payload = failure = None
+    try:
+        parsed_payload = parse_payload(session, payload_cache, input_file, use_mmap, sources, source_locations)
+        if parsed_payload is None:
+            failure = UpdateResult('no_data', "Fail", "Could not find any data on individuals or entities on the URL!")
+    except request_errors() as e:
+        failure = UpdateResult('network_error', "Network Error", f"Network error occurred: {e}")
+    except Exception as e:
+        failure = UpdateResult('error', "Error", f"Error occurred while reading the list: {e}")
+    parse_seconds = time.perf_counter() - start
+
+    if failure is not None:
+        logging.error(failure.message)
+        results = [TargetResult(target['name'], failure.status, failure.title, failure.message, 0, 0.0)
+                   for target in targets]
+    else:
+        logging.info(f"Parsed {len(parsed_payload.records)} records from {parsed_payload.source} in "
+                     f"{parse_seconds:.2f}s; loading {len(targets)} targets")
+        db_managers = db_managers or {}
+        with ThreadPoolExecutor(max_workers=max_workers or len(targets), thread_name_prefix='aml-target') as executor:
+            futures = [executor.submit(load_target, target, parsed_payload, payload_cache, cancel_event,
+                                       db_managers.get(target['name']), **load_options) for target in targets]
+            results = [future.result() for future in futures]
+
+    failed = [target_result for target_result in results if EXIT_CODES[target_result.status] != 0]
+    if not failed:
+        status = 'up_to_date' if all(target_result.status == 'up_to_date' for target_result in results) else 'success'
+        summary = "are up to date" if status == 'up_to_date' else "loaded successfully"
+        result = UpdateResult(status, "Success", f"All {len(results)} targets {summary}.")
+    elif len(failed) == len(results):
+        result = UpdateResult(failed[0].status, failed[0].title, f"All {len(results)} targets failed.")
+    else:
+        names = ', '.join(target_result.name for target_result in failed)
+        result = UpdateResult('partial', "Partial Failure", f"{len(failed)} of {len(results)} targets failed: {names}.")
+    if report_path:
+        report = {
+            'started': started.isoformat(timespec='seconds'),
+            'status': result.status,
+            'source': parsed_payload.source if parsed_payload else None,
+            'payload_sha256': parsed_payload.sha256 if parsed_payload else None,
+            'records': len(parsed_payload.records) if parsed_payload else 0,
+            'parse_seconds': round(parse_seconds, 3),
+            'seconds': round(time.perf_counter() - start, 3),
+            'targets': [dict(target_result._asdict(), seconds=round(target_result.seconds, 3))
+                        for target_result in results]
+        }
+        write_atomically(report_path, json.dumps(report, indent=2))
+        logging.info(f"Target report written to {report_path}")
+    return result, results
+
+
+def format_progress(update):
+    text = f"Processing {update['label']}: {update['percent']:.1f}% ({update['rate']:.0f} records/s"
+    if update['eta'] is not None:
+        minutes, seconds = divmod(int(update['eta']), 60)
+        text += f", ETA {minutes}:{seconds:02d}"
+    return text + ")"
+
+
+def create_gui(load_options=None):
+    import tkinter as tk
+    from tkinter import messagebox, ttk
+
+    progress_queue = queue.Queue()
+    result_queue = queue.Queue()
+    cancel_event = threading.Event()
 
-def create_gui():
     def start_process():
         button.config(state=tk.DISABLED)
+        cancel_button.config(state=tk.NORMAL)
+        cancel_event.clear()
+        progress_var.set(0)
+        status_label.config(text="Starting...")
         db_details = {
             "server": server_entry.get(),
             "database": database_entry.get(),
@@ -602,8 +3319,43 @@ def create_gui():
             "driver": "ODBC Driver 17 for SQL Server",
             "port": "1433"
         }
-        process_data(progress_var, status_label, window, db_details)
+
+        def worker():
+            result_queue.put(process_data(db_details, progress=progress_queue.put, cancel_event=cancel_event,
+                                          **(load_options or {})))
+
+        threading.Thread(target=worker, name='aml-update', daemon=True).start()
+        window.after(100, poll_worker)
+
+    def cancel_process():
+        cancel_event.set()
+        cancel_button.config(state=tk.DISABLED)
+        status_label.config(text="Cancelling at the next batch boundary...")
+
+    def poll_worker():
+        latest = None
+        while True:
+            try:
+                latest = progress_queue.get_nowait()
+            except queue.Empty:
+                break
+        if latest is not None and not cancel_event.is_set():
+            progress_var.set(latest['percent'])
+            status_label.config(text=format_progress(latest))
+
+        try:
+            result = result_queue.get_nowait()
+        except queue.Empty:
+            window.after(100, poll_worker)
+            return
+
         button.config(state=tk.NORMAL)
+        cancel_button.config(state=tk.DISABLED)
+        status_label.config(text=result.message)
+        if result.status in ('success', 'up_to_date', 'cancelled'):
+            messagebox.showinfo(result.title, result.message)
+        else:
+            messagebox.showerror(result.title, result.message)
 
     window = tk.Tk()
     window.title("AML Risk Update")
@@ -634,12 +3386,355 @@ def create_gui():
 
     button = tk.Button(window, text="Update AML Risks", command=start_process,
                        font=("Arial", 14), bg="green", fg="white")
-    button.pack(pady=50)
+    button.pack(pady=(50, 10))
+
+    cancel_button = tk.Button(window, text="Cancel", command=cancel_process, state=tk.DISABLED)
+    cancel_button.pack(pady=5)
 
     version_label = ttk.Label(window, text="Program Version: AML 1.4")
     version_label.pack(side=tk.RIGHT, anchor=tk.SE)
     window.mainloop()
 
 
+EXIT_CODES = {
+    'success': 0,
+    'up_to_date': 0,
+    'error': 1,
+    'config_error': 2,
+    'network_error': 3,
+    'no_data': 4,
+    'partial': 5,
+    'cancelled': 130
+}
+
+DB_ENVIRONMENT = {
+    'backend': 'AML_DB_BACKEND',
+    'server': 'AML_DB_SERVER',
+    'database': 'AML_DB_DATABASE',
+    'user': 'AML_DB_USER',
+    'password': 'AML_DB_PASSWORD',
+    'driver': 'AML_DB_DRIVER',
+    'port': 'AML_DB_PORT'
+}
+
+
+def source_list(value):
+    names = [name.strip().lower() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SOURCE_ADAPTERS]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(f"unknown sources {unknown}; choose from {', '.join(SOURCE_ADAPTERS)}")
+    return names
+
+
+def source_location(value):
+    name, separator, location = value.partition('=')
+    if not separator or name.strip().lower() not in SOURCE_ADAPTERS or not location:
+        raise argparse.ArgumentTypeError(f"expected NAME=PATH_OR_URL with NAME one of {', '.join(SOURCE_ADAPTERS)}")
+    return name.strip().lower(), location
+
+
+def configure_logging(log_file='aml_risk_update.log', max_bytes=10 << 20, backup_count=5, level=logging.INFO):
+    # Called by the entry point only, so importing this module never creates a log file. Log calls put the record
+    # on a queue and return; a listener thread does the file I/O, so a slow disk never stalls the load loop. The
+    # file rotates at max_bytes and keeps backup_count old files.
+    import atexit
+    import logging.handlers
+
+    handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                                   encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_queue = queue.Queue()
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    listener.start()
+    # Stopping the listener writes out whatever is still queued.
+    atexit.register(listener.stop)
+    return listener
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Update AML risk tables from the UN consolidated sanctions list.")
+    parser.add_argument('--headless', action='store_true', help="Run without the GUI and exit with a status code")
+    parser.add_argument('--daemon', action='store_true',
+                        help="Keep running headless and re-check the list every --interval seconds")
+    parser.add_argument('--interval', type=float, default=3600, help="Seconds between checks in daemon mode")
+    parser.add_argument('--quiet', action='store_true', help="Do not print progress lines in headless mode")
+    parser.add_argument('--progress-interval', type=float, default=1.0,
+                        help="Seconds between progress lines in headless mode")
+    parser.add_argument('--log-file', default='aml_risk_update.log', help="Log file (default: %(default)s)")
+    parser.add_argument('--log-max-mb', type=float, default=10,
+                        help="Rotate the log file at this size (default: %(default)s MB)")
+    parser.add_argument('--log-backups', type=int, default=5,
+                        help="Rotated log files to keep (default: %(default)s)")
+    for key, env in DB_ENVIRONMENT.items():
+        if key == 'backend':
+            parser.add_argument('--backend', choices=sorted(DATABASE_BACKENDS),
+                                help=f"Storage backend, mssql or sqlite (default: ${env} or mssql)")
+        else:
+            parser.add_argument(f'--{key}', help=f"Database {key}, or the file path for sqlite (default: ${env})"
+                                if key == 'database' else f"Database {key} (default: ${env})")
+    parser.add_argument('--targets',
+                        help="JSON file of target databases; the list is parsed once and loaded into all of them "
+                             "concurrently (runs headless, database settings above are ignored)")
+    parser.add_argument('--target-retries', type=int, default=2,
+                        help="Retries of a failed target load, unless the target file sets its own")
+    parser.add_argument('--target-retry-delay', type=float, default=30,
+                        help="Base delay in seconds between retries of a target; backs off exponentially")
+    parser.add_argument('--target-workers', type=int, help="Targets loaded at once (default: all of them)")
+    parser.add_argument('--target-report', help="Write the per-target results of a --targets run to this JSON file")
+    parser.add_argument('--input-file', help="Load a local consolidated.xml instead of downloading it")
+    parser.add_argument('--mmap', action='store_true', help="Memory-map the input file while parsing")
+    parser.add_argument('--cache-dir', default='aml_cache',
+                        help="Directory for the downloaded list cache (empty string disables it)")
+    parser.add_argument('--force', action='store_true', help="Load even if the list has not changed")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Overlap download, parsing and database writes instead of running them in turn")
+    parser.add_argument('--load-mode', choices=['full', 'delta', 'shadow'], default='full',
+                        help="Reload everything, apply only added, changed and delisted records, or load into "
+                             "shadow tables and swap them in when complete")
+    parser.add_argument('--rollback', action='store_true',
+                        help="Swap the generation replaced by the last shadow load back in, then exit")
+    parser.add_argument('--change-summary', help="Path of the JSON change summary written in delta mode")
+    parser.add_argument('--writer', choices=['batch', 'row', 'parallel', 'bulk'], default='batch',
+                        help="Set-based, per-row, set-based on several connections at once, or exported to files "
+                             "and bulk-loaded")
+    parser.add_argument('--workers', type=int, default=4, help="Connections used by the parallel writer")
+    parser.add_argument('--export-dir', default='aml_export',
+                        help="Directory of the per-table files written by the bulk writer")
+    parser.add_argument('--export-format', choices=EXPORT_FORMATS, default='csv',
+                        help="File format of the bulk writer export (parquet needs pyarrow)")
+    parser.add_argument('--bulk-server-dir',
+                        help="The export directory as SQL Server sees it, when BULK INSERT runs on another host")
+    parser.add_argument('--sources', type=source_list,
+                        help=f"Comma-separated sanctions lists to load together ({', '.join(SOURCE_ADAPTERS)}); "
+                             f"the tables then hold exactly these lists")
+    parser.add_argument('--source-location', action='append', default=[], type=source_location,
+                        metavar='NAME=PATH_OR_URL',
+                        help="Read a source from a local file or another URL, e.g. ofac=sdn.xml (repeatable)")
+    parser.add_argument('--snapshot-dir',
+                        help="Keep a compressed snapshot of every loaded list version here (query with snapshots.py)")
+    parser.add_argument('--snapshot-retention', type=int, default=30,
+                        help="Number of snapshots to keep (default: %(default)s, 0 keeps all)")
+    parser.add_argument('--commit-interval', type=int,
+                        help="Commit and checkpoint every N records instead of loading in a single transaction")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue an interrupted checkpointed load after its last committed record")
+    parser.add_argument('--db-retries', type=int, default=3,
+                        help="Retries of the database phase after a transient error such as a lost connection or a "
+                             "deadlock; with --commit-interval only the uncommitted batch is redone")
+    parser.add_argument('--db-retry-delay', type=float, default=1.0,
+                        help="Base of the exponential backoff between database retries, in seconds")
+    parser.add_argument('--metrics-report', help="Write a JSON run report with phase timings and per-table queries")
+    parser.add_argument('--prometheus-file',
+                        help="Write run metrics for the Prometheus node exporter textfile collector (*.prom)")
+    parser.add_argument('--profile', help="Write cProfile statistics of the run to this file")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Trace allocations with tracemalloc and add the top sites to the run report")
+    parser.add_argument('--screening-index',
+                        help="Keep an in-memory screening index file up to date after each load (see screening.py)")
+    parser.add_argument('--batch-size', type=int, default=500, help="Records per batch for the batch writer")
+    parser.add_argument('--auto-tune-batch', action='store_true', help="Adapt the batch size to observed latency")
+    return parser.parse_args(argv)
+
+
+def load_options_from_args(args):
+    return {
+        "input_file": args.input_file,
+        "use_mmap": args.mmap,
+        "cache_dir": args.cache_dir or None,
+        "force": args.force,
+        "pipeline": args.pipeline,
+        "load_mode": args.load_mode,
+        "change_summary_path": args.change_summary,
+        "writer": args.writer,
+        "batch_size": args.batch_size,
+        "auto_tune_batch": args.auto_tune_batch,
+        "workers": args.workers,
+        "export_dir": args.export_dir,
+        "export_format": args.export_format,
+        "bulk_server_dir": args.bulk_server_dir,
+        "screening_index": args.screening_index,
+        "sources": args.sources,
+        "source_locations": dict(args.source_location),
+        "snapshot_dir": args.snapshot_dir,
+        "snapshot_retention": args.snapshot_retention,
+        "commit_interval": args.commit_interval,
+        "resume": args.resume,
+        "db_retries": args.db_retries,
+        "db_retry_delay": args.db_retry_delay,
+        "metrics_report": args.metrics_report,
+        "prometheus_file": args.prometheus_file,
+        "profile_output": args.profile,
+        "trace_memory": args.trace_memory
+    }
+
+
+def db_details_from_args(args):
+    db_details = {key: getattr(args, key) or os.environ.get(env) for key, env in DB_ENVIRONMENT.items()}
+    db_details['backend'] = db_details['backend'] or 'mssql'
+    db_details['driver'] = db_details['driver'] or "ODBC Driver 17 for SQL Server"
+    db_details['port'] = db_details['port'] or "1433"
+    return db_details
+
+
+def missing_db_settings(db_details):
+    required = ('database',) if db_details['backend'] == 'sqlite' else ('server', 'database', 'user', 'password')
+    return [key for key in required if not db_details[key]]
+
+
+def read_targets(path, retries=2, retry_delay=30.0):
+    # A JSON list of targets (or {"targets": [...]}). Each has a name, the database settings of DB_ENVIRONMENT,
+    # where any setting can instead name an environment variable as "<setting>_env", optional "retries" and
+    # "retry_delay", and "options" overriding the load options of TARGET_OPTIONS for that target.
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = entries.get('targets')
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path} does not list any targets")
+    allowed = set(DB_ENVIRONMENT) | {f"{key}_env" for key in DB_ENVIRONMENT} | {'name', 'retries', 'retry_delay',
+                                                                                 'options'}
+    targets = []
+    for entry in entries:
+        name = str(entry.get('name') or '')
+        if not name or not all(c.isalnum() or c in '-_.' for c in name):
+            raise ValueError(f"Target names must be letters, digits, '-', '_' or '.', not {name!r}")
+        if name in (target['name'] for target in targets):
+            raise ValueError(f"Target {name} is listed twice")
+        unknown = sorted(set(entry) - allowed) + sorted(set(entry.get('options', {})) - set(TARGET_OPTIONS))
+        if unknown:
+            raise ValueError(f"Target {name} has unknown settings: {', '.join(unknown)}")
+        db_details = {key: entry.get(key) or (os.environ.get(entry[f'{key}_env']) if entry.get(f'{key}_env') else None)
+                      for key in DB_ENVIRONMENT}
+        db_details['backend'] = db_details['backend'] or 'mssql'
+        db_details['driver'] = db_details['driver'] or "ODBC Driver 17 for SQL Server"
+        db_details['port'] = str(db_details['port'] or "1433")
+        if db_details['backend'] not in DATABASE_BACKENDS:
+            raise ValueError(f"Target {name} has an unknown backend {db_details['backend']!r}")
+        missing = missing_db_settings(db_details)
+        if missing:
+            raise ValueError(f"Target {name} is missing {', '.join(missing)}")
+        targets.append({
+            'name': name,
+            'db_details': db_details,
+            'retries': int(entry.get('retries', retries)),
+            'retry_delay': float(entry.get('retry_delay', retry_delay)),
+            'options': dict(entry.get('options', {}))
+        })
+    return targets
+
+
+def print_progress(update):
+    print(format_progress(update), flush=True)
+
+
+def stop_on_signals():
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        logging.info(f"Received signal {signum}; stopping at the next batch boundary")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    return stop_event
+
+
+def run_headless(args):
+    if args.targets:
+        return run_headless_targets(args)
+    db_details = db_details_from_args(args)
+    missing = missing_db_settings(db_details)
+    if missing:
+        print("Missing database settings: " + ", ".join(
+            f"--{key} / ${DB_ENVIRONMENT[key]}" for key in missing), file=sys.stderr)
+        return EXIT_CODES['config_error']
+    if args.rollback:
+        result = rollback_generation(db_details, cache_dir=args.cache_dir or None)
+        print(f"{result.title}: {result.message}", file=sys.stdout if result.status == 'success' else sys.stderr)
+        return EXIT_CODES[result.status]
+
+    stop_event = stop_on_signals()
+
+    # The session and engine outlive individual runs, so daemon cycles reuse warm HTTP and database connections.
+    session = create_session() if needs_session(args.input_file, args.sources, dict(args.source_location)) else None
+    db_manager = create_database_manager(db_details)
+    load_options = load_options_from_args(args)
+    try:
+        while True:
+            result = process_data(db_details, progress=None if args.quiet else print_progress,
+                                  cancel_event=stop_event, progress_interval=args.progress_interval,
+                                  session=session, db_manager=db_manager, **load_options)
+            stream = sys.stdout if EXIT_CODES[result.status] == 0 else sys.stderr
+            print(f"{result.title}: {result.message}", file=stream, flush=True)
+            if not args.daemon:
+                return EXIT_CODES[result.status]
+            # A stop during the load cancelled and rolled it back, which the exit code must show; only a stop
+            # while idle between cycles is a clean exit.
+            if result.status == 'cancelled':
+                logging.info("Daemon stopped during a load")
+                return EXIT_CODES[result.status]
+            if stop_event.is_set() or stop_event.wait(args.interval):
+                logging.info("Daemon stopped")
+                return EXIT_CODES['success']
+    finally:
+        if session is not None:
+            session.close()
+        db_manager.dispose()
+
+
+def run_headless_targets(args):
+    try:
+        targets = read_targets(args.targets, retries=args.target_retries, retry_delay=args.target_retry_delay)
+    except (OSError, ValueError) as e:
+        print(f"Invalid target file: {e}", file=sys.stderr)
+        return EXIT_CODES['config_error']
+    if args.rollback:
+        exit_code = EXIT_CODES['success']
+        for target in targets:
+            result = rollback_generation(target['db_details'], cache_dir=args.cache_dir or None)
+            print(f"{target['name']}: {result.title}: {result.message}",
+                  file=sys.stdout if result.status == 'success' else sys.stderr)
+            exit_code = exit_code or EXIT_CODES[result.status]
+        return exit_code
+
+    stop_event = stop_on_signals()
+    session = create_session() if needs_session(args.input_file, args.sources, dict(args.source_location)) else None
+    db_managers = {target['name']: create_database_manager(target['db_details']) for target in targets}
+    load_options = load_options_from_args(args)
+    try:
+        while True:
+            result, target_results = run_targets(targets, cancel_event=stop_event, session=session,
+                                                 db_managers=db_managers, max_workers=args.target_workers,
+                                                 report_path=args.target_report, **load_options)
+            for target_result in target_results:
+                stream = sys.stdout if EXIT_CODES[target_result.status] == 0 else sys.stderr
+                print(f"{target_result.name}: {target_result.title}: {target_result.message} "
+                      f"({target_result.attempts} attempt(s), {target_result.seconds:.1f}s)", file=stream, flush=True)
+            stream = sys.stdout if EXIT_CODES[result.status] == 0 else sys.stderr
+            print(f"{result.title}: {result.message}", file=stream, flush=True)
+            if not args.daemon:
+                return EXIT_CODES[result.status]
+            # A stop during the loads cancelled and rolled back the targets still loading, which the exit code
+            # must show; only a stop while idle between cycles is a clean exit.
+            if any(target_result.status == 'cancelled' for target_result in target_results):
+                logging.info("Daemon stopped during a load")
+                return EXIT_CODES[result.status] or EXIT_CODES['cancelled']
+            if stop_event.is_set() or stop_event.wait(args.interval):
+                logging.info("Daemon stopped")
+                return EXIT_CODES['success']
+    finally:
+        if session is not None:
+            session.close()
+        for db_manager in db_managers.values():
+            db_manager.dispose()
+
+
 if __name__ == "__main__":
-    create_gui()
\ No newline at end of file
+    args = parse_arguments()
+    configure_logging(args.log_file, max_bytes=int(args.log_max_mb * (1 << 20)), backup_count=args.log_backups)
+    if args.headless or args.daemon or args.rollback or args.targets:
+        sys.exit(run_headless(args))
+    create_gui(load_options_from_args(args))
@@ -0,0 +1,273 @@
+import argparse
+import json
+import logging
+import math
+import os
+import pickle
+import re
+import sys
+import tempfile
+import time
+import unicodedata
+from array import array
+from collections import Counter, namedtuple
+
+INDEX_FORMAT_VERSION = 1
+
+ScreeningMatch = namedtuple('ScreeningMatch', ['dataid', 'record_type', 'name', 'kind', 'score'])
+
+# Letters that NFKD does not decompose to ASCII. Scripts without an entry here are indexed as written.
+TRANSLITERATION = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya', 'і': 'i', 'ї': 'i', 'є': 'ye', 'ґ': 'g',
+    'α': 'a', 'β': 'v', 'γ': 'g', 'δ': 'd', 'ε': 'e', 'ζ': 'z', 'η': 'i', 'θ': 'th', 'ι': 'i', 'κ': 'k',
+    'λ': 'l', 'μ': 'm', 'ν': 'n', 'ξ': 'x', 'ο': 'o', 'π': 'p', 'ρ': 'r', 'σ': 's', 'ς': 's', 'τ': 't',
+    'υ': 'y', 'φ': 'f', 'χ': 'ch', 'ψ': 'ps', 'ω': 'o',
+    'ß': 'ss', 'æ': 'ae', 'ø': 'o', 'œ': 'oe', 'ð': 'd', 'þ': 'th', 'ł': 'l', 'ı': 'i', 'đ': 'd'
+})
+
+NON_WORD = re.compile(r'[\W_]+')
+
+SOUNDEX_CODES = str.maketrans('bfpvcgjkqsxzdtlmnr', '111122222222334556', 'aeiouyhw')
+
+
+def normalize_name(name):
+    if not name:
+        return ''
+    text = unicodedata.normalize('NFKD', name.casefold().translate(TRANSLITERATION))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(NON_WORD.sub(' ', text).split())
+
+
+def name_tokens(normalized):
+    # Word-order independent form of a normalized name: "kim jong un" and "jong un kim" share it.
+    return ' '.join(sorted(set(normalized.split())))
+
+
+def normalize_document_number(number):
+    return ''.join(normalize_name(number).split()).upper()
+
+
+def name_trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def phonetic_key(token):
+    # Soundex over ASCII letters; tokens in other scripts have no key and match on trigrams only.
+    letters = ''.join(ch for ch in token if 'a' <= ch <= 'z')
+    if not letters:
+        return None
+    codes = []
+    previous = letters[0].translate(SOUNDEX_CODES)
+    for ch in letters[1:]:
+        code = ch.translate(SOUNDEX_CODES)
+        if code and code != previous:
+            codes.append(code)
+        if ch not in 'hw':
+            previous = code
+    return (letters[0] + ''.join(codes) + '000')[:4]
+
+
+def phonetic_keys(normalized):
+    return {key for key in map(phonetic_key, normalized.split()) if key}
+
+
+class ScreeningIndex:
+    # Entries are individual names (primary name, original script name, aliases) of listed records. Removed
+    # entries are tombstoned and dropped from the postings by compact() once they make up a quarter of the index.
+    def __init__(self):
+        self.dataids = []
+        self.record_types = []
+        self.names = []
+        self.kinds = []
+        self.normalized = []
+        self.trigram_counts = array('I')
+        self.alive = bytearray()
+        self.phonetic = []
+        self.trigram_postings = {}
+        self.records = {}
+        self.dead_entries = 0
+
+    def __len__(self):
+        return len(self.names) - self.dead_entries
+
+    def add_entry(self, dataid, record_type, name, kind):
+        normalized = normalize_name(name)
+        if not normalized:
+            return None
+        entry_id = len(self.names)
+        trigrams = name_trigrams(normalized)
+        self.dataids.append(dataid)
+        self.record_types.append(record_type)
+        self.names.append(name)
+        self.kinds.append(kind)
+        self.normalized.append(normalized)
+        self.trigram_counts.append(len(trigrams))
+        self.phonetic.append(tuple(phonetic_keys(normalized)))
+        self.alive.append(1)
+        for trigram in trigrams:
+            postings = self.trigram_postings.get(trigram)
+            if postings is None:
+                postings = self.trigram_postings[trigram] = array('I')
+            postings.append(entry_id)
+        return entry_id
+
+    def add_record(self, record_type, dataid, versionnum, names):
+        entry_ids = [entry_id for entry_id in (self.add_entry(dataid, record_type, name, kind)
+                                               for name, kind in names) if entry_id is not None]
+        self.records[(record_type, dataid)] = (versionnum, entry_ids)
+
+    def remove_record(self, record_type, dataid):
+        _, entry_ids = self.records.pop((record_type, dataid), (None, []))
+        for entry_id in entry_ids:
+            if self.alive[entry_id]:
+                self.alive[entry_id] = 0
+                self.dead_entries += 1
+
+    def refresh(self, records):
+        # records: the complete current list as (record_type, dataid, versionnum, names). Only records whose
+        # VERSIONNUM changed are re-indexed, mirroring the delta load.
+        start = time.perf_counter()
+        seen = set()
+        added = modified = 0
+        for record_type, dataid, versionnum, names in records:
+            key = (record_type, dataid)
+            seen.add(key)
+            stored = self.records.get(key)
+            if stored is not None and stored[0] == versionnum:
+                continue
+            if stored is None:
+                added += 1
+            else:
+                modified += 1
+                self.remove_record(record_type, dataid)
+            self.add_record(record_type, dataid, versionnum, names)
+        removed = [key for key in self.records if key not in seen]
+        for record_type, dataid in removed:
+            self.remove_record(record_type, dataid)
+        if self.dead_entries * 4 > len(self.names):
+            self.compact()
+        summary = {'added': added, 'modified': modified, 'removed': len(removed), 'entries': len(self)}
+        logging.info(f"Screening index refreshed in {time.perf_counter() - start:.2f}s: {summary}")
+        return summary
+
+    def compact(self):
+        records = [(record_type, dataid, versionnum, [(self.names[i], self.kinds[i]) for i in entry_ids])
+                   for (record_type, dataid), (versionnum, entry_ids) in self.records.items()]
+        self.__init__()
+        for record in records:
+            self.add_record(*record)
+
+    def screen(self, name, threshold=0.8, limit=10):
+        return self.screen_batch([name], threshold, limit)[0]
+
+    def screen_batch(self, names, threshold=0.8, limit=10):
+        # Prefix filtering: a name scoring at least the threshold must share at least min_shared trigrams, so it
+        # also shares one of the (len - min_shared + 1) rarest query trigrams. Overlap counts are summed over
+        # the posting arrays by Counter.update at C speed, and only the prefix candidates are scored in Python.
+        results = {}
+        for name in names:
+            if name in results:
+                continue
+            normalized = normalize_name(name)
+            if not normalized:
+                results[name] = []
+                continue
+            trigrams = name_trigrams(normalized)
+            # Phonetic keys only boost names that already share trigrams; on their own they are too coarse.
+            keys = phonetic_keys(normalized)
+            min_dice = (threshold - 0.2) / 0.8 if keys else threshold
+            query_size = len(trigrams)
+            # The small epsilon keeps float rounding from excluding names that score exactly the threshold.
+            min_dice = max(0.0, min_dice - 1e-9)
+            min_shared = max(1, math.ceil(min_dice * query_size / (2 - min_dice))) if min_dice > 0 else 1
+            postings = sorted((self.trigram_postings.get(trigram, ()) for trigram in trigrams), key=len)
+            prefix_length = query_size - min_shared + 1
+            candidates = Counter()
+            for entry_postings in postings[:prefix_length]:
+                candidates.update(entry_postings)
+            overlap = candidates.copy()
+            for entry_postings in postings[prefix_length:]:
+                overlap.update(entry_postings)
+
+            scored = []
+            for entry_id in candidates:
+                if not self.alive[entry_id]:
+                    continue
+                entry_size = self.trigram_counts[entry_id]
+                if min_dice > 0 and not (min_dice * entry_size <= (2 - min_dice) * query_size and
+                                         min_dice * query_size <= (2 - min_dice) * entry_size):
+                    continue
+                dice = 2.0 * overlap[entry_id] / (query_size + entry_size)
+                score = dice
+                if keys:
+                    score = 0.8 * dice + 0.2 * len(keys.intersection(self.phonetic[entry_id])) / len(keys)
+                if score >= threshold:
+                    scored.append((score, entry_id))
+            scored.sort(reverse=True)
+            matches = []
+            matched_records = set()
+            for score, entry_id in scored:
+                record_key = (self.record_types[entry_id], self.dataids[entry_id])
+                if record_key in matched_records:
+                    continue
+                matched_records.add(record_key)
+                matches.append(ScreeningMatch(self.dataids[entry_id], self.record_types[entry_id],
+                                              self.names[entry_id], self.kinds[entry_id], round(score, 4)))
+                if len(matches) >= limit:
+                    break
+            results[name] = matches
+        return [results[name] for name in names]
+
+    def save(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((INDEX_FORMAT_VERSION, self.__dict__), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        logging.info(f"Screening index with {len(self)} entries saved to {path}")
+
+    @classmethod
+    def load(cls, path):
+        # Only load files written by save(); pickle is used because it restores the posting arrays in
+        # milliseconds.
+        with open(path, 'rb') as f:
+            version, state = pickle.load(f)
+        if version != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported screening index format {version} in {path}")
+        index = cls()
+        index.__dict__.update(state)
+        return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Screen names against a saved AML screening index.")
+    parser.add_argument('index', help="Index file written by risk_update.py --screening-index")
+    parser.add_argument('names', nargs='?', help="File with one name per line (default: standard input)")
+    parser.add_argument('--threshold', type=float, default=0.8, help="Minimum score of a reported match")
+    parser.add_argument('--limit', type=int, default=10, help="Maximum matches per name")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    index = ScreeningIndex.load(args.index)
+    loaded = time.perf_counter()
+    with open(args.names, encoding='utf-8') if args.names else sys.stdin as f:
+        names = [line.strip() for line in f if line.strip()]
+    results = index.screen_batch(names, args.threshold, args.limit)
+    for name, matches in zip(names, results):
+        print(json.dumps({'name': name, 'matches': [match._asdict() for match in matches]}, ensure_ascii=False))
+    elapsed = time.perf_counter() - loaded
+    print(f"Loaded {len(index)} entries in {(loaded - start) * 1000:.0f} ms; screened {len(names)} names in "
+          f"{elapsed:.2f}s ({len(names) / elapsed if elapsed else 0:.0f} names/s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
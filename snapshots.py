@@ -0,0 +1,296 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+from datetime import datetime
+
+SNAPSHOT_FORMAT_VERSION = 1
+MAGIC = b'AMLSNAP1'
+SNAPSHOT_SUFFIX = '.amls'
+
+# File layout: MAGIC, a little-endian uint32 header length, the JSON header, then the data blocks. Every column
+# is one zlib block holding the character length of each value (-1 for NULL) followed by the values as UTF-8, so
+# a column decodes with one decompress and one decode. The key index stays uncompressed -- row count, key byte
+# offsets, row numbers and the keys sorted as UTF-8 bytes -- so a lookup is a binary search over the mapped file
+# that never decompresses anything.
+
+
+def encode_column(values):
+    lengths = array('i', (-1 if value is None else len(value) for value in values))
+    text = ''.join(value for value in values if value is not None)
+    return zlib.compress(lengths.tobytes() + text.encode('utf-8'), 6)
+
+
+def decode_column(block, rows):
+    raw = zlib.decompress(block)
+    lengths = array('i')
+    lengths.frombytes(raw[:rows * lengths.itemsize])
+    text = raw[rows * lengths.itemsize:].decode('utf-8')
+    values = []
+    position = 0
+    for length in lengths:
+        if length < 0:
+            values.append(None)
+        else:
+            values.append(text[position:position + length])
+            position += length
+    return values
+
+
+def encode_index(keys):
+    entries = sorted((key.encode('utf-8'), row) for row, key in enumerate(keys) if key is not None)
+    offsets = array('I', [0])
+    for key, _ in entries:
+        offsets.append(offsets[-1] + len(key))
+    rows = array('I', (row for _, row in entries))
+    return struct.pack('<I', len(entries)) + offsets.tobytes() + rows.tobytes() + b''.join(key for key, _ in entries)
+
+
+def write_snapshot(path, columns, rows, key_column, metadata=None):
+    # rows: sequences of strings or None, in the order of columns. Written to a temporary file and renamed, so a
+    # snapshot is either complete or absent.
+    rows = list(rows)
+    blocks = [encode_column([row[position] for row in rows]) for position in range(len(columns))]
+    blocks.append(encode_index([row[columns.index(key_column)] for row in rows]))
+    offset = 0
+    column_entries = []
+    for name, block in zip(columns + ['__index__'], blocks):
+        column_entries.append({'name': name, 'offset': offset, 'length': len(block)})
+        offset += len(block)
+    header = json.dumps({
+        'format': SNAPSHOT_FORMAT_VERSION,
+        'rows': len(rows),
+        'key': key_column,
+        'columns': column_entries[:-1],
+        'index': column_entries[-1],
+        'metadata': metadata or {}
+    }).encode('utf-8')
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC + struct.pack('<I', len(header)) + header)
+            for block in blocks:
+                f.write(block)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return path
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a snapshot file")
+        header_length, = struct.unpack_from('<I', self.map, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        self.header = json.loads(self.map[header_start:header_start + header_length])
+        if self.header['format'] != SNAPSHOT_FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported snapshot format {self.header['format']} in {path}")
+        self.data_start = header_start + header_length
+        self.rows = self.header['rows']
+        self.metadata = self.header['metadata']
+        self.columns = [column['name'] for column in self.header['columns']]
+        self.decoded = {}
+
+        index = self.header['index']
+        start = self.data_start + index['offset']
+        self.index_size, = struct.unpack_from('<I', self.map, start)
+        self.key_offsets = memoryview(self.map)[start + 4:start + 4 + 4 * (self.index_size + 1)].cast('I')
+        rows_start = start + 4 + 4 * (self.index_size + 1)
+        self.key_rows = memoryview(self.map)[rows_start:rows_start + 4 * self.index_size].cast('I')
+        self.keys_start = rows_start + 4 * self.index_size
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for name in ('key_offsets', 'key_rows'):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def column(self, name):
+        values = self.decoded.get(name)
+        if values is None:
+            entry = self.header['columns'][self.columns.index(name)]
+            start = self.data_start + entry['offset']
+            values = self.decoded[name] = decode_column(self.map[start:start + entry['length']], self.rows)
+        return values
+
+    def key_at(self, position):
+        return self.map[self.keys_start + self.key_offsets[position]:self.keys_start + self.key_offsets[position + 1]]
+
+    def find(self, key):
+        # Binary search over the mapped index; returns the row number of the first row with this key.
+        encoded = key.encode('utf-8')
+        low, high = 0, self.index_size
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_at(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.index_size and self.key_at(low) == encoded:
+            return self.key_rows[low]
+        return None
+
+    def row(self, position):
+        return {name: self.column(name)[position] for name in self.columns}
+
+    def get(self, key):
+        position = self.find(key)
+        return self.row(position) if position is not None else None
+
+    def items(self, *names):
+        key_values = self.column(self.header['key'])
+        columns = [self.column(name) for name in names]
+        return {key: tuple(column[position] for column in columns)
+                for position, key in enumerate(key_values) if key is not None}
+
+
+def diff_snapshots(old, new, compare_column='DIGEST'):
+    old_items = old.items(compare_column)
+    new_items = new.items(compare_column)
+    return {
+        'added': sorted(key for key in new_items if key not in old_items),
+        'removed': sorted(key for key in old_items if key not in new_items),
+        'modified': sorted(key for key, value in new_items.items() if key in old_items and old_items[key] != value)
+    }
+
+
+class SnapshotStore:
+    # One snapshot file per loaded list version, named after the time it was loaded, so the store needs no
+    # catalogue: listing the directory gives the versions in order. The newest `retention` files are kept.
+    def __init__(self, directory, retention=30):
+        self.directory = directory
+        self.retention = retention
+        os.makedirs(directory, exist_ok=True)
+
+    def versions(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SNAPSHOT_SUFFIX))
+        return [(datetime.strptime(name.split('_')[1], '%Y%m%dT%H%M%S'), os.path.join(self.directory, name))
+                for name in names]
+
+    def save(self, columns, rows, key_column, metadata=None, created=None):
+        created = created or datetime.now()
+        metadata = dict(metadata or {}, created=created.isoformat(timespec='seconds'))
+        digest = (metadata.get('payload_sha256') or 'unknown')[:12]
+        path = os.path.join(self.directory, f"snapshot_{created.strftime('%Y%m%dT%H%M%S')}_{digest}{SNAPSHOT_SUFFIX}")
+        start = time.perf_counter()
+        write_snapshot(path, columns, rows, key_column, metadata)
+        logging.info(f"Snapshot {os.path.basename(path)} ({os.path.getsize(path)} bytes) written in "
+                     f"{time.perf_counter() - start:.2f}s")
+        self.prune()
+        return path
+
+    def prune(self):
+        versions = self.versions()
+        if self.retention and len(versions) > self.retention:
+            for _, path in versions[:-self.retention]:
+                os.remove(path)
+                logging.info(f"Snapshot {os.path.basename(path)} removed by the retention setting")
+
+    def at(self, moment):
+        # The version that was current at `moment`: the last one loaded at or before it.
+        path = None
+        for created, candidate in self.versions():
+            if created > moment:
+                break
+            path = candidate
+        return Snapshot(path) if path else None
+
+    def latest(self, offset=0):
+        versions = self.versions()
+        return Snapshot(versions[-1 - offset][1]) if len(versions) > offset else None
+
+
+def parse_moment(text):
+    # A bare date means the end of that day, so "listed on 2024-05-01" includes loads made during that day.
+    moment = datetime.fromisoformat(text)
+    if len(text) == 10:
+        moment = moment.replace(hour=23, minute=59, second=59)
+    return moment
+
+
+def open_version(store, text):
+    if text is None:
+        return store.latest()
+    if os.path.exists(text):
+        return Snapshot(text)
+    return store.at(parse_moment(text))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the versioned snapshots written by risk_update.py.")
+    parser.add_argument('directory', help="Snapshot directory (risk_update.py --snapshot-dir)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="List the stored versions")
+    get_parser = commands.add_parser('get', help="Show records as listed at a point in time")
+    get_parser.add_argument('dataids', nargs='+')
+    get_parser.add_argument('--at', help="ISO date or timestamp (default: the latest version)")
+    diff_parser = commands.add_parser('diff', help="Compare two versions (default: the latest two)")
+    diff_parser.add_argument('old', nargs='?', help="ISO date/timestamp or snapshot file")
+    diff_parser.add_argument('new', nargs='?', help="ISO date/timestamp or snapshot file")
+    args = parser.parse_args(argv)
+
+    store = SnapshotStore(args.directory, retention=None)
+    start = time.perf_counter()
+    if args.command == 'list':
+        for created, path in store.versions():
+            with Snapshot(path) as snapshot:
+                print(json.dumps({'created': created.isoformat(), 'rows': len(snapshot),
+                                  'bytes': os.path.getsize(path), 'file': os.path.basename(path),
+                                  'payload_sha256': snapshot.metadata.get('payload_sha256')}))
+    elif args.command == 'get':
+        snapshot = open_version(store, args.at)
+        if snapshot is None:
+            print(f"No snapshot at {args.at}", file=sys.stderr)
+            return 1
+        with snapshot:
+            for dataid in args.dataids:
+                print(json.dumps({'dataid': dataid, 'snapshot': os.path.basename(snapshot.path),
+                                  'listed': snapshot.find(dataid) is not None, 'record': snapshot.get(dataid)},
+                                 ensure_ascii=False))
+    else:
+        if args.old is None:
+            old, new = store.latest(1), store.latest()
+        else:
+            old, new = open_version(store, args.old), open_version(store, args.new)
+        if old is None or new is None:
+            print("Two snapshots are needed for a diff", file=sys.stderr)
+            return 1
+        with old, new:
+            changes = diff_snapshots(old, new)
+            print(json.dumps(dict({'old': os.path.basename(old.path), 'new': os.path.basename(new.path)},
+                                  **{f"{kind}_count": len(keys) for kind, keys in changes.items()}, **changes),
+                             indent=2))
+    print(f"{(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+import hashlib
+import re
+from abc import ABC, abstractmethod
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+# Adapters turn each sanctions list format into INDIVIDUAL/ENTITY elements shaped like the UN consolidated list,
+# so every source goes through the same record mapping and lands in the same tables. Records of other sources
+# are tagged by a DATAID prefix and by their list type; their VERSIONNUM is a digest of the source entry, which
+# lets delta loads detect changes in lists that carry no version of their own.
+
+MONTHS = {month: number for number, month in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], 1)}
+
+DATE_FORMATS = [
+    (re.compile(r'^(\d{4})-(\d{2})-(\d{2})$'), ('year', 'month', 'day')),
+    (re.compile(r'^(\d{1,2}|dd)/(\d{1,2}|mm)/(\d{4})$', re.IGNORECASE), ('day', 'month', 'year')),
+    (re.compile(r'^(\d{1,2}) ([A-Za-z]{3})[a-z]* (\d{4})$'), ('day', 'month', 'year'))
+]
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def iter_elements(source, tags):
+    # Streams the elements whose local name is in tags, ignoring namespaces, and drops each one once it has been
+    # handled so memory stays flat.
+    parents = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if local_name(elem.tag) in tags:
+            yield local_name(elem.tag), elem
+            elem.clear()
+            if parents:
+                parents[-1].clear()
+
+
+def child_texts(element):
+    texts = {}
+    for child in element:
+        name = local_name(child.tag)
+        if name not in texts:
+            texts[name] = (child.text or '').strip() or None
+    return texts
+
+
+def entry_digest(element):
+    return hashlib.sha1(ET.tostring(element)).hexdigest()[:16]
+
+
+def join_name(*parts):
+    return ' '.join(part for part in parts if part) or None
+
+
+def parse_date(text):
+    # Returns (TYPE_OF_DATE, YEAR, DATE) in the conventions of the UN list: ISO dates, a bare year when only the
+    # year is known, APPROXIMATELY for circa dates. Unknown day or month parts (00, or dd/mm placeholders) leave
+    # only the year.
+    if not text:
+        return None, None, None
+    text = text.strip()
+    date_type = 'EXACT'
+    if text.lower().startswith(('circa', 'ca.', 'approx')):
+        date_type = 'APPROXIMATELY'
+        text = text.split(None, 1)[-1]
+    if re.fullmatch(r'\d{4}', text):
+        return date_type, text, None
+    for pattern, order in DATE_FORMATS:
+        match = pattern.match(text)
+        if match:
+            parts = {key: '00' if value.lower() in ('dd', 'mm') else value
+                     for key, value in zip(order, match.groups())}
+            month = MONTHS.get(parts['month'][:3].lower()) if parts['month'].isalpha() else int(parts['month'])
+            try:
+                return date_type, parts['year'], datetime(int(parts['year']), month, int(parts['day'])).strftime(
+                    '%Y-%m-%d')
+            except (TypeError, ValueError):
+                return date_type, parts['year'] if parts['year'] != '0000' else None, None
+    return date_type, None, None
+
+
+def build_record(tag, fields, lookups):
+    # fields: {column: text}; lookups: {element: [value, ...]} for VALUE lists or {element: [{column: text}]}.
+    record = ET.Element(tag)
+    for column, text in fields.items():
+        if text is not None:
+            ET.SubElement(record, column).text = text
+    for name, values in lookups.items():
+        if not values:
+            continue
+        if isinstance(values[0], dict):
+            for columns in values:
+                element = ET.SubElement(record, name)
+                for column, text in columns.items():
+                    if text is not None:
+                        ET.SubElement(element, column).text = text
+        else:
+            element = ET.SubElement(record, name)
+            for text in values:
+                ET.SubElement(element, 'VALUE').text = text
+    return record
+
+
+def date_of_birth(text):
+    date_type, year, date = parse_date(text)
+    if date_type is None:
+        return None
+    # Dates in a format parse_date does not know are kept verbatim in the note.
+    return {'TYPE_OF_DATE': date_type, 'YEAR': year, 'DATE': date, 'NOTE': None if year or date else text}
+
+
+def place_of_birth(city=None, country=None, state=None):
+    if not (city or country or state):
+        return None
+    return {'CITY': city, 'STATE_PROVINCE': state, 'COUNTRY': country}
+
+
+def document(document_type, text):
+    # Free-text document details lead with the number ("A1234567 (Iraq), issued 2001"); the rest goes to the note.
+    if not text:
+        return None
+    number, _, note = text.partition(' ')
+    return {'TYPE_OF_DOCUMENT': document_type, 'NUMBER': number.rstrip(',;'), 'NOTE': note.strip() or None}
+
+
+def unique(values):
+    return list(dict.fromkeys(value for value in values if value))
+
+
+def unique_dicts(values):
+    seen = []
+    for value in values:
+        if value and value not in seen:
+            seen.append(value)
+    return seen
+
+
+class SourceAdapter(ABC):
+    name = None
+    label = None
+    url = None
+    prefix = None
+
+    @abstractmethod
+    def records(self, path):
+        pass
+
+    def dataid(self, identifier):
+        return f"{self.prefix}-{identifier}"
+
+
+class UNAdapter(SourceAdapter):
+    name = 'un'
+    label = 'UN List'
+    url = "https://scsanctions.un.org/resources/xml/en/consolidated.xml"
+
+    def records(self, path):
+        return iter_elements(path, ('INDIVIDUAL', 'ENTITY'))
+
+
+class OFACAdapter(SourceAdapter):
+    # OFAC SDN list (sdn.xml): one sdnEntry per party, names in firstName/lastName, repeated data in *List
+    # elements. Gender is published as an id entry.
+    name = 'ofac'
+    label = 'OFAC SDN List'
+    url = "https://sanctionslistservice.ofac.treas.gov/api/PublicationPreview/exports/SDN.XML"
+    prefix = 'OFAC'
+
+    def records(self, path):
+        for _, entry in iter_elements(path, ('sdnEntry',)):
+            yield self.convert(entry)
+
+    def convert(self, entry):
+        texts = child_texts(entry)
+        lists = {local_name(child.tag): [child_texts(item) for item in child] for child in entry
+                 if local_name(child.tag).endswith('List')}
+        individual = (texts.get('sdnType') or '').lower() == 'individual'
+        tag = 'INDIVIDUAL' if individual else 'ENTITY'
+        ids = lists.get('idList', [])
+        gender = next((i.get('idNumber') for i in ids if (i.get('idType') or '').lower() == 'gender'), None)
+        fields = {
+            'DATAID': self.dataid(texts.get('uid')),
+            'VERSIONNUM': entry_digest(entry),
+            'UN_LIST_TYPE': '; '.join(unique(child.text for child in entry.iter()
+                                             if local_name(child.tag) == 'program')) or None,
+            'REFERENCE_NUMBER': texts.get('uid'),
+            'COMMENTS1': texts.get('remarks')
+        }
+        aliases = [{'QUALITY': 'Good' if (aka.get('category') or '').lower() == 'strong' else 'Low',
+                    'ALIAS_NAME': join_name(aka.get('firstName'), aka.get('lastName'))}
+                   for aka in lists.get('akaList', [])]
+        addresses = [{'STREET': join_name(a.get('address1'), a.get('address2'), a.get('address3')),
+                      'CITY': a.get('city'), 'STATE_PROVINCE': a.get('stateOrProvince'),
+                      'ZIP_CODE': a.get('postalCode'), 'COUNTRY': a.get('country')}
+                     for a in lists.get('addressList', [])]
+        lookups = {'LIST_TYPE': [self.label]}
+        if individual:
+            fields.update({'FIRST_NAME': texts.get('firstName'), 'SECOND_NAME': texts.get('lastName'),
+                           'GENDER': gender})
+            places = []
+            for item in lists.get('placeOfBirthList', []):
+                city, _, country = (item.get('placeOfBirth') or '').rpartition(', ')
+                places.append(place_of_birth(city or None, country or None))
+            lookups.update({
+                'TITLE': unique([texts.get('title')]),
+                'NATIONALITY': unique([n.get('country') for n in lists.get('nationalityList', [])] +
+                                      [c.get('country') for c in lists.get('citizenshipList', [])]),
+                'INDIVIDUAL_ALIAS': aliases,
+                'INDIVIDUAL_ADDRESS': addresses,
+                'INDIVIDUAL_DATE_OF_BIRTH': [d for d in (date_of_birth(item.get('dateOfBirth'))
+                                                         for item in lists.get('dateOfBirthList', [])) if d],
+                'INDIVIDUAL_PLACE_OF_BIRTH': [p for p in places if p],
+                'INDIVIDUAL_DOCUMENT': [{'TYPE_OF_DOCUMENT': i.get('idType'), 'NUMBER': i.get('idNumber'),
+                                         'COUNTRY_OF_ISSUE': i.get('idCountry'), 'DATE_OF_ISSUE': i.get('issueDate')}
+                                        for i in ids if (i.get('idType') or '').lower() != 'gender']
+            })
+        else:
+            fields['FIRST_NAME'] = join_name(texts.get('firstName'), texts.get('lastName'))
+            lookups.update({'ENTITY_ALIAS': aliases, 'ENTITY_ADDRESS': addresses})
+        return tag, build_record(tag, fields, lookups)
+
+
+class EUAdapter(SourceAdapter):
+    # EU Financial Sanctions Files (FSF) XML 1.1: one sanctionEntity per subject, all values in attributes. The
+    # first name alias is the primary name.
+    name = 'eu'
+    label = 'EU Financial Sanctions'
+    url = "https://webgate.ec.europa.eu/fsd/fsf/public/files/xmlFullSanctionsList_1_1/content?token=dG9rZW4tMjAxNw"
+    prefix = 'EU'
+
+    def records(self, path):
+        for _, entity in iter_elements(path, ('sanctionEntity',)):
+            yield self.convert(entity)
+
+    def convert(self, entity):
+        children = {}
+        for child in entity:
+            children.setdefault(local_name(child.tag), []).append(
+                {key: value.strip() or None for key, value in child.attrib.items()})
+        remarks = [(child.text or '').strip() for child in entity if local_name(child.tag) == 'remark']
+        subject = (children.get('subjectType') or [{}])[0]
+        individual = subject.get('code') == 'person'
+        tag = 'INDIVIDUAL' if individual else 'ENTITY'
+        names = children.get('nameAlias', [])
+        primary = names[0] if names else {}
+        regulations = children.get('regulation', [])
+        fields = {
+            'DATAID': self.dataid(entity.get('logicalId')),
+            'VERSIONNUM': entry_digest(entity),
+            'UN_LIST_TYPE': '; '.join(unique(r.get('programme') for r in regulations)) or None,
+            'REFERENCE_NUMBER': entity.get('euReferenceNumber'),
+            'LISTED_ON': min((r['publicationDate'] for r in regulations if r.get('publicationDate')), default=None),
+            'COMMENTS1': '\n'.join(remark for remark in remarks if remark) or None
+        }
+        aliases = [{'QUALITY': 'Good' if name.get('strong') == 'true' else 'Low',
+                    'ALIAS_NAME': name.get('wholeName') or join_name(
+                        name.get('firstName'), name.get('middleName'), name.get('lastName'))}
+                   for name in names[1:]]
+        addresses = [{'STREET': a.get('street'), 'CITY': a.get('city'), 'STATE_PROVINCE': a.get('region'),
+                      'ZIP_CODE': a.get('zipCode'), 'COUNTRY': a.get('countryDescription'),
+                      'NOTE': a.get('place')}
+                     for a in children.get('address', [])]
+        lookups = {'LIST_TYPE': [self.label]}
+        if individual:
+            if primary.get('firstName') or primary.get('lastName'):
+                fields.update({'FIRST_NAME': primary.get('firstName'), 'SECOND_NAME': primary.get('middleName'),
+                               'THIRD_NAME': primary.get('lastName')})
+            else:
+                fields['FIRST_NAME'] = primary.get('wholeName')
+            fields['GENDER'] = {'M': 'Male', 'F': 'Female'}.get(primary.get('gender'))
+            births = children.get('birthdate', [])
+            dates = []
+            for birth in births:
+                text = birth.get('birthdate') or birth.get('year')
+                dob = date_of_birth(('circa ' if birth.get('circa') == 'true' else '') + text if text else None)
+                if dob:
+                    dates.append(dob)
+            lookups.update({
+                'TITLE': unique(name.get('title') for name in names),
+                'DESIGNATION': unique(name.get('function') for name in names),
+                'NATIONALITY': unique(c.get('countryDescription') for c in children.get('citizenship', [])),
+                'INDIVIDUAL_ALIAS': aliases,
+                'INDIVIDUAL_ADDRESS': addresses,
+                'INDIVIDUAL_DATE_OF_BIRTH': dates,
+                'INDIVIDUAL_PLACE_OF_BIRTH': [p for p in (place_of_birth(b.get('city') or b.get('place'),
+                                                                         b.get('countryDescription'),
+                                                                         b.get('region')) for b in births) if p],
+                'INDIVIDUAL_DOCUMENT': [{'TYPE_OF_DOCUMENT': i.get('identificationTypeDescription'),
+                                         'NUMBER': i.get('number'), 'COUNTRY_OF_ISSUE': i.get('countryDescription'),
+                                         'DATE_OF_ISSUE': i.get('issueDate'), 'NOTE': i.get('remark')}
+                                        for i in children.get('identification', [])]
+            })
+        else:
+            fields['FIRST_NAME'] = primary.get('wholeName')
+            lookups.update({'ENTITY_ALIAS': aliases, 'ENTITY_ADDRESS': addresses})
+        return tag, build_record(tag, fields, lookups)
+
+
+class UKAdapter(SourceAdapter):
+    # OFSI consolidated list (ConList.xml): one FinancialSanctionsTarget row per name, grouped by GroupID. Rows
+    # are collected per group first because a group's rows are not guaranteed to be adjacent.
+    name = 'uk'
+    label = 'UK Consolidated List'
+    url = "https://ofsistorage.blob.core.windows.net/publishlive/2022format/ConList.xml"
+    prefix = 'UK'
+
+    def records(self, path):
+        groups = {}
+        for _, row in iter_elements(path, ('FinancialSanctionsTarget',)):
+            texts = child_texts(row)
+            texts['_digest'] = entry_digest(row)
+            groups.setdefault(texts.get('GroupID'), []).append(texts)
+        for group_id, rows in groups.items():
+            yield self.convert(group_id, rows)
+
+    def convert(self, group_id, rows):
+        primary = next((row for row in rows if (row.get('AliasType') or '').lower() == 'primary name'), rows[0])
+        individual = (primary.get('GroupTypeDescription') or '').lower() == 'individual'
+        tag = 'INDIVIDUAL' if individual else 'ENTITY'
+        version = hashlib.sha1(''.join(sorted(row['_digest'] for row in rows)).encode()).hexdigest()[:16]
+        listed_on = primary.get('DateListed')
+        fields = {
+            'DATAID': self.dataid(group_id),
+            'VERSIONNUM': version,
+            'UN_LIST_TYPE': primary.get('RegimeName'),
+            'REFERENCE_NUMBER': primary.get('UKSanctionsListRef'),
+            'LISTED_ON': parse_date(listed_on.split('T')[0])[2] if listed_on else None,
+            'COMMENTS1': primary.get('OtherInformation')
+        }
+        aliases = [{'QUALITY': 'Good' if (row.get('AliasQuality') or '').lower() in ('good', 'high') else 'Low',
+                    'ALIAS_NAME': join_name(row.get('Name1'), row.get('Name2'), row.get('Name3'), row.get('Name4'),
+                                            row.get('Name5'), row.get('Name6'))}
+                   for row in rows if row is not primary]
+        addresses = unique_dicts({'STREET': join_name(*(row.get(f'Address{i}') for i in range(1, 4))),
+                                  'CITY': join_name(*(row.get(f'Address{i}') for i in range(4, 7))),
+                                  'ZIP_CODE': row.get('PostCode'), 'COUNTRY': row.get('Country')}
+                                 for row in rows if row.get('Address1') or row.get('Country'))
+        lookups = {'LIST_TYPE': [self.label]}
+        if individual:
+            fields.update({'FIRST_NAME': join_name(primary.get('Name1'), primary.get('Name2')),
+                           'SECOND_NAME': join_name(primary.get('Name3'), primary.get('Name4'), primary.get('Name5')),
+                           'THIRD_NAME': primary.get('Name6')})
+            lookups.update({
+                'TITLE': unique(row.get('Title') for row in rows),
+                'DESIGNATION': unique(row.get('Position') for row in rows),
+                'NATIONALITY': unique(row.get('Nationality') for row in rows),
+                'INDIVIDUAL_ALIAS': aliases,
+                'INDIVIDUAL_ADDRESS': addresses,
+                'INDIVIDUAL_DATE_OF_BIRTH': unique_dicts(date_of_birth(row.get('DOB')) for row in rows),
+                'INDIVIDUAL_PLACE_OF_BIRTH': unique_dicts(place_of_birth(row.get('TownOfBirth'),
+                                                                         row.get('CountryOfBirth')) for row in rows),
+                'INDIVIDUAL_DOCUMENT': unique_dicts(
+                    [document('Passport', row.get('PassportDetails')) for row in rows] +
+                    [document('National Identification Number', row.get('NINumber')) for row in rows])
+            })
+        else:
+            fields['FIRST_NAME'] = join_name(*(primary.get(f'Name{i}') for i in range(1, 7)))
+            lookups.update({'ENTITY_ALIAS': aliases, 'ENTITY_ADDRESS': addresses})
+        return tag, build_record(tag, fields, lookups)
+
+
+SOURCE_ADAPTERS = {adapter.name: adapter for adapter in (UNAdapter(), OFACAdapter(), EUAdapter(), UKAdapter())}